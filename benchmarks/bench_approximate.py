@@ -0,0 +1,151 @@
+import sys, time, json, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, timed, percentile
+from serving.approximate import approximate, APPROX_CONFIDENCE_Z, APPROX_SOURCE_TABLE, APPROX_TABLE
+from serving.replicas import shared_pool
+
+RAW_PATH = project_root / "query_scenarios" / "queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_approximate"
+
+# دقیق (ny_taxi_trips) در برابر تقریبی (ny_taxi_trips_sampled SAMPLE p) برای چند نرخ نمونه:
+#   latency: میانه‌ی چند اجرا (بعد از یک اجرای گرم‌کننده)، speedup = exact / approx
+#   دقت: برای هر گروه مشترک و هر ستون تخمینی |approx − exact| / |exact| (میانه، p95، بیشینه)
+#        coverage: سهم گروه‌هایی که exact در بازه‌ی ±z·stderr افتاده (برای 95% باید نزدیک 0.95 باشد)
+#        recall: سهم گروه‌های نتیجه‌ی دقیق که در نتیجه‌ی تقریبی هم هستند (گروه‌های کوچک یا top-k با LIMIT)
+def by_key(cols, rows, key_columns):
+    idx = [cols.index(k) for k in key_columns]
+    return {tuple(r[i] for i in idx): dict(zip(cols, r)) for r in rows}
+
+def accuracy(exact, approx, plan):
+    out = {"groups_exact": len(exact), "groups_approx": len(approx)}
+    common = [k for k in exact if k in approx]
+    out["recall"] = len(common) / len(exact) if exact else None
+    for col in plan.estimate_columns:
+        errs, covered, with_se = [], 0, 0
+        se_col = plan.stderr_columns.get(col)
+        for k in common:
+            e, a = exact[k][col], approx[k][col]
+            if e is None or a is None:
+                continue
+            diff = abs(float(a) - float(e))
+            if e:
+                errs.append(diff / abs(float(e)))
+            if se_col is not None:
+                with_se += 1
+                covered += diff <= APPROX_CONFIDENCE_Z * float(approx[k][se_col]) + 1e-9
+        out[col] = {
+            "rel_error_median": percentile(errs, 0.50),
+            "rel_error_p95": percentile(errs, 0.95),
+            "rel_error_max": max(errs) if errs else None,
+            "coverage": covered / with_se if with_se else None,
+        }
+    return out
+
+def save_figure(report, out_png):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for q in report:
+        rates = [r["sample_rate"] for r in q["rates"] if "error" not in r]
+        ok = [r for r in q["rates"] if "error" not in r]
+        axes[0].plot(rates, [r["speedup"] for r in ok], marker="o", label=f"Q{q['query_no']}")
+        col = ok[0]["columns"][0] if ok else None
+        axes[1].plot(rates, [r["accuracy"][col]["rel_error_median"] or 0.0 for r in ok], marker="o",
+                     label=f"Q{q['query_no']} {col}")
+    axes[0].set_title("Speedup vs exact")
+    axes[1].set_title("Median relative error")
+    axes[1].set_yscale("log")
+    for ax in axes:
+        ax.set_xscale("log")
+        ax.set_xlabel("sample rate")
+        ax.grid(alpha=0.3)
+        ax.legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(out_png, dpi=150)
+    plt.close(fig)
+
+# شکل‌های FROM و بازنویسی مورد انتظار (None: نمونه‌گیری نمی‌شود)؛ --check-rewrites بدون ClickHouse
+REWRITE_CASES = [
+    (f"SELECT sum(fare) AS s FROM {APPROX_SOURCE_TABLE}", f"FROM {APPROX_TABLE} SAMPLE 0.1"),
+    (f"SELECT sum(t.fare) AS s FROM {APPROX_SOURCE_TABLE} AS t WHERE t.x = 1",
+     f"FROM {APPROX_TABLE} AS t SAMPLE 0.1 WHERE"),
+    (f"SELECT sum(fare) AS s FROM nyc.{APPROX_SOURCE_TABLE} GROUP BY k", f"FROM nyc.{APPROX_TABLE} SAMPLE 0.1 GROUP"),
+    (f"SELECT sum(fare) AS s FROM `nyc`.`{APPROX_SOURCE_TABLE}` AS t", f"FROM `nyc`.{APPROX_TABLE} AS t SAMPLE 0.1"),
+    (f"SELECT sum(t.fare) AS s FROM {APPROX_SOURCE_TABLE} t", None),        # alias بدون AS
+    (f"SELECT sum(fare) AS s FROM {APPROX_SOURCE_TABLE}, zones", None),
+    (f"SELECT sum(fare) AS s FROM {APPROX_SOURCE_TABLE} ARRAY JOIN arr", None),
+    (f"SELECT sum(fare) AS s FROM other.{APPROX_SOURCE_TABLE}_x", None),
+    (f"SELECT sum(fare) AS s FROM {APPROX_SOURCE_TABLE} AS", None),
+]
+
+def check_rewrites() -> int:
+    failed = 0
+    for sql, expected in REWRITE_CASES:
+        plan = approximate(sql, 0.1)
+        got = plan.sql if plan is not None and plan.sample_rate is not None else None
+        ok = got is None if expected is None else got is not None and expected in got
+        failed += not ok
+        print(f"[approx] {'ok  ' if ok else 'FAIL'} {sql} → {got}")
+    print(f"[approx] {len(REWRITE_CASES) - failed}/{len(REWRITE_CASES)} rewrite cases ok")
+    return 1 if failed else 0
+
+def main():
+    p = argparse.ArgumentParser(description="Latency/accuracy of approximate (SAMPLE) execution vs exact.")
+    p.add_argument("--queries", type=int, nargs="+", default=[3, 5, 7, 9], help="1-based indexes in queries.sql")
+    p.add_argument("--rates", type=float, nargs="+", default=[0.01, 0.05, 0.1, 0.25])
+    p.add_argument("--repetitions", type=int, default=5)
+    p.add_argument("--check-rewrites", action="store_true", help="Only check the FROM rewrite cases and exit")
+    args = p.parse_args()
+    if args.check_rewrites:
+        sys.exit(check_rewrites())
+
+    queries = load_queries(RAW_PATH)
+    report = []
+    with shared_pool().connection() as client:
+        for n in args.queries:
+            sql = queries[n - 1]
+            probe = approximate(sql, args.rates[0])
+            if probe is None or probe.sample_rate is None:
+                print(f"[approx] Q{n} is not eligible for sampling; skipped")
+                continue
+            exact_s, cols, rows = timed(client, sql, args.repetitions)
+            exact = by_key(cols, rows, probe.key_columns)
+            print(f"[approx] Q{n} exact {exact_s*1000:.1f}ms ({len(rows)} groups)")
+            entry = {"query_no": n, "query": sql, "exact_latency_sec": exact_s, "rates": []}
+            for rate in args.rates:
+                plan = approximate(sql, rate)
+                row = {"sample_rate": rate, "sql": plan.sql, "columns": plan.estimate_columns}
+                try:
+                    approx_s, a_cols, a_rows = timed(client, plan.sql, args.repetitions)
+                except Exception as e:
+                    row["error"] = str(e)
+                    print(f"[approx] Q{n} p={rate} error: {e}")
+                    entry["rates"].append(row)
+                    continue
+                row.update(latency_sec=approx_s, speedup=exact_s / approx_s if approx_s > 0 else None,
+                           accuracy=accuracy(exact, by_key(a_cols, a_rows, plan.key_columns), plan))
+                acc = row["accuracy"][plan.estimate_columns[0]]
+                print(f"[approx] Q{n} p={rate:<5g} {approx_s*1000:8.1f}ms x{row['speedup']:.1f} "
+                      f"err p50={acc['rel_error_median']} p95={acc['rel_error_p95']} "
+                      f"coverage={acc['coverage']} recall={row['accuracy']['recall']}")
+                entry["rates"].append(row)
+            report.append(entry)
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    out = RESULTS_DIR / f"{stamp}.json"
+    out.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+    if report:
+        png = RESULTS_DIR / f"{stamp}.png"
+        save_figure(report, png)
+        print(f"🖼️ saved figure: {png}")
+
+if __name__ == "__main__":
+    main()
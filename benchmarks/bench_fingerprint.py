@@ -0,0 +1,38 @@
+import sys, time, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from query_scenarios import sql_fingerprint
+from query_scenarios.sql_fingerprint import fingerprint
+from benchmarks.common import load_queries
+
+QUERY_FILES = [
+    project_root / "query_scenarios" / "queries.sql",
+    project_root / "optimizations" / "optimized_queries.sql",
+]
+
+def _per_query_us(fn, queries, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - t0) / (rounds * len(queries)) * 1e6
+
+def main():
+    p = argparse.ArgumentParser(description="Fingerprint cost per query (cold = no LRU, warm = LRU hit).")
+    p.add_argument("--rounds", type=int, default=2000)
+    args = p.parse_args()
+
+    queries = [q for f in QUERY_FILES for q in load_queries(f)]
+    cold = _per_query_us(lambda q: sql_fingerprint._canonical_tokens.__wrapped__(q), queries, args.rounds)
+    warm = _per_query_us(fingerprint, queries, args.rounds)
+    distinct = len({fingerprint(q) for q in queries})
+
+    print(f"queries: {len(queries)}  distinct fingerprints: {distinct}")
+    print(f"cold canonicalization: {cold:.2f} µs/query")
+    print(f"warm fingerprint:      {warm:.3f} µs/query")
+
+if __name__ == "__main__":
+    main()
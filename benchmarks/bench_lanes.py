@@ -0,0 +1,92 @@
+import sys, time, json, asyncio, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, percentile
+from serving.protocol import AsyncProtocolClient
+
+RAW_PATH = project_root / "query_scenarios" / "queries.sql"
+OPT_PATH = project_root / "optimizations" / "optimized_queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_lanes"
+
+# بار سنگین پشت سر هم (مثلاً Q6 خام) + probe ارزان (Q1 روی MV)؛ latency ی probe را می‌سنجیم
+async def heavy_loop(host, port, sql, stop_at):
+    client = await AsyncProtocolClient.connect(host, port)
+    done = 0
+    try:
+        while time.perf_counter() < stop_at:
+            try:
+                await client.query(sql, priority=1)
+            except Exception:
+                pass
+            done += 1
+    finally:
+        await client.close()
+    return done
+
+async def probe_loop(host, port, sql, stop_at, interval_s):
+    client = await AsyncProtocolClient.connect(host, port)
+    lats = []
+    try:
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            await client.query(sql, priority=1)
+            lats.append(time.perf_counter() - t0)
+            await asyncio.sleep(interval_s)
+    finally:
+        await client.close()
+    return lats
+
+async def run_target(host, port, heavy_sql, cheap_sql, heavy_clients, duration_s, interval_s):
+    # یک بار گرم کردن تا تخمین هزینه (EXPLAIN/تاریخچه) در اندازه‌گیری نیاید
+    warm = await AsyncProtocolClient.connect(host, port)
+    await warm.query(cheap_sql)
+    await warm.close()
+
+    stop_at = time.perf_counter() + duration_s
+    heavy = [heavy_loop(host, port, heavy_sql, stop_at) for _ in range(heavy_clients)]
+    results = await asyncio.gather(probe_loop(host, port, cheap_sql, stop_at, interval_s), *heavy)
+    lats = sorted(results[0])
+    return {
+        "heavy_clients": heavy_clients,
+        "heavy_completed": sum(results[1:]),
+        "probes": len(lats),
+        "probe_p50_latency_sec": percentile(lats, 0.50, default=0.0),
+        "probe_p99_latency_sec": percentile(lats, 0.99, default=0.0),
+        "probe_max_latency_sec": lats[-1] if lats else 0.0,
+    }
+
+def main():
+    p = argparse.ArgumentParser(description="Cheap-query latency under heavy load (lanes on vs off).")
+    p.add_argument("--targets", nargs="+", default=["lanes=localhost:9001"],
+                   help="label=host:port (مثلاً lanes=localhost:9001 single=localhost:9002 با LANES_ENABLED=0)")
+    p.add_argument("--heavy-query", type=int, default=6, help="1-based index in queries.sql")
+    p.add_argument("--cheap-query", type=int, default=1, help="1-based index in optimized_queries.sql")
+    p.add_argument("--heavy-clients", type=int, default=20)
+    p.add_argument("--duration", type=float, default=60.0)
+    p.add_argument("--probe-interval", type=float, default=0.2)
+    args = p.parse_args()
+
+    heavy_sql = load_queries(RAW_PATH)[args.heavy_query - 1]
+    cheap_sql = load_queries(OPT_PATH)[args.cheap_query - 1]
+
+    report = []
+    for target in args.targets:
+        label, addr = target.split("=", 1)
+        host, port = addr.rsplit(":", 1)
+        row = asyncio.run(run_target(host, int(port), heavy_sql, cheap_sql, args.heavy_clients,
+                                     args.duration, args.probe_interval))
+        row["target"] = label
+        report.append(row)
+        print(f"[{label}] heavy={row['heavy_completed']} probes={row['probes']} "
+              f"p50={row['probe_p50_latency_sec']*1000:.1f}ms p99={row['probe_p99_latency_sec']*1000:.1f}ms")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+
+if __name__ == "__main__":
+    main()
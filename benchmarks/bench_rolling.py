@@ -0,0 +1,137 @@
+import sys, time, json, argparse
+from datetime import date, timedelta
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, timed
+from data_ingestion.derived_tables import create_rolling_table, refresh_rolling, rolling_window_sql
+from serving.replicas import shared_pool
+
+RAW_PATH = project_root / "query_scenarios" / "queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_rolling"
+START_DAY = date(2015, 1, 1)
+
+# Q6 روی داده‌ی مصنوعی 1 و 10 ساله در یک database جدا (جدول‌های اصلی دست نمی‌خورند):
+#   raw           queries.sql Q6: دو بار تجمیع جدول سفرها + self-join با BETWEEN
+#   mv_self_join  نسخه‌ی قبلی optimized: self-join روی MV روزانه — O(days²)
+#   window        window function روی MV روزانه — O(days)
+#   rolling_table جدول نگه‌داری‌شده (derived_tables.py) — فقط خواندن
+# و هزینه‌ی نگه‌داری: بازمحاسبه برای یک روز، یک ماه (یک فایل parquet) و کل بازه.
+MV_SELF_JOIN = """
+SELECT current_day.trip_day,
+       avg(past.trip_count) AS rolling_avg_trip_count
+    FROM {daily} AS current_day
+    JOIN {daily} AS past
+        ON past.trip_day BETWEEN current_day.trip_day - INTERVAL 6 DAY AND current_day.trip_day
+    GROUP BY current_day.trip_day
+    ORDER BY current_day.trip_day
+"""
+
+def load_synthetic(client, db, days, trips_per_day):
+    trips, daily = f"{db}.trips", f"{db}.daily"
+    client.command(f"DROP DATABASE IF EXISTS {db}")
+    client.command(f"CREATE DATABASE {db}")
+    client.command(f"""
+        CREATE TABLE {trips} (tpep_pickup_datetime DateTime, trip_distance Float64)
+        ENGINE = MergeTree PARTITION BY toYYYYMM(tpep_pickup_datetime) ORDER BY tpep_pickup_datetime
+    """)
+    # 60%..100% از trips_per_day برای هر روز (deterministic)، پخش یکنواخت در طول روز
+    client.command(f"""
+        INSERT INTO {trips}
+        SELECT toDateTime('{START_DAY}') + toIntervalSecond(intDiv(number, {trips_per_day}) * 86400
+                   + (number % {trips_per_day}) * intDiv(86400, {trips_per_day})),
+               (number % 97) / 10
+        FROM numbers({days * trips_per_day})
+        WHERE (number % {trips_per_day}) * 10 < {trips_per_day} * (6 + cityHash64(intDiv(number, {trips_per_day})) % 5)
+    """)
+    client.command(f"""
+        CREATE TABLE {daily} (trip_day Date, trip_count UInt64)
+        ENGINE = SummingMergeTree PARTITION BY toYYYYMM(trip_day) ORDER BY trip_day
+    """)
+    client.command(f"INSERT INTO {daily} SELECT toDate(tpep_pickup_datetime), count() FROM {trips} GROUP BY 1")
+    # self-join روی MV ردیف‌های ادغام‌نشده را جمع نمی‌کند؛ برای مقایسه‌ی منصفانه یک بار ادغام
+    client.command(f"OPTIMIZE TABLE {daily} FINAL")
+    return trips, daily
+
+def as_series(rows):
+    return {r[0]: float(r[1]) for r in rows}
+
+def matches(a, b, tol=1e-9):
+    return a.keys() == b.keys() and all(abs(a[k] - b[k]) <= tol * max(1.0, abs(b[k])) for k in b)
+
+def bench_scale(client, db, years, trips_per_day, repetitions, skip_raw_above):
+    days = int(years * 365)
+    t0 = time.perf_counter()
+    trips, daily = load_synthetic(client, db, days, trips_per_day)
+    rolling = f"{db}.trip_counts_rolling_7d"
+    create_rolling_table(client, rolling)
+    load_s = time.perf_counter() - t0
+
+    maintenance = {}
+    t0 = time.perf_counter()
+    refresh_rolling(client, None, source=daily, table=rolling)
+    maintenance["full_rebuild_sec"] = time.perf_counter() - t0
+    last = START_DAY + timedelta(days=days - 1)
+    for label, touched in (("one_day_sec", [last]),
+                           ("one_month_sec", [last - timedelta(days=i) for i in range(31)])):
+        t0 = time.perf_counter()
+        refresh_rolling(client, touched, source=daily, table=rolling)
+        maintenance[label] = time.perf_counter() - t0
+
+    variants = {
+        "raw": load_queries(RAW_PATH)[5].strip().rstrip(";").replace("ny_taxi_trips", trips),
+        "mv_self_join": MV_SELF_JOIN.format(daily=daily),
+        "window": rolling_window_sql(daily),
+        "rolling_table": f"SELECT trip_day, rolling_avg_trip_count FROM {rolling} FINAL ORDER BY trip_day",
+    }
+    out = {"years": years, "days": days, "trips_per_day": trips_per_day, "load_sec": load_s,
+           "maintenance": maintenance, "variants": {}}
+    series = {}
+    for name, sql in variants.items():
+        if name == "raw" and years > skip_raw_above:
+            out["variants"][name] = {"skipped": f"years > {skip_raw_above}"}
+            continue
+        try:
+            latency, _, rows = timed(client, sql, repetitions)
+        except Exception as e:
+            out["variants"][name] = {"error": str(e)}
+            print(f"[rolling] {years}y {name}: error {e}")
+            continue
+        series[name] = as_series(rows)
+        out["variants"][name] = {"latency_sec": latency, "rows": len(rows)}
+        print(f"[rolling] {years}y {name:<14} {latency*1000:9.1f}ms ({len(rows)} days)")
+    reference = series.get("raw") or series.get("mv_self_join")
+    for name, s in series.items():
+        out["variants"][name]["matches_reference"] = matches(s, reference) if reference is not None else None
+    print(f"[rolling] {years}y maintenance: " + ", ".join(f"{k}={v*1000:.1f}ms" for k, v in maintenance.items()))
+    return out
+
+def main():
+    p = argparse.ArgumentParser(description="Q6 rolling average: raw / MV self-join / window / maintained table.")
+    p.add_argument("--years", type=float, nargs="+", default=[1, 10])
+    p.add_argument("--trips-per-day", type=int, default=2000)
+    p.add_argument("--repetitions", type=int, default=5)
+    p.add_argument("--skip-raw-above", type=float, default=100.0, help="skip the raw variant above this many years")
+    p.add_argument("--database", default="bench_rolling")
+    p.add_argument("--keep", action="store_true", help="keep the synthetic database")
+    args = p.parse_args()
+
+    report = []
+    with shared_pool().connection() as client:
+        try:
+            for years in args.years:
+                report.append(bench_scale(client, args.database, years, args.trips_per_day,
+                                          args.repetitions, args.skip_raw_above))
+        finally:
+            if not args.keep:
+                client.command(f"DROP DATABASE IF EXISTS {args.database}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import sys, time, random, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from serving.scheduler import FairScheduler
+
+# الگوریتم قبلی server2.dispatcher: اسکن کامل لیست و list.pop(best_idx)
+def legacy_pop(task_queue: list, now: float):
+    scored = [(priority * (now - ts), idx) for idx, (_, _, priority, ts, _) in enumerate(task_queue)]
+    _, best_idx = max(scored)
+    return task_queue.pop(best_idx)
+
+def make_tasks(n: int, clients: int, seed: int = 7):
+    rnd = random.Random(seed)
+    base = time.time() - 60.0
+    return [(None, f"c{rnd.randrange(clients)}", rnd.randint(1, 9), base + rnd.random() * 60.0, "SELECT 1")
+            for _ in range(n)]
+
+def bench_legacy(tasks, pops: int) -> float:
+    q = list(tasks)
+    now = time.time()
+    t0 = time.perf_counter()
+    for _ in range(pops):
+        legacy_pop(q, now)
+    return (time.perf_counter() - t0) / pops * 1e6
+
+def bench_fair(tasks, pops: int) -> float:
+    s = FairScheduler()
+    for t in tasks:
+        s.push(t, t[1], t[2], t[3])
+    now = time.time()
+    t0 = time.perf_counter()
+    for _ in range(pops):
+        s.pop(now)
+    return (time.perf_counter() - t0) / pops * 1e6
+
+def main():
+    p = argparse.ArgumentParser(description="Dequeue cost: legacy list scan vs heap/fair scheduler.")
+    p.add_argument("--depths", default="10000,50000,100000")
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--legacy-pops", type=int, default=200, help="Legacy is O(n) per pop; sample a few")
+    args = p.parse_args()
+
+    print(f"{'depth':>8} {'legacy µs/pop':>15} {'fair µs/pop':>13} {'speedup':>9}")
+    for depth in [int(x) for x in args.depths.split(",")]:
+        tasks = make_tasks(depth, args.clients)
+        legacy = bench_legacy(tasks, min(args.legacy_pops, depth))
+        fair = bench_fair(tasks, depth)  # تخلیه‌ی کامل صف
+        print(f"{depth:>8} {legacy:>15.1f} {fair:>13.2f} {legacy / fair:>8.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import sys, time, json, random, asyncio, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, percentile
+from serving.protocol import AsyncProtocolClient
+
+QUERY_PATH = project_root / "optimizations" / "optimized_queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_servers"
+
+# هر کلاینت: اتصال، مدتی بیکار، یک کوئری، انتظار برای پاسخ
+async def one_client(host, port, query, idle_s, timeout_s):
+    client = await asyncio.wait_for(AsyncProtocolClient.connect(host, port), timeout=timeout_s)
+    try:
+        await asyncio.sleep(idle_s)
+        t0 = time.perf_counter()
+        await asyncio.wait_for(client.query(query, priority=random.randint(1, 9)), timeout=timeout_s)
+        return time.perf_counter() - t0
+    finally:
+        await client.close()
+
+def _server_stats(pid):
+    if pid is None:
+        return {}
+    import psutil
+    p = psutil.Process(pid)
+    return {"server_threads": p.num_threads(), "server_rss_mb": p.memory_info().rss / (1024 ** 2)}
+
+async def run_level(host, port, n_clients, queries, idle_s, timeout_s, server_pid):
+    tasks = [one_client(host, port, random.choice(queries), idle_s * random.uniform(0.5, 1.5), timeout_s)
+             for _ in range(n_clients)]
+    t0 = time.perf_counter()
+    gathered = asyncio.gather(*tasks, return_exceptions=True)
+    # نمونه‌برداری از سرور وقتی همه‌ی اتصال‌ها باز و بیکارند
+    await asyncio.sleep(idle_s * 0.5)
+    peak = _server_stats(server_pid)
+    outcomes = await gathered
+    wall = time.perf_counter() - t0
+
+    lats = sorted(o for o in outcomes if isinstance(o, float))
+    errors = [o for o in outcomes if not isinstance(o, float)]
+    return {
+        "clients": n_clients,
+        "ok": len(lats),
+        "errors": len(errors),
+        "first_error": repr(errors[0]) if errors else None,
+        "wall_sec": wall,
+        "p50_latency_sec": percentile(lats, 0.50, default=0.0),
+        "p99_latency_sec": percentile(lats, 0.99, default=0.0),
+        "max_latency_sec": lats[-1] if lats else 0.0,
+        "completed_per_sec": len(lats) / wall if wall > 0 else 0.0,
+        **peak,
+    }
+
+def main():
+    p = argparse.ArgumentParser(description="Compare threaded vs asyncio server2 under N mostly-idle clients.")
+    p.add_argument("--targets", nargs="+", default=["threaded=localhost:9001"],
+                   help="label=host:port (مثلاً threaded=localhost:9001 asyncio=localhost:9002)")
+    p.add_argument("--clients", default="10,100,1000")
+    p.add_argument("--idle", type=float, default=2.0, help="Seconds each client stays idle before its query")
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--server-pid", type=int, nargs="*", default=None,
+                   help="PID per target (same order) to sample server threads/RSS")
+    p.add_argument("--queries", default=str(QUERY_PATH))
+    args = p.parse_args()
+
+    queries = load_queries(Path(args.queries))
+    levels = [int(x) for x in args.clients.split(",")]
+    pids = args.server_pid or [None] * len(args.targets)
+
+    report = []
+    for target, pid in zip(args.targets, pids):
+        label, addr = target.split("=", 1)
+        host, port = addr.rsplit(":", 1)
+        for n in levels:
+            row = asyncio.run(run_level(host, int(port), n, queries, args.idle, args.timeout, pid))
+            row["target"] = label
+            report.append(row)
+            print(f"[{label}] clients={n:5d} ok={row['ok']:5d} err={row['errors']:4d} "
+                  f"p50={row['p50_latency_sec']*1000:9.1f}ms p99={row['p99_latency_sec']*1000:9.1f}ms "
+                  f"threads={row.get('server_threads', '-')}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys, time, json, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, timed
+from data_ingestion.derived_tables import THRESHOLD_TABLE, threshold_sql
+from serving.replicas import shared_pool
+
+RAW_PATH = project_root / "query_scenarios" / "queries.sql"
+OPT_PATH = project_root / "optimizations" / "optimized_queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_thresholds"
+
+# Q10 در سه نسخه روی داده‌ی واقعی:
+#   raw              queries.sql: دو تجمیع روی جدول سفرها + join
+#   mv_cte           نسخه‌ی قبلی optimized: quantile روی mv_trip_stats_daily در هر اجرا
+#   threshold_table  optimized_queries.sql: join با آستانه‌های نگه‌داری‌شده (derived_tables.py)
+# بررسی: نتیجه‌ی هر نسخه (به‌صورت multiset، چون ترتیب vendor های هم‌تعداد آزاد است) باید با raw یکی باشد،
+# و آستانه‌ی هر روز در جدول با محاسبه‌ی دوباره از MV (روزهای stale = ingestion بدون refresh). خروج با 1 اگر نه.
+MV_CTE = """
+WITH thresholds AS (
+    SELECT trip_day, quantile(0.95)(trip_count) AS p95_count
+    FROM mv_trip_stats_daily
+    GROUP BY trip_day
+)
+SELECT d.vendor_id, d.trip_day, d.trip_count
+    FROM mv_trip_stats_daily d
+    JOIN thresholds t ON d.trip_day = t.trip_day
+    WHERE d.trip_count > t.p95_count
+    ORDER BY d.trip_day, d.trip_count DESC
+"""
+
+def stale_days(client):
+    fresh = {r[0]: float(r[1]) for r in client.query(threshold_sql()).result_rows}
+    stored = {r[0]: float(r[1]) for r in
+              client.query(f"SELECT trip_day, p95_count FROM {THRESHOLD_TABLE} FINAL").result_rows}
+    return sorted(d for d in fresh.keys() | stored.keys() if fresh.get(d) != stored.get(d))
+
+def main():
+    p = argparse.ArgumentParser(description="Query 10: raw vs MV quantile vs maintained threshold table.")
+    p.add_argument("--repetitions", type=int, default=5)
+    args = p.parse_args()
+
+    variants = {
+        "raw": load_queries(RAW_PATH)[9],
+        "mv_cte": MV_CTE,
+        "threshold_table": load_queries(OPT_PATH)[9],
+    }
+    report = {"variants": {}}
+    results = {}
+    with shared_pool().connection() as client:
+        for name, sql in variants.items():
+            latency, _, rows = timed(client, sql.strip().rstrip(";"), args.repetitions)
+            results[name] = sorted(tuple(r) for r in rows)
+            report["variants"][name] = {"latency_sec": latency, "rows": len(rows)}
+            print(f"[q10] {name:<16} {latency*1000:9.1f}ms ({len(rows)} rows)")
+        stale = stale_days(client)
+
+    ok = True
+    for name, rows in results.items():
+        same = rows == results["raw"]
+        report["variants"][name]["identical_to_raw"] = same
+        if not same:
+            # mv_cte روی ردیف‌های ادغام‌نشده‌ی SummingMergeTree می‌تواند متفاوت باشد؛ فقط گزارش
+            extra = sorted(set(rows) - set(results["raw"]))[:5]
+            missing = sorted(set(results["raw"]) - set(rows))[:5]
+            print(f"[q10] {name} differs from raw: extra={extra} missing={missing}")
+            ok = ok and name != "threshold_table"
+    report["stale_threshold_days"] = [str(d) for d in stale]
+    if stale:
+        print(f"[q10] {len(stale)} days in {THRESHOLD_TABLE} are stale (e.g. {stale[:3]})")
+        ok = False
+    base = report["variants"]["raw"]["latency_sec"]
+    for v in report["variants"].values():
+        v["speedup_vs_raw"] = base / v["latency_sec"] if v["latency_sec"] > 0 else None
+    report["verified"] = ok
+    print(f"[q10] threshold_table identical to raw: {report['variants']['threshold_table']['identical_to_raw']}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import sys, time, json, math, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries, timed
+from serving.replicas import shared_pool
+
+ZONE_PATH = project_root / "optimizations" / "zone_queries.sql"
+RESULTS_DIR = project_root / "results" / "bench_zones"
+
+# هر کوئری zone_queries.sql (dictGet روی taxi_zone_dict) در برابر همان کوئری با LEFT JOIN روی taxi_zones،
+# به همان ترتیب فایل. latency = میانه‌ی چند اجرا؛ نتیجه‌ها باید یکی باشند (جمع float با تلورانس نسبی).
+JOIN_QUERIES = {
+    "3z": """
+SELECT t.pulocation_id, z.zone AS pickup_zone, z.borough AS pickup_borough, sum(t.trip_distance) AS total_distance
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS z ON z.location_id = t.pulocation_id
+    GROUP BY t.pulocation_id, pickup_zone, pickup_borough
+    ORDER BY total_distance DESC
+""",
+    "3b": """
+SELECT z.borough AS pickup_borough, sum(t.trip_distance) AS total_distance
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS z ON z.location_id = t.pulocation_id
+    GROUP BY pickup_borough
+    ORDER BY total_distance DESC
+""",
+    "5b": """
+SELECT z.borough AS dropoff_borough, toYYYYMM(t.tpep_pickup_datetime) AS month, sum(t.total_amount) AS monthly_income
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS z ON z.location_id = t.dolocation_id
+    GROUP BY dropoff_borough, month
+    ORDER BY month, monthly_income DESC
+""",
+    "7z": """
+SELECT t.pulocation_id, t.dolocation_id, pz.zone AS pickup_zone, dz.zone AS dropoff_zone,
+       sum(t.total_amount) AS total_income
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS pz ON pz.location_id = t.pulocation_id
+    LEFT JOIN taxi_zones AS dz ON dz.location_id = t.dolocation_id
+    GROUP BY t.pulocation_id, t.dolocation_id, pickup_zone, dropoff_zone
+    ORDER BY total_income DESC
+    LIMIT 10
+""",
+    "7b": """
+SELECT pz.borough AS pickup_borough, dz.borough AS dropoff_borough, count() AS trips,
+       sum(t.total_amount) AS total_income
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS pz ON pz.location_id = t.pulocation_id
+    LEFT JOIN taxi_zones AS dz ON dz.location_id = t.dolocation_id
+    GROUP BY pickup_borough, dropoff_borough
+    ORDER BY total_income DESC
+""",
+    "9z": """
+SELECT t.dolocation_id, z.zone AS dropoff_zone, z.borough AS dropoff_borough,
+       avg(t.tip_amount / t.total_amount) * 100 AS avg_tip_percent
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS z ON z.location_id = t.dolocation_id
+    GROUP BY t.dolocation_id, dropoff_zone, dropoff_borough
+    ORDER BY avg_tip_percent DESC
+""",
+    "9b": """
+SELECT z.borough AS dropoff_borough, avg(t.tip_amount / t.total_amount) * 100 AS avg_tip_percent
+    FROM ny_taxi_trips AS t
+    LEFT JOIN taxi_zones AS z ON z.location_id = t.dolocation_id
+    GROUP BY dropoff_borough
+    ORDER BY avg_tip_percent DESC
+""",
+}
+
+def _sort_key(row):
+    return tuple(round(v, 2) if isinstance(v, float) else str(v) for v in row)
+
+def same_rows(a, b, rel=1e-9):
+    if len(a) != len(b):
+        return False
+    for ra, rb in zip(sorted(a, key=_sort_key), sorted(b, key=_sort_key)):
+        for va, vb in zip(ra, rb):
+            if isinstance(va, float) or isinstance(vb, float):
+                if not math.isclose(float(va), float(vb), rel_tol=rel, abs_tol=1e-9):
+                    return False
+            elif str(va) != str(vb):
+                return False
+    return True
+
+def main():
+    p = argparse.ArgumentParser(description="Zone enrichment: dictGet (FLAT dictionary) vs JOIN on taxi_zones.")
+    p.add_argument("--repetitions", type=int, default=5)
+    args = p.parse_args()
+
+    dict_queries = load_queries(ZONE_PATH)
+    if len(dict_queries) != len(JOIN_QUERIES):
+        raise SystemExit(f"{ZONE_PATH.name} has {len(dict_queries)} queries, expected {len(JOIN_QUERIES)}")
+    report = []
+    with shared_pool().connection() as client:
+        for (name, join_sql), dict_sql in zip(JOIN_QUERIES.items(), dict_queries):
+            d_lat, _, d_rows = timed(client, dict_sql.strip().rstrip(";"), args.repetitions)
+            j_lat, _, j_rows = timed(client, join_sql, args.repetitions)
+            row = {
+                "query": name,
+                "dict_latency_sec": d_lat,
+                "join_latency_sec": j_lat,
+                "speedup": j_lat / d_lat if d_lat > 0 else None,
+                "rows": len(d_rows),
+                "identical": same_rows(d_rows, j_rows),
+            }
+            report.append(row)
+            print(f"[zones] Q{name:<3} dictGet {d_lat*1000:8.1f}ms  JOIN {j_lat*1000:8.1f}ms  "
+                  f"x{row['speedup']:.2f}  rows={row['rows']} identical={row['identical']}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import statistics
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+# ---------------- Shared benchmark helpers ----------------
+# خواندن فایل‌های کوئری، اجرای زمان‌دار روی یک کلاینت ClickHouse و صدک ساده؛
+# اسکریپت‌های benchmarks/ و ابزارهای query_scenarios همه از همین‌جا import می‌کنند.
+
+
+def load_queries(path: Path) -> List[str]:
+    """Queries of a ``.sql`` file: blocks separated by a blank line, ``--`` comment lines dropped."""
+    text = Path(path).read_text(encoding="utf-8")
+    queries = []
+    for chunk in text.split("\n\n"):
+        lines = [ln for ln in chunk.strip().splitlines() if ln.strip() and not ln.strip().startswith("--")]
+        if lines:
+            queries.append("\n".join(lines))
+    return queries
+
+
+def run(client, sql: str):
+    """``(latency_s, column_names, rows)`` of one ``client.query``."""
+    t0 = time.perf_counter()
+    res = client.query(sql)
+    return time.perf_counter() - t0, res.column_names, res.result_rows
+
+
+def timed(client, sql: str, repetitions: int):
+    """Median latency of *repetitions* runs after one warm-up, plus the last result."""
+    run(client, sql)  # گرم کردن (mark cache، page cache)
+    lats = []
+    for _ in range(repetitions):
+        latency, cols, rows = run(client, sql)
+        lats.append(latency)
+    return statistics.median(lats), cols, rows
+
+
+def percentile(values: Sequence[float], q: float, default: Optional[float] = None) -> Optional[float]:
+    """Nearest-rank percentile (``q`` in [0, 1]); *default* for an empty input."""
+    if not values:
+        return default
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
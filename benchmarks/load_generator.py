@@ -0,0 +1,300 @@
+import sys, time, json, math, random, asyncio, argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.common import load_queries
+from query_scenarios.latency_histogram import LatencyHistogram
+from serving.protocol import AsyncProtocolClient, QueryError
+
+QUERY_PATH = project_root / "optimizations" / "optimized_queries.sql"
+RESULTS_DIR = project_root / "results" / "load_generator"
+
+# ---------------- Open-loop load generator ----------------
+# برخلاف clients_simulations (هر کلاینت یک کوئری و منتظر پاسخ = closed loop) زمان ارسال هر درخواست
+# از قبل از روی فرایند ورود (Poisson یا ثابت) تعیین می‌شود و به کند شدن سرور بستگی ندارد.
+# برای هر درخواست سه زمان ثبت می‌شود:
+#   intended: لحظه‌ای که طبق برنامه باید فرستاده می‌شد
+#   actual:   لحظه‌ای که واقعاً فرستاده شد (اگر همه‌ی کلاینت‌های مجازی مشغول بودند، دیرتر)
+#   end:      رسیدن پاسخ
+# corrected = end - intended (اصلاح coordinated omission)، service = end - actual.
+# وقتی سرور اشباع می‌شود service تقریباً ثابت می‌ماند ولی corrected بالا می‌رود.
+
+
+def parse_mix(spec: str, n_queries: int):
+    """``"1=5,3=2"`` (1-based query numbers) → weights; unlisted queries get 0. Empty = uniform."""
+    if not spec:
+        return [1.0] * n_queries
+    weights = [0.0] * n_queries
+    for part in spec.split(","):
+        idx, w = part.split("=")
+        if not 1 <= int(idx) <= n_queries:
+            raise ValueError(f"query {idx} not in 1..{n_queries}")
+        weights[int(idx) - 1] = float(w)
+    if not any(weights):
+        raise ValueError("query mix has no positive weight")
+    return weights
+
+
+def rate_at(t: float, rate: float, profile: str, ramp_s: float) -> float:
+    # نرخ هدف در ثانیه‌ی t از شروع سطح؛ linear و step در ramp_s به rate می‌رسند
+    if profile == "constant" or ramp_s <= 0 or t >= ramp_s:
+        return rate
+    if profile == "linear":
+        return rate * max(0.05, t / ramp_s)
+    if profile == "step":
+        return rate * math.ceil(4 * t / ramp_s + 1e-9) / 4  # چهار پله‌ی 25%
+    raise ValueError(f"unknown ramp profile {profile}")
+
+
+def arrival_times(rate: float, duration_s: float, arrival: str, profile: str, ramp_s: float, rng: random.Random):
+    """Intended send offsets (seconds from level start)."""
+    out, t = [], 0.0
+    while True:
+        if arrival == "poisson":
+            # thinning: نامزدها با نرخ بیشینه، پذیرش با احتمال rate(t)/rate
+            t += rng.expovariate(rate)
+            if t >= duration_s:
+                return out
+            if rng.random() * rate <= rate_at(t, rate, profile, ramp_s):
+                out.append(t)
+        elif arrival == "constant":
+            t += 1.0 / rate_at(t, rate, profile, ramp_s)
+            if t >= duration_s:
+                return out
+            out.append(t)
+        else:
+            raise ValueError(f"unknown arrival process {arrival}")
+
+
+class VirtualClients:
+    """At most ``n`` connections; a request waits for a free one (this wait is the start delay)."""
+
+    def __init__(self, host: str, port: int, n: int, timeout_s: float):
+        self.host, self.port, self.timeout_s = host, port, timeout_s
+        self._free: asyncio.Queue = asyncio.Queue()
+        self._sem = asyncio.Semaphore(n)
+        self._all = []
+
+    async def acquire(self) -> AsyncProtocolClient:
+        await self._sem.acquire()
+        try:
+            if not self._free.empty():
+                return self._free.get_nowait()
+            # اتصال‌ها تنبل باز می‌شوند و بین درخواست‌ها می‌مانند
+            client = await asyncio.wait_for(AsyncProtocolClient.connect(self.host, self.port), self.timeout_s)
+            self._all.append(client)
+            return client
+        except BaseException:
+            self._sem.release()
+            raise
+
+    def release(self, client: AsyncProtocolClient, broken: bool = False):
+        if broken:
+            self._all.remove(client)
+            asyncio.ensure_future(client.close())
+        else:
+            self._free.put_nowait(client)
+        self._sem.release()
+
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self._all), return_exceptions=True)
+
+
+class LevelStats:
+    def __init__(self, ramp_s: float):
+        self.ramp_s = ramp_s
+        self.sent = self.ok = self.errors = self.timeouts = 0
+        self.first_error = None
+        # فقط بعد از ramp (حالت پایدار) در هیستوگرام‌ها
+        self.corrected = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.start_delay = LatencyHistogram()
+        self.per_query = {}
+        self.client_latencies = []  # برای پیام maintenance (service latency، مثل clients_simulations)
+        self.last_end = 0.0
+
+    def record(self, qnum: int, intended: float, actual: float, end: float, offset: float):
+        self.ok += 1
+        self.client_latencies.append(end - actual)
+        if offset < self.ramp_s:
+            return
+        self.last_end = max(self.last_end, end)
+        self.corrected.record(end - intended)
+        self.service.record(end - actual)
+        self.start_delay.record(actual - intended)
+        self.per_query.setdefault(qnum, LatencyHistogram()).record(end - intended)
+
+
+async def one_request(pool: VirtualClients, stats: LevelStats, qnum: int, sql: str, priority: int,
+                      intended: float, offset: float, timeout_s: float):
+    stats.sent += 1
+    try:
+        client = await asyncio.wait_for(pool.acquire(), timeout_s)
+    except Exception as e:
+        stats.errors += 1
+        stats.timeouts += isinstance(e, asyncio.TimeoutError)
+        stats.first_error = stats.first_error or repr(e)
+        return
+    broken = False
+    actual = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.query(sql, priority=priority), timeout_s)
+        stats.record(qnum, intended, actual, time.perf_counter(), offset)
+    except Exception as e:
+        # بعد از timeout پاسخ دیررس روی همین اتصال می‌رسد؛ اتصال کنار گذاشته می‌شود
+        broken = not isinstance(e, QueryError)
+        stats.errors += 1
+        stats.timeouts += isinstance(e, asyncio.TimeoutError)
+        stats.first_error = stats.first_error or repr(e)
+    finally:
+        pool.release(client, broken)
+
+
+async def run_level(host, port, rate, args, queries, weights, rng):
+    offsets = arrival_times(rate, args.duration, args.arrival, args.profile, args.ramp, rng)
+    qnums = rng.choices(range(len(queries)), weights=weights, k=len(offsets))
+    pool = VirtualClients(host, port, args.clients, args.timeout)
+    stats = LevelStats(args.ramp)
+    tasks = []
+    lag = LatencyHistogram()  # تأخیر خود حلقه‌ی asyncio در بیدار شدن (سلامت مولد بار)
+    t0 = time.perf_counter()
+    try:
+        for offset, q in zip(offsets, qnums):
+            intended = t0 + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag.record(max(0.0, time.perf_counter() - intended))
+            tasks.append(asyncio.create_task(one_request(
+                pool, stats, q + 1, queries[q], rng.randint(1, 9) if args.priority == 0 else args.priority,
+                intended, offset, args.timeout)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+        if args.maintenance and stats.client_latencies:
+            client = await AsyncProtocolClient.connect(host, port)
+            try:
+                ack = await client.maintenance(stats.client_latencies) or {}
+                print(f"📝 report {ack.get('report_id')}: {ack.get('json_path')}")
+            finally:
+                await client.close()
+    finally:
+        await pool.close()
+
+    # پاسخ‌های حالت پایدار تقسیم بر زمان تا آخرین آن‌ها؛ بعد از اشباع این زمان از duration بیشتر می‌شود
+    steady_s = max(stats.last_end - (t0 + args.ramp), args.duration - args.ramp, 1e-9)
+    return {
+        "offered_rps": rate,
+        "arrival": args.arrival,
+        "profile": args.profile,
+        "sent": stats.sent,
+        "ok": stats.ok,
+        "errors": stats.errors,
+        "timeouts": stats.timeouts,
+        "first_error": stats.first_error,
+        "wall_sec": wall,
+        "achieved_rps": stats.corrected.count / steady_s,
+        "corrected": stats.corrected.to_dict(),
+        "service": stats.service.to_dict(),
+        "start_delay": stats.start_delay.to_dict(),
+        "generator_lag": lag.summary(),
+        "per_query": {f"Q{k}": h.to_dict() for k, h in sorted(stats.per_query.items())},
+    }
+
+
+def saturation_point(levels, slo_s: float):
+    """First offered rate where achieved < 85% of offered or corrected p99 exceeds ``slo_s``."""
+    for row in levels:
+        p99 = row["corrected"]["summary"]["p99_sec"]
+        if row["achieved_rps"] < 0.85 * row["offered_rps"] or (slo_s and p99 > slo_s):
+            return row["offered_rps"]
+    return None
+
+
+def save_curve(report, out_png: Path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 2, figsize=(13, 5))
+    for label, levels in report["targets"].items():
+        x = [r["achieved_rps"] for r in levels]
+        axes[0].plot([r["offered_rps"] for r in levels], x, marker="o", label=label)
+        for key, style in (("corrected", "-"), ("service", "--")):
+            axes[1].plot(x, [r[key]["summary"]["p99_sec"] for r in levels], style, marker="o",
+                         label=f"{label} p99 {key}")
+        axes[1].plot(x, [r["corrected"]["summary"]["p50_sec"] for r in levels], ":", marker=".",
+                     label=f"{label} p50 corrected")
+    top = max(r["offered_rps"] for levels in report["targets"].values() for r in levels)
+    axes[0].plot([0, top], [0, top], color="gray", linewidth=0.8, label="ideal")
+    axes[0].set_xlabel("offered (req/s)")
+    axes[0].set_ylabel("achieved (req/s)")
+    axes[0].set_title("Throughput")
+    axes[1].set_yscale("log")
+    axes[1].set_xlabel("achieved (req/s)")
+    axes[1].set_ylabel("latency (s)")
+    axes[1].set_title("Latency vs throughput (saturation curve)")
+    for ax in axes:
+        ax.grid(alpha=0.3)
+        ax.legend(fontsize=8)
+    fig.tight_layout()
+    fig.savefig(out_png, dpi=150)
+    plt.close(fig)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Open-loop load generator: fixed arrival rate, coordinated-omission "
+                                            "corrected latencies, throughput-vs-latency saturation curve.")
+    p.add_argument("--targets", nargs="+", default=["server2=localhost:9001"],
+                   help="label=host:port (مثلاً server1=localhost:9001 server2=localhost:9002)")
+    p.add_argument("--rates", default="5,10,20,40", help="offered req/s per level (comma separated)")
+    p.add_argument("--duration", type=float, default=30.0, help="Seconds per level (ramp included)")
+    p.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    p.add_argument("--profile", choices=["constant", "linear", "step"], default="constant",
+                   help="ramp-up shape over the first --ramp seconds")
+    p.add_argument("--ramp", type=float, default=0.0, help="Ramp-up seconds (excluded from latency stats)")
+    p.add_argument("--clients", type=int, default=1000, help="Virtual clients = max connections in flight")
+    p.add_argument("--mix", default="", help="query weights, e.g. 1=5,3=2 (1-based; default uniform)")
+    p.add_argument("--priority", type=int, default=0, help="fixed priority 1..9 (0 = random per request)")
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--slo", type=float, default=0.0, help="corrected p99 (s) that marks saturation")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--maintenance", action="store_true",
+                   help="send the scenario-end message after each level (server writes its report)")
+    p.add_argument("--queries", default=str(QUERY_PATH))
+    args = p.parse_args()
+
+    if args.ramp >= args.duration:
+        p.error("--ramp must be shorter than --duration")
+    queries = load_queries(Path(args.queries))
+    weights = parse_mix(args.mix, len(queries))
+    rates = [float(x) for x in args.rates.split(",")]
+
+    report = {"args": vars(args), "targets": {}, "saturation_rps": {}}
+    for target in args.targets:
+        label, addr = target.split("=", 1)
+        host, port = addr.rsplit(":", 1)
+        levels = []
+        for rate in rates:
+            rng = random.Random(args.seed)  # همان برنامه‌ی ورود برای هر هدف
+            row = asyncio.run(run_level(host, int(port), rate, args, queries, weights, rng))
+            levels.append(row)
+            c, s = row["corrected"]["summary"], row["service"]["summary"]
+            print(f"[{label}] offered={rate:7.1f}/s achieved={row['achieved_rps']:7.1f}/s "
+                  f"err={row['errors']:4d} p99 corrected={c['p99_sec']*1000:9.1f}ms "
+                  f"service={s['p99_sec']*1000:9.1f}ms lag p99={row['generator_lag']['p99_sec']*1000:.1f}ms")
+        report["targets"][label] = levels
+        report["saturation_rps"][label] = saturation_point(levels, args.slo)
+        print(f"[{label}] saturation at offered ≈ {report['saturation_rps'][label]} req/s")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    out = RESULTS_DIR / f"{stamp}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+    save_curve(report, RESULTS_DIR / f"{stamp}.png")
+    print(f"🖼️ saved figure: {RESULTS_DIR / f'{stamp}.png'}")
+
+if __name__ == "__main__":
+    main()
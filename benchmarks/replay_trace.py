@@ -0,0 +1,166 @@
+import sys, time, json, glob, asyncio, argparse
+from collections import Counter, defaultdict
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from query_scenarios.latency_histogram import LatencyHistogram
+from serving.protocol import AsyncProtocolClient, FLAG_STREAM, FLAG_APPROX
+from serving.trace import read_trace, KIND_QUERY, KIND_MAINTENANCE, KIND_CLOSE
+
+RESULTS_DIR = project_root / "results" / "replay"
+
+# ---------------- Trace replay ----------------
+# ترافیک ضبط‌شده (serving/trace.py) با همان فاصله‌های زمانی دوباره فرستاده می‌شود:
+#   --speed 1   زمان واقعی، --speed 4   چهار برابر سریع‌تر، --speed 0   بدون انتظار (حداکثر سرعت)
+# هر اتصال اصلی = یک اتصال در replay و ترتیب ارسال درخواست‌های هر اتصال حفظ می‌شود.
+# پیش‌فرض open-loop است (مثل ترافیک اصلی، چند درخواست هم‌زمان روی یک اتصال)؛ --closed هر درخواست را
+# تا رسیدن پاسخ قبلیِ همان اتصال نگه می‌دارد. latency از زمان برنامه‌ریزی‌شده (corrected) و از ارسال واقعی.
+
+
+class ReplayStats:
+    def __init__(self):
+        self.sent = self.ok = 0
+        self.errors = Counter()
+        self.sources = Counter()  # db / cache از پاسخ server2
+        self.corrected = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.start_delay = LatencyHistogram()
+        self.per_query = defaultdict(LatencyHistogram)
+        self.since_maintenance = []
+
+    def record(self, fp, scheduled, actual, end, response):
+        self.ok += 1
+        self.corrected.record(end - scheduled)
+        self.service.record(end - actual)
+        self.start_delay.record(actual - scheduled)
+        self.per_query[fp].record(end - scheduled)
+        self.since_maintenance.append(end - actual)
+        if isinstance(response, dict):
+            self.sources[response.get("source", "db")] += 1
+
+
+async def run_request(client, ev, scheduled, stats, timeout_s):
+    stats.sent += 1
+    actual = time.perf_counter()
+    approximate = bool(ev["flags"] & FLAG_APPROX)  # همان حالت تقریبیِ درخواست ضبط‌شده
+    try:
+        if ev["flags"] & FLAG_STREAM:
+            stream = await client.stream(ev["sql"], priority=ev["priority"], approximate=approximate)
+            async def drain():
+                async for _ in stream:
+                    pass
+            await asyncio.wait_for(drain(), timeout_s)
+            response = stream.summary
+        else:
+            response = await asyncio.wait_for(
+                client.query(ev["sql"], priority=ev["priority"], approximate=approximate), timeout_s)
+        stats.record(ev["fingerprint"], scheduled, actual, time.perf_counter(), response)
+    except Exception as e:
+        stats.errors[f"{type(e).__name__}: {str(e)[:80]}"] += 1
+
+
+async def replay_connection(host, port, events, t0, trace_t0, speed, closed, stats, args):
+    client = None
+    inflight = []
+    try:
+        for ev in events:
+            scheduled = t0 + (ev["t"] - trace_t0) / speed if speed > 0 else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if ev["kind"] == KIND_CLOSE:
+                break
+            if client is None:
+                client = await asyncio.wait_for(AsyncProtocolClient.connect(host, port), args.timeout)
+            if ev["kind"] == KIND_QUERY:
+                req = run_request(client, ev, scheduled, stats, args.timeout)
+                if closed:
+                    await req
+                else:
+                    inflight.append(asyncio.create_task(req))
+            elif ev["kind"] == KIND_MAINTENANCE and args.maintenance:
+                await asyncio.gather(*inflight)
+                latencies, stats.since_maintenance = stats.since_maintenance, []
+                ack = await client.maintenance(latencies) or {}
+                print(f"📝 report {ack.get('report_id')}: {ack.get('json_path')}")
+        await asyncio.gather(*inflight)
+    except Exception as e:
+        stats.errors[f"connection {type(e).__name__}: {str(e)[:80]}"] += 1
+        await asyncio.gather(*inflight, return_exceptions=True)
+    finally:
+        if client is not None:
+            await client.close()
+
+
+async def replay(host, port, events, args):
+    by_conn = defaultdict(list)
+    for ev in events:
+        by_conn[ev["conn"]].append(ev)
+    stats = ReplayStats()
+    trace_t0 = events[0]["t"]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(replay_connection(host, port, evs, t0, trace_t0, args.speed, args.closed, stats, args)
+                           for evs in by_conn.values()))
+    wall = time.perf_counter() - t0
+    return stats, wall, len(by_conn)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Replay a captured server2 query trace against a server.")
+    p.add_argument("traces", nargs="+", help="trace files (globs allowed), e.g. 'results/traces/*.jsonl'")
+    p.add_argument("--target", default="localhost:9001", help="host:port (server1 or server2)")
+    p.add_argument("--label", default="", help="name stored in the output JSON (e.g. cache-off)")
+    p.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N× faster, 0 = as fast as possible")
+    p.add_argument("--closed", action="store_true", help="wait for each response before the next request of a connection")
+    p.add_argument("--maintenance", action="store_true", help="also replay scenario-end messages")
+    p.add_argument("--limit", type=int, default=0, help="only the first N events")
+    p.add_argument("--timeout", type=float, default=120.0)
+    args = p.parse_args()
+
+    files = sorted({f for pat in args.traces for f in glob.glob(pat)})
+    events = read_trace(files)
+    if args.limit:
+        events = events[:args.limit]
+    queries = [e for e in events if e["kind"] == KIND_QUERY]
+    if not queries:
+        p.error("trace has no queries")
+    span = events[-1]["t"] - events[0]["t"]
+    print(f"[replay] {len(queries)} queries over {span:.1f}s from {len(files)} file(s), speed={args.speed or 'max'}")
+
+    host, port = args.target.rsplit(":", 1)
+    stats, wall, conns = asyncio.run(replay(host, int(port), events, args))
+
+    report = {
+        "label": args.label,
+        "target": args.target,
+        "traces": files,
+        "speed": args.speed,
+        "closed": args.closed,
+        "connections": conns,
+        "trace_span_sec": span,
+        "wall_sec": wall,
+        "sent": stats.sent,
+        "ok": stats.ok,
+        "errors": dict(stats.errors),
+        "sources": dict(stats.sources),
+        "achieved_rps": stats.ok / wall if wall > 0 else 0.0,
+        "corrected": stats.corrected.to_dict(),
+        "service": stats.service.to_dict(),
+        "start_delay": stats.start_delay.to_dict(),
+        "per_query": {fp: h.to_dict() for fp, h in stats.per_query.items()},
+    }
+    c, s = stats.corrected.summary(), stats.service.summary()
+    print(f"[replay] ok={stats.ok} err={sum(stats.errors.values())} sources={dict(stats.sources)} "
+          f"wall={wall:.1f}s p50={c['p50_sec']*1000:.1f}ms p99 corrected={c['p99_sec']*1000:.1f}ms "
+          f"service={s['p99_sec']*1000:.1f}ms")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    name = time.strftime('%Y%m%d_%H%M%S') + (f"_{args.label}" if args.label else "")
+    out = RESULTS_DIR / f"{name}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+
+if __name__ == "__main__":
+    main()
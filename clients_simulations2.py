@@ -1,10 +1,9 @@
-import socket
 import threading
 import random
 import time
-from clickhouse_connect import get_client
 from pathlib import Path
-import json
+
+from serving.protocol import ProtocolClient
 
 # Server address
 HOST = 'localhost'
@@ -12,6 +11,7 @@ PORT = 9001
 sum_latency = 0.000
 sum_client = 0
 latency_list = []
+stats_lock = threading.Lock()  # thread های کلاینت هم‌زمان این شمارنده‌ها را به‌روز می‌کنند
 
 BASE_DIR = Path(__file__).parent
 QUERY_PATH = BASE_DIR / 'optimizations' / 'optimized_queries.sql'
@@ -30,30 +30,23 @@ def simulate_client(client_id, queries):
         delay = random.uniform(0.1, 2.0)
 
         # Connect to server
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((HOST, PORT))
-
-            # Send priority
-            sock.sendall(f"{priority}\n".encode())
-
+        with ProtocolClient(HOST, PORT) as client:
             # Wait before sending query
             time.sleep(delay)
 
-            # Send query
+            # Send query (priority travels in the frame header) and wait for its response
             start_time = time.perf_counter()
-            sock.sendall(query.encode())
-
-            # Receive response
-            response = sock.recv(16384).decode()
+            response = client.query(query, priority=priority)
             end_time = time.perf_counter()
 
             latency = end_time - start_time
-            sum_latency += latency
-            latency_list.append(latency)
-            print(f"[Client {client_id}] Priority: {priority}, Latency: {latency:.3f}s, Query: {query}, Response: {response[:60]}...")
-            sock.close()
-            sum_client += 1;
-            print(f"[Client {client_id}] Connection closed. {sum_client}")
+            with stats_lock:
+                sum_latency += latency
+                latency_list.append(latency)
+            print(f"[Client {client_id}] Priority: {priority}, Latency: {latency:.3f}s, Query: {query}, Response: {str(response)[:60]}...")
+        with stats_lock:
+            sum_client += 1
+        print(f"[Client {client_id}] Connection closed. {sum_client}")
 
     except Exception as e:
         print(f"[Client {client_id}] Error: {e}")
@@ -86,15 +79,10 @@ def launch_clients(queries, num_clients=5):
         t.join()
     print(f"🚀 latency={sum_latency:.3f}")
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((HOST, PORT))
-        priority = 0
-        sock.sendall(f"{priority}\n".encode())
-        time.sleep(0.5)
-        data_str = json.dumps(latency_list)
-        sock.sendall(data_str.encode())
-        time.sleep(10)
-        sock.close()
+    # Scenario-end message; the ack carries the report ID, the figure is rendered in the background
+    with ProtocolClient(HOST, PORT) as client:
+        ack = client.maintenance(latency_list) or {}
+    print(f"📝 report {ack.get('report_id')}: {ack.get('json_path')}")
 
 
 if __name__ == "__main__":
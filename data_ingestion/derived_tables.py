@@ -0,0 +1,163 @@
+import time
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+# ---------------- Derived per-day tables ----------------
+# جدول‌هایی که از MV های روزانه ساخته می‌شوند ولی خودشان MV نیستند (window function / quantile روی روزها
+# را نمی‌شود در MV افزایشی نوشت). بعد از commit هر فایل، file_listener فقط روزهای لمس‌شده را بازمحاسبه
+# می‌کند؛ setup_project یک بار کل بازه را می‌سازد. ردیف جدید با updated_at بزرگ‌تر نسخه‌ی قبلی همان روز را
+# در ReplacingMergeTree جایگزین می‌کند؛ خواندن با FINAL.
+#
+# Q6 — میانگین 7 روزه‌ی تعداد سفر: برای روز d روی روزهای موجود در [d-6, d] (مثل self-join در queries.sql)
+#   ردیف روز d به روزهای d-6..d وابسته است، پس ورود داده برای روز t روزهای t..t+6 را عوض می‌کند.
+# Q10 — آستانه‌ی p95 تعداد سفر vendor ها در هر روز: فقط به همان روز وابسته است.
+ROLLING_WINDOW_DAYS = 7
+ROLLING_SOURCE = "mv_trip_counts_daily"
+ROLLING_TABLE = "trip_counts_rolling_7d"
+THRESHOLD_QUANTILE = 0.95
+THRESHOLD_SOURCE = "mv_trip_stats_daily"
+THRESHOLD_TABLE = "vendor_p95_thresholds_daily"
+
+
+def create_rolling_table(client, table: str = ROLLING_TABLE):
+    client.command(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            trip_day Date,
+            rolling_avg_trip_count Float64,
+            days_in_window UInt8,
+            updated_at DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY trip_day;
+    """)
+
+
+def day_ranges(days: Iterable[date], spread: int = 0) -> List[Tuple[date, date]]:
+    """Merges ``[d, d + spread]`` for every day into sorted, non-overlapping ranges."""
+    ranges: List[Tuple[date, date]] = []
+    for d in sorted(set(days)):
+        lo, hi = d, d + timedelta(days=spread)
+        if ranges and lo <= ranges[-1][1] + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], hi))
+        else:
+            ranges.append((lo, hi))
+    return ranges
+
+
+def rolling_window_sql(source: str = ROLLING_SOURCE, lo: Optional[date] = None, hi: Optional[date] = None) -> str:
+    """Rolling average of ``source`` (a daily ``trip_count`` table) for days in ``[lo, hi]``."""
+    back = ROLLING_WINDOW_DAYS - 1
+    # SummingMergeTree: ممکن است چند ردیف ادغام‌نشده برای یک روز باشد → sum قبل از window
+    where = f"WHERE trip_day BETWEEN toDate('{lo}') - {back} AND toDate('{hi}')" if lo is not None else ""
+    outer = f"WHERE trip_day BETWEEN toDate('{lo}') AND toDate('{hi}')" if lo is not None else ""
+    return f"""
+        SELECT trip_day, rolling_avg_trip_count, days_in_window
+        FROM (
+            SELECT trip_day,
+                   avg(trip_count) OVER w AS rolling_avg_trip_count,
+                   toUInt8(count() OVER w) AS days_in_window
+            FROM (
+                SELECT trip_day, sum(trip_count) AS trip_count
+                FROM {source}
+                {where}
+                GROUP BY trip_day
+            )
+            WINDOW w AS (ORDER BY toRelativeDayNum(trip_day) RANGE BETWEEN {back} PRECEDING AND CURRENT ROW)
+        )
+        {outer}
+        ORDER BY trip_day
+    """
+
+
+def _source_ranges(client, source: str, days: Optional[Iterable[date]], spread: int) -> List[Tuple[date, date]]:
+    if days is not None:
+        return day_ranges(days, spread)
+    lo, hi = client.query(f"SELECT min(trip_day), max(trip_day) FROM {source}").result_rows[0]
+    if not hi or hi.year < 1971:  # جدول خالی → 1970-01-01
+        return []
+    return [(lo, hi)]
+
+
+def refresh_rolling(client, days: Optional[Iterable[date]] = None, source: str = ROLLING_SOURCE,
+                    table: str = ROLLING_TABLE) -> int:
+    """Recomputes the rolling rows affected by ``days`` (``None``: every day in ``source``)."""
+    ranges = _source_ranges(client, source, days, spread=ROLLING_WINDOW_DAYS - 1)
+    for lo, hi in ranges:
+        client.command(f"""
+            INSERT INTO {table} (trip_day, rolling_avg_trip_count, days_in_window)
+            {rolling_window_sql(source, lo, hi)}
+        """)
+    return sum((hi - lo).days + 1 for lo, hi in ranges)
+
+
+def create_threshold_table(client, table: str = THRESHOLD_TABLE):
+    client.command(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            trip_day Date,
+            p95_count Float64,
+            vendors UInt32,
+            updated_at DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY trip_day;
+    """)
+
+
+def daily_vendor_counts_sql(source: str = THRESHOLD_SOURCE, where: str = "") -> str:
+    # SummingMergeTree: ردیف‌های ادغام‌نشده‌ی هر (روز، vendor) جمع می‌شوند
+    return f"""
+        SELECT trip_day, vendor_id, sum(trip_count) AS trip_count
+        FROM {source}
+        {where}
+        GROUP BY trip_day, vendor_id
+    """
+
+
+def threshold_sql(source: str = THRESHOLD_SOURCE, lo: Optional[date] = None, hi: Optional[date] = None) -> str:
+    """Per-day ``quantile(0.95)`` of the vendors' daily trip counts, same as Query 10's ``thresholds``."""
+    where = f"WHERE trip_day BETWEEN toDate('{lo}') AND toDate('{hi}')" if lo is not None else ""
+    return f"""
+        SELECT trip_day, quantile({THRESHOLD_QUANTILE})(trip_count) AS p95_count, toUInt32(count()) AS vendors
+        FROM ({daily_vendor_counts_sql(source, where)})
+        GROUP BY trip_day
+    """
+
+
+def refresh_thresholds(client, days: Optional[Iterable[date]] = None, source: str = THRESHOLD_SOURCE,
+                       table: str = THRESHOLD_TABLE) -> int:
+    """Recomputes the thresholds of ``days`` (``None``: every day in ``source``)."""
+    ranges = _source_ranges(client, source, days, spread=0)
+    for lo, hi in ranges:
+        client.command(f"""
+            INSERT INTO {table} (trip_day, p95_count, vendors)
+            {threshold_sql(source, lo, hi)}
+        """)
+    return sum((hi - lo).days + 1 for lo, hi in ranges)
+
+
+# ---------------- Registry ----------------
+# (نام، ساخت جدول، بازمحاسبه برای روزها) — ترتیب مهم است اگر جدولی از دیگری بخواند
+DERIVED_TABLES = (
+    (ROLLING_TABLE, create_rolling_table, refresh_rolling),
+    (THRESHOLD_TABLE, create_threshold_table, refresh_thresholds),
+)
+
+
+def create_derived_tables(client, rebuild: bool = True):
+    for name, create, refresh in DERIVED_TABLES:
+        create(client)
+        if rebuild:
+            # داده‌ی قبل از ساخت جدول (یا بعد از reset) یک بار کامل
+            print(f"✅ {name}: {refresh(client, None)} days built.")
+
+
+def refresh_derived(client, days: Iterable[date]):
+    """Called after a file is committed with the pickup days it contained."""
+    days = set(days)
+    if not days:
+        return
+    for name, _, refresh in DERIVED_TABLES:
+        t0 = time.perf_counter()
+        try:
+            n = refresh(client, days)
+            print(f"🔁 {name}: refreshed {n} days in {time.perf_counter() - t0:.2f}s")
+        except Exception as e:
+            print(f"⚠️  {name}: refresh failed ({e}); rebuild with scripts/init_clickhouse.py")
@@ -7,6 +7,7 @@ import pyarrow.parquet as pq
 
 from config import INPUT_DIR, PROCESSED_DIR, POLL_INTERVAL, CLICKHOUSE_TABLE
 from preprocessor import preprocess_data
+from derived_tables import refresh_derived
 
 BATCH_ROWS = int(os.getenv("NYC_BATCH_ROWS", "50000"))
 
@@ -84,6 +85,7 @@ def watch_and_process(client):
                 fname = os.path.basename(filepath)
                 print(f"📄 Found: {fname}")
                 total_inserted = 0
+                touched_days = set()  # روزهای pickup این فایل → بازمحاسبه‌ی جدول‌های مشتق
 
                 try:
                     pf = pq.ParquetFile(filepath)
@@ -101,6 +103,7 @@ def watch_and_process(client):
 
                         _insert_dataframe(client, df_clean, table_cols)
                         total_inserted += len(df_clean)
+                        touched_days.update(df_clean["tpep_pickup_datetime"].dt.date.unique())
 
                         del df_chunk, df_clean, rec_batch
                         gc.collect()
@@ -125,6 +128,9 @@ def watch_and_process(client):
                     except Exception:
                         print("⚠️  Insert OK but move to PROCESSED failed. Keeping file in place.")
 
+                # batch های درج‌شده (حتی اگر فایل وسط کار شکست خورده باشد) در MV ها هستند
+                refresh_derived(client, touched_days)
+
         except KeyboardInterrupt:
             print("🛑 Stopped by user.")
             break
@@ -0,0 +1,62 @@
+import csv
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+# ---------------- Taxi zone dimension ----------------
+# جدول lookup رسمی TLC (taxi_zone_lookup.csv: LocationID, Borough, Zone, service_zone) یک بار با یک
+# INSERT در جدول کوچک taxi_zones بارگذاری می‌شود و dictionary با layout FLAT (آرایه‌ی در حافظه به اندیس
+# LocationID، حدود 265 کلید) از همان جدول پر می‌شود. کوئری‌ها با dictGet نام zone/borough را بدون JOIN
+# می‌گیرند؛ چون dictGet تابعی از کلید GROUP BY است، بعد از تجمیع فقط یک بار برای هر گروه اجرا می‌شود.
+# id ناموجود در CSV → رشته‌ی خالی (همان مقدار پیش‌فرض LEFT JOIN، برای مقایسه‌ی نتیجه‌ها)
+ZONES_CSV = os.getenv("TAXI_ZONES_CSV", str(Path(__file__).parent / "taxi_zone_lookup.csv"))
+ZONES_CSV_URL = "https://d37ci6vzurychx.cloudfront.net/misc/taxi_zone_lookup.csv"
+ZONE_TABLE = "taxi_zones"
+ZONE_DICT = "taxi_zone_dict"
+ZONE_COLUMNS = ["location_id", "borough", "zone", "service_zone"]
+
+
+def read_zone_csv(path: str = ZONES_CSV) -> List[Tuple[int, str, str, str]]:
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for rec in csv.DictReader(f):
+            rec = {k.strip().lower(): (v or "").strip() for k, v in rec.items() if k}
+            if not rec.get("locationid"):
+                continue
+            rows.append((int(rec["locationid"]), rec.get("borough", ""), rec.get("zone", ""),
+                         rec.get("service_zone", "")))
+    return rows
+
+
+def create_zone_dictionary(client, path: str = ZONES_CSV):
+    client.command(f"""
+        CREATE TABLE IF NOT EXISTS {ZONE_TABLE} (
+            location_id UInt16,
+            borough LowCardinality(String),
+            zone String,
+            service_zone LowCardinality(String)
+        ) ENGINE = MergeTree()
+        ORDER BY location_id;
+    """)
+    if os.path.exists(path):
+        rows = read_zone_csv(path)
+        # بارگذاری دوباره‌ی کامل: جدول کوچک است و CSV منبع حقیقت
+        client.command(f"TRUNCATE TABLE {ZONE_TABLE}")
+        client.insert(ZONE_TABLE, rows, column_names=ZONE_COLUMNS)
+        print(f"✅ Loaded {len(rows)} taxi zones from {path}.")
+    else:
+        print(f"⚠️  {path} not found; zone names will be empty. Download it from {ZONES_CSV_URL}")
+    client.command(f"""
+        CREATE DICTIONARY IF NOT EXISTS {ZONE_DICT} (
+            location_id UInt64,
+            borough String DEFAULT '',
+            zone String DEFAULT '',
+            service_zone String DEFAULT ''
+        )
+        PRIMARY KEY location_id
+        SOURCE(CLICKHOUSE(TABLE '{ZONE_TABLE}'))
+        LIFETIME(0)
+        LAYOUT(FLAT());
+    """)
+    client.command(f"SYSTEM RELOAD DICTIONARY {ZONE_DICT}")
+    print(f"✅ Dictionary {ZONE_DICT} is ready.")
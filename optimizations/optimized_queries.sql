@@ -27,13 +27,9 @@ SELECT dolocation_id, toYYYYMM(tpep_pickup_datetime) AS month, sum(total_amount)
     ORDER BY month, monthly_income DESC;
 
 -- Query 6: 7-day rolling average of daily trip count
-SELECT current_day.trip_day,
-       avg(past.trip_count) AS rolling_avg_trip_count
-    FROM mv_trip_counts_daily AS current_day
-    JOIN mv_trip_counts_daily AS past
-        ON past.trip_day BETWEEN current_day.trip_day - INTERVAL 6 DAY AND current_day.trip_day
-    GROUP BY current_day.trip_day
-    ORDER BY current_day.trip_day;
+SELECT trip_day, rolling_avg_trip_count
+    FROM trip_counts_rolling_7d FINAL
+    ORDER BY trip_day;
 
 -- Query 7: Top 10 pickup/dropoff pairs by total income
 SELECT pulocation_id, dolocation_id, sumMerge(sum_amount_state) AS total_income
@@ -54,13 +50,12 @@ SELECT dolocation_id, avgMerge(tip_pct_state) AS avg_tip_percent
     ORDER BY avg_tip_percent DESC;
 
 -- Query 10: Vendor IDs with daily trip count above 95th percentile
-WITH thresholds AS (
-    SELECT trip_day, quantile(0.95)(trip_count) AS p95_count
-    FROM mv_trip_stats_daily
-    GROUP BY trip_day
-)
 SELECT d.vendor_id, d.trip_day, d.trip_count
-    FROM mv_trip_stats_daily d
-    JOIN thresholds t ON d.trip_day = t.trip_day
+    FROM (
+        SELECT trip_day, vendor_id, sum(trip_count) AS trip_count
+        FROM mv_trip_stats_daily
+        GROUP BY trip_day, vendor_id
+    ) AS d
+    JOIN (SELECT trip_day, p95_count FROM vendor_p95_thresholds_daily FINAL) AS t ON d.trip_day = t.trip_day
     WHERE d.trip_count > t.p95_count
     ORDER BY d.trip_day, d.trip_count DESC;
\ No newline at end of file
@@ -0,0 +1,58 @@
+-- Query 3z: Total trip distance per pickup zone
+SELECT pulocation_id,
+       dictGet('taxi_zone_dict', 'zone', toUInt64(pulocation_id)) AS pickup_zone,
+       dictGet('taxi_zone_dict', 'borough', toUInt64(pulocation_id)) AS pickup_borough,
+       sum(trip_distance) AS total_distance
+    FROM ny_taxi_trips
+    GROUP BY pulocation_id
+    ORDER BY total_distance DESC;
+
+-- Query 3b: Total trip distance per pickup borough
+SELECT dictGet('taxi_zone_dict', 'borough', toUInt64(pulocation_id)) AS pickup_borough,
+       sum(trip_distance) AS total_distance
+    FROM ny_taxi_trips
+    GROUP BY pickup_borough
+    ORDER BY total_distance DESC;
+
+-- Query 5b: Monthly income per dropoff borough
+SELECT dictGet('taxi_zone_dict', 'borough', toUInt64(dolocation_id)) AS dropoff_borough,
+       toYYYYMM(tpep_pickup_datetime) AS month,
+       sum(total_amount) AS monthly_income
+    FROM ny_taxi_trips
+    GROUP BY dropoff_borough, month
+    ORDER BY month, monthly_income DESC;
+
+-- Query 7z: Top 10 pickup/dropoff zone pairs by total income
+SELECT pulocation_id, dolocation_id,
+       dictGet('taxi_zone_dict', 'zone', toUInt64(pulocation_id)) AS pickup_zone,
+       dictGet('taxi_zone_dict', 'zone', toUInt64(dolocation_id)) AS dropoff_zone,
+       sum(total_amount) AS total_income
+    FROM ny_taxi_trips
+    GROUP BY pulocation_id, dolocation_id
+    ORDER BY total_income DESC
+    LIMIT 10;
+
+-- Query 7b: Borough-to-borough income matrix
+SELECT dictGet('taxi_zone_dict', 'borough', toUInt64(pulocation_id)) AS pickup_borough,
+       dictGet('taxi_zone_dict', 'borough', toUInt64(dolocation_id)) AS dropoff_borough,
+       count() AS trips,
+       sum(total_amount) AS total_income
+    FROM ny_taxi_trips
+    GROUP BY pickup_borough, dropoff_borough
+    ORDER BY total_income DESC;
+
+-- Query 9z: Dropoff zones ranked by average tip percentage
+SELECT dolocation_id,
+       dictGet('taxi_zone_dict', 'zone', toUInt64(dolocation_id)) AS dropoff_zone,
+       dictGet('taxi_zone_dict', 'borough', toUInt64(dolocation_id)) AS dropoff_borough,
+       avg(tip_amount / total_amount) * 100 AS avg_tip_percent
+    FROM ny_taxi_trips
+    GROUP BY dolocation_id
+    ORDER BY avg_tip_percent DESC;
+
+-- Query 9b: Dropoff boroughs ranked by average tip percentage
+SELECT dictGet('taxi_zone_dict', 'borough', toUInt64(dolocation_id)) AS dropoff_borough,
+       avg(tip_amount / total_amount) * 100 AS avg_tip_percent
+    FROM ny_taxi_trips
+    GROUP BY dropoff_borough
+    ORDER BY avg_tip_percent DESC;
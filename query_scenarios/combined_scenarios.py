@@ -8,6 +8,8 @@ import matplotlib
 matplotlib.use("Agg")  # مناسب سرور/WSL
 import matplotlib.pyplot as plt
 
+from latency_histogram import merge_reports, percentile_table
+
 METRIC_KEYS = ["cpu", "memory_mb", "threads", "fds", "net_kbps"]
 PHASES = ["pre", "during", "post"]
 
@@ -18,7 +20,7 @@ def load_json(path: Path) -> dict:
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def collect_from_files(files: list[Path]) -> tuple[dict, float, float, int]:
+def collect_from_files(files: list[Path]) -> tuple[dict, float, float, int, dict | None]:
     n = len(files)
     if n == 0:
         raise RuntimeError("هیچ فایل JSONی پیدا نشد.")
@@ -26,6 +28,7 @@ def collect_from_files(files: list[Path]) -> tuple[dict, float, float, int]:
     sums = {k: {p: 0.0 for p in PHASES} for k in METRIC_KEYS}
     latencies = []
     throughputs = []
+    reports = []
 
     for p in files:
         data = load_json(p)
@@ -36,13 +39,27 @@ def collect_from_files(files: list[Path]) -> tuple[dict, float, float, int]:
                 sums[mk][ph] += float(m.get(ph, 0.0))
         if "avg_latency_sec" in data:
             latencies.append(float(data["avg_latency_sec"]))
-        if "avg_throughput_rows_per_sec" in data:
-            throughputs.append(float(data["avg_throughput_rows_per_sec"]))
+        # میانگین روی همه‌ی کوئری‌ها، نه میانگینِ میانگین فایل‌ها (فایل‌ها تعداد کوئری متفاوت دارند)
+        if data.get("queries"):
+            throughputs.extend(float(q.get("throughput_rows_per_sec", 0.0)) for q in data["queries"])
+        elif "avg_throughput_rows_per_sec" in data:
+            # سرورها (aggregator) لیست کوئری ندارند: میانگین فایل با وزن query_count
+            throughputs.extend([float(data["avg_throughput_rows_per_sec"])] * int(data.get("query_count", 1)))
+        if data.get("latency_histograms"):
+            reports.append(data["latency_histograms"])
 
     avg_metrics = {mk: {ph: (sums[mk][ph] / n) for ph in PHASES} for mk in METRIC_KEYS}
     avg_latency = mean(latencies)
     avg_throughput = mean(throughputs)
-    return avg_metrics, avg_latency, avg_throughput, n
+    latency = None
+    if reports:
+        # merge دقیق هیستوگرام‌ها؛ صدک‌ها و میانگین از کل نمونه‌ها
+        latency = merge_reports(reports)
+        if len(reports) == n:
+            avg_latency = latency.get("client", latency["total"])["summary"]["mean_sec"]
+        else:
+            print(f"[combined] {n - len(reports)} file(s) without latency_histograms; percentiles cover {len(reports)}")
+    return avg_metrics, avg_latency, avg_throughput, n, latency
 
 def beautify(ax, title, ylabel=None):
     ax.set_title(title, pad=10, fontsize=12)
@@ -60,7 +77,8 @@ def bar3(ax, values, fmt="%.2f"):
     except Exception:
         pass
 
-def make_figure(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_files: int, out_dir: Path) -> Path:
+def make_figure(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_files: int, out_dir: Path,
+                latency: dict | None = None) -> Path:
     out_dir.mkdir(parents=True, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     out_path = out_dir / f"combined_{n_files}files_{ts}.png"
@@ -88,6 +106,17 @@ def make_figure(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_
     bar3(ax_net,  [avg_metrics["net_kbps"]["pre"], avg_metrics["net_kbps"]["during"], avg_metrics["net_kbps"]["post"]], fmt="%.1f")
     beautify(ax_net, "Network Rate (avg)", "KB/s")
 
+    if latency:
+        ax_lat = fig.add_subplot(gs[1, 2])
+        summ = latency.get("client", latency["total"])["summary"]
+        bars = ax_lat.bar(["p50", "p90", "p99", "max"],
+                          [summ["p50_sec"] * 1000, summ["p90_sec"] * 1000, summ["p99_sec"] * 1000, summ["max_sec"] * 1000])
+        try:
+            ax_lat.bar_label(bars, fmt="%.1f", padding=3)
+        except Exception:
+            pass
+        beautify(ax_lat, f"Latency percentiles ({summ['count']} queries)", "ms")
+
     fig.suptitle(f"Combined Averages over {n_files} scenarios", fontsize=14, y=0.98)
     fig.text(0.01, 0.995, f"Avg Latency: {avg_latency*1000:.2f} ms", va="top", fontsize=11)
     fig.text(0.26, 0.995, f"Avg Throughput: {avg_throughput:.2f} rows/s", va="top", fontsize=11)
@@ -96,11 +125,14 @@ def make_figure(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_
     plt.close(fig)
     return out_path
 
-def save_json(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_files: int, out_dir: Path, img_path: Path) -> Path:
+def save_json(avg_metrics: dict, avg_latency: float, avg_throughput: float, n_files: int, out_dir: Path, img_path: Path,
+              latency: dict | None = None) -> Path:
     payload = {
         "files_combined": n_files,
         "avg_latency_sec": avg_latency,
         "avg_throughput_rows_per_sec": avg_throughput,
+        "latency_percentiles": percentile_table(latency) if latency else None,
+        "latency_histograms": latency,
         "aggregated_metrics": avg_metrics,
         "figure_path": str(img_path),
     }
@@ -124,11 +156,11 @@ def main():
         files.extend([m for m in matches if m.suffix.lower() == ".json"])
     files = sorted(set(files))
 
-    avg_metrics, avg_latency, avg_throughput, n = collect_from_files(files)
+    avg_metrics, avg_latency, avg_throughput, n, latency = collect_from_files(files)
 
     out_dir = Path(args.outdir)
-    img_path = make_figure(avg_metrics, avg_latency, avg_throughput, n, out_dir)
-    json_path = save_json(avg_metrics, avg_latency, avg_throughput, n, out_dir, img_path)
+    img_path = make_figure(avg_metrics, avg_latency, avg_throughput, n, out_dir, latency)
+    json_path = save_json(avg_metrics, avg_latency, avg_throughput, n, out_dir, img_path, latency)
 
     print(f"🖼  saved figure: {img_path}")
     print(f"🧾 saved json:   {json_path}")
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from query_scenarios.latency_histogram import LatencyHistogram
+from query_scenarios.sql_fingerprint import shape_fingerprint
+from serving.replicas import ReplicaPoolSet, replica_registry
+from serving.streaming import count_rows_streaming
+from serving.query_log import new_query_id, with_query_id
+
+# ---------------- Concurrency sweep (scenario_runner --benchmark) ----------------
+# برای هر کوئری: اجرای cold (اولین اجرا، اختیاری بعد از خالی کردن کش‌های ClickHouse)، warmup،
+# سپس در هر سطح هم‌زمانی c (1, 2, 4, … N)، c thread هر کدام K بار همان کوئری را پشت سر هم اجرا می‌کنند.
+# همه‌ی سطح‌ها از یک pool از پیش گرم‌شده با N اتصال استفاده می‌کنند، پس ساخت اتصال در latency نیست.
+#   scaling efficiency(c) = qps(c) / (c · qps(1))   — 1.0 یعنی مقیاس‌پذیری خطی
+#   knee = بزرگ‌ترین c که تا آن هر افزایش هم‌زمانی حداقل KNEE_MIN_GAIN برابر throughput را بالا برده
+SWEEP_WARMUP = int(os.getenv("SWEEP_WARMUP", "2"))
+SWEEP_REPETITIONS = int(os.getenv("SWEEP_REPETITIONS", "5"))
+KNEE_MIN_GAIN = float(os.getenv("KNEE_MIN_GAIN", "1.10"))
+# خالی کردن کش‌های سرور برای اجرای cold (نیاز به دسترسی SYSTEM؛ page cache سیستم‌عامل خالی نمی‌شود)
+DROP_CACHE_STATEMENTS = (
+    "SYSTEM DROP MARK CACHE",
+    "SYSTEM DROP UNCOMPRESSED CACHE",
+    "SYSTEM DROP QUERY CACHE",
+)
+
+
+def concurrency_levels(max_clients: int) -> List[int]:
+    """1, 2, 4, … up to ``max_clients`` (``max_clients`` itself is always included)."""
+    levels, c = [], 1
+    while c < max_clients:
+        levels.append(c)
+        c *= 2
+    levels.append(max(1, max_clients))
+    return levels
+
+
+def _run_once(pool: ReplicaPoolSet, query: str) -> Dict[str, Any]:
+    query_id = new_query_id()
+    with pool.connection() as client:
+        t0 = time.perf_counter()
+        stats = count_rows_streaming(client, query, settings=with_query_id(query_id))
+        latency = time.perf_counter() - t0
+    return {
+        "latency_s": latency,
+        "rows": stats.rows,
+        "throughput": stats.rows / latency if latency > 0 else 0.0,
+        "ttfr_s": stats.ttfr_s,
+        "fingerprint": shape_fingerprint(query),
+        "query_id": query_id,
+        "queue_wait_s": 0.0,
+    }
+
+
+def drop_caches(pool: ReplicaPoolSet) -> List[str]:
+    dropped = []
+    for stmt in DROP_CACHE_STATEMENTS:
+        try:
+            with pool.connection() as client:
+                client.command(stmt)
+            dropped.append(stmt)
+        except Exception as e:
+            print(f"[sweep] {stmt} skipped: {e}")
+    return dropped
+
+
+def run_level(pool: ReplicaPoolSet, query: str, clients: int, repetitions: int) -> Dict[str, Any]:
+    """``clients`` threads, each running ``query`` ``repetitions`` times back to back."""
+    records: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(repetitions):
+            try:
+                r = _run_once(pool, query)
+                with lock:
+                    records.append(r)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    start.wait()  # همه‌ی thread ها با هم شروع می‌کنند
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    hist = LatencyHistogram().extend(r["latency_s"] for r in records)
+    return {
+        "clients": clients,
+        "executions": len(records),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_sec": wall,
+        "qps": len(records) / wall if wall > 0 else 0.0,
+        "latency": hist.summary(),
+        "records": records,
+    }
+
+
+def knee_point(levels: List[Dict[str, Any]], min_gain: float = KNEE_MIN_GAIN) -> Optional[int]:
+    """Largest concurrency reached while every step still multiplied throughput by ≥ ``min_gain``."""
+    knee = levels[0]["clients"] if levels else None
+    for prev, cur in zip(levels, levels[1:]):
+        if prev["qps"] <= 0 or cur["qps"] / prev["qps"] < min_gain:
+            break
+        knee = cur["clients"]
+    return knee
+
+
+def sweep_query(pool: ReplicaPoolSet, query: str, levels: List[int], warmup: int, repetitions: int,
+                cold_drop_caches: bool) -> Dict[str, Any]:
+    fp = shape_fingerprint(query)
+    dropped = drop_caches(pool) if cold_drop_caches else []
+    cold = {**_run_once(pool, query), "source": "cold"}  # results_db compare فقط source=db را مقایسه می‌کند
+    for _ in range(warmup):
+        _run_once(pool, query)
+
+    rows = [run_level(pool, query, c, repetitions) for c in levels]
+    base = rows[0]["qps"] if rows and rows[0]["clients"] == 1 else 0.0
+    for r in rows:
+        r["scaling_efficiency"] = r["qps"] / (r["clients"] * base) if base > 0 else None
+    warm_p50 = rows[0]["latency"]["p50_sec"] if rows else 0.0
+    return {
+        "fingerprint": fp,
+        "query": query,
+        "cold_latency_sec": cold["latency_s"],
+        "cold_caches_dropped": dropped,
+        "warm_p50_latency_sec": warm_p50,
+        "cold_warm_ratio": cold["latency_s"] / warm_p50 if warm_p50 > 0 else None,
+        "knee_clients": knee_point(rows),
+        "levels": rows,
+        "cold_record": cold,
+    }
+
+
+def save_sweep_figure(report: Dict[str, Any], out_png: Path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 3, figsize=(17, 5))
+    for i, q in enumerate(report["queries"], 1):
+        c = [r["clients"] for r in q["levels"]]
+        line, = axes[0].plot(c, [r["qps"] for r in q["levels"]], marker="o", label=f"Q{i}")
+        if q["knee_clients"] is not None:
+            knee = next(r for r in q["levels"] if r["clients"] == q["knee_clients"])
+            axes[0].scatter([knee["clients"]], [knee["qps"]], s=120, facecolors="none", edgecolors=line.get_color())
+        axes[1].plot(c, [r["scaling_efficiency"] or 0.0 for r in q["levels"]], marker="o", label=f"Q{i}")
+        axes[2].plot(c, [r["latency"]["p50_sec"] for r in q["levels"]], marker="o", label=f"Q{i} p50")
+    axes[0].set_title("Throughput (knee circled)")
+    axes[0].set_ylabel("queries / s")
+    axes[1].axhline(1.0, color="gray", linewidth=0.8)
+    axes[1].set_title("Scaling efficiency")
+    axes[2].set_yscale("log")
+    axes[2].set_title("p50 latency (s)")
+    for ax in axes:
+        ax.set_xscale("log", base=2)
+        ax.set_xlabel("concurrency")
+        ax.grid(alpha=0.3)
+        ax.legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(out_png, dpi=150)
+    plt.close(fig)
+
+
+def run_sweep(queries: List[str], max_clients: int, results_base: Path, warmup: int = SWEEP_WARMUP,
+              repetitions: int = SWEEP_REPETITIONS, cold_drop_caches: bool = False,
+              results_db=None, run_id: Optional[str] = None) -> Path:
+    """Sweeps every query and writes ``<results_base>/sweeps/sweep_<ts>.json`` and its PNG."""
+    from query_scenarios.results_db import execution_row
+
+    levels = concurrency_levels(max_clients)
+    # یک pool مشترک با اندازه‌ی بزرگ‌ترین سطح؛ warm() همه‌ی اتصال‌ها را از قبل باز می‌کند
+    pool = ReplicaPoolSet(replica_registry(), "sweep", min_size=levels[-1], max_size=levels[-1]).warm()
+    report = {
+        "levels": levels,
+        "warmup": warmup,
+        "repetitions": repetitions,
+        "knee_min_gain": KNEE_MIN_GAIN,
+        "queries": [],
+    }
+    for i, q in enumerate(queries, 1):
+        print(f"\n🚀 Sweep Q{i} over concurrency {levels}")
+        res = sweep_query(pool, q, levels, warmup, repetitions, cold_drop_caches)
+        for r in res["levels"]:
+            eff = r["scaling_efficiency"]
+            print(f"[sweep] Q{i} c={r['clients']:3d} qps={r['qps']:8.2f} p50={r['latency']['p50_sec']*1000:9.1f}ms "
+                  f"p99={r['latency']['p99_sec']*1000:9.1f}ms eff={eff if eff is None else round(eff, 2)}")
+        print(f"[sweep] Q{i} cold={res['cold_latency_sec']:.3f}s warm p50={res['warm_p50_latency_sec']:.3f}s "
+              f"knee at c={res['knee_clients']}")
+        cold = res.pop("cold_record")
+        if results_db is not None:
+            rows = [execution_row(cold, report_id="cold")]
+            rows += [execution_row(rec, report_id=f"c{r['clients']}") for r in res["levels"] for rec in r["records"]]
+            results_db.append(run_id, rows)
+        for r in res["levels"]:
+            del r["records"]  # JSON فقط خلاصه‌ها؛ همه‌ی اجراها در results_db
+        report["queries"].append(res)
+    report["pool"] = pool.stats()
+
+    # زیرپوشه‌ی جدا تا glob های results/<profile>/*.json (combined_scenarios) آن را برندارند
+    out_dir = results_base / "sweeps"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out = out_dir / f"sweep_{stamp}.json"
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+    png = out_dir / f"sweep_{stamp}.png"
+    save_sweep_figure(report, png)
+    print(f"🖼️ saved figure: {png}")
+    return out
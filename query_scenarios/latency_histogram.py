@@ -0,0 +1,156 @@
+import math
+from typing import Dict, Iterable, Optional
+
+# ---------------- Mergeable latency histograms ----------------
+# باکت‌های لگاریتمی (HDR-style): مرز باکت i برابر min_s·γ^i با γ=(1+e)/(1-e)؛ هر صدک با خطای نسبی ≤ e.
+# فقط شمارش هر باکت ذخیره می‌شود، پس merge دو هیستوگرام با تنظیمات یکسان دقیقاً برابر
+# هیستوگرام همه‌ی نمونه‌ها با هم است (برخلاف میانگینِ میانگین‌ها یا میانگینِ صدک‌ها).
+DEFAULT_RELATIVE_ERROR = 0.01
+DEFAULT_MIN_S = 1e-6  # کوچک‌تر از 1µs در باکت صفر
+# total = queue_wait + execution؛ client = latency ی که خود کلاینت اندازه گرفته (سرورها)
+REPORT_KEYS = ("total", "execution", "queue_wait", "client")
+
+
+class LatencyHistogram:
+    """Sparse log-bucketed histogram of seconds; ``merge`` is exact, percentiles within ``relative_error``."""
+
+    def __init__(self, relative_error: float = DEFAULT_RELATIVE_ERROR, min_s: float = DEFAULT_MIN_S):
+        self.relative_error = relative_error
+        self.min_s = min_s
+        self._log_gamma = math.log((1 + relative_error) / (1 - relative_error))
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.sum_s = 0.0
+        self.min_seen = math.inf
+        self.max_seen = 0.0
+
+    def _index(self, seconds: float) -> int:
+        if seconds <= self.min_s:
+            return 0
+        return int(math.ceil(math.log(seconds / self.min_s) / self._log_gamma))
+
+    def _value(self, index: int) -> float:
+        # نقطه‌ی میانی باکت (γ^(i-1), γ^i]؛ خطای نسبی آن حداکثر e است
+        if index == 0:
+            return self.min_s
+        gamma = math.exp(self._log_gamma)
+        return self.min_s * gamma ** index * 2 / (1 + gamma)
+
+    def record(self, seconds: float, n: int = 1):
+        seconds = max(0.0, float(seconds))
+        idx = self._index(seconds)
+        self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += n
+        self.sum_s += seconds * n
+        self.min_seen = min(self.min_seen, seconds)
+        self.max_seen = max(self.max_seen, seconds)
+
+    def extend(self, values: Iterable[float]) -> "LatencyHistogram":
+        for v in values:
+            self.record(v)
+        return self
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        if (other.relative_error, other.min_s) != (self.relative_error, self.min_s):
+            raise ValueError("cannot merge histograms with different bucket layouts")
+        for idx, c in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + c
+        self.count += other.count
+        self.sum_s += other.sum_s
+        self.min_seen = min(self.min_seen, other.min_seen)
+        self.max_seen = max(self.max_seen, other.max_seen)
+        return self
+
+    def percentile(self, q: float) -> float:
+        """``q`` in [0, 1]; exact min/max at the ends."""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen > rank:
+                return min(max(self._value(idx), self.min_seen), self.max_seen)
+        return self.max_seen
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_sec": self.sum_s / self.count if self.count else 0.0,
+            "p50_sec": self.percentile(0.50),
+            "p90_sec": self.percentile(0.90),
+            "p99_sec": self.percentile(0.99),
+            "max_sec": self.max_seen,
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "relative_error": self.relative_error,
+            "min_s": self.min_s,
+            "count": self.count,
+            "sum_s": self.sum_s,
+            "min_seen_s": self.min_seen if self.count else 0.0,
+            "max_seen_s": self.max_seen,
+            "buckets": {str(k): v for k, v in sorted(self.counts.items())},  # کلید JSON باید رشته باشد
+            "summary": self.summary(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "LatencyHistogram":
+        h = cls(relative_error=float(d["relative_error"]), min_s=float(d["min_s"]))
+        h.counts = {int(k): int(v) for k, v in d["buckets"].items()}
+        h.count = int(d["count"])
+        h.sum_s = float(d["sum_s"])
+        h.min_seen = float(d["min_seen_s"]) if h.count else math.inf
+        h.max_seen = float(d["max_seen_s"])
+        return h
+
+
+def latency_report(execution: Iterable[float], queue_wait: Optional[Iterable[float]] = None,
+                   fingerprints: Optional[Iterable[str]] = None, client: Optional[Iterable[float]] = None) -> Dict:
+    """
+    Histograms for one scenario: ``total`` (= queue wait + execution), ``execution``, ``queue_wait``,
+    optionally ``client`` and ``execution`` per query fingerprint. Lists are aligned per query.
+    """
+    execution = list(execution)
+    waits = list(queue_wait) if queue_wait is not None else [0.0] * len(execution)
+    fps = list(fingerprints) if fingerprints is not None else [None] * len(execution)
+    total, exe, wait = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    per_query: Dict[str, LatencyHistogram] = {}
+    for e, w, fp in zip(execution, waits, fps):
+        exe.record(e)
+        wait.record(w)
+        total.record(e + w)
+        if fp is not None:
+            per_query.setdefault(fp, LatencyHistogram()).record(e)
+    out = {
+        "total": total.to_dict(),
+        "execution": exe.to_dict(),
+        "queue_wait": wait.to_dict(),
+        "per_query": {fp: h.to_dict() for fp, h in per_query.items()},
+    }
+    if client is not None:
+        out["client"] = LatencyHistogram().extend(client).to_dict()
+    return out
+
+
+def merge_reports(reports: Iterable[Dict]) -> Dict:
+    """Exact merge of several :func:`latency_report` outputs (e.g. one per scenario JSON)."""
+    merged: Dict[str, LatencyHistogram] = {}
+    per_query: Dict[str, LatencyHistogram] = {}
+    for rep in reports:
+        for key in REPORT_KEYS:
+            if key in rep:
+                h = LatencyHistogram.from_dict(rep[key])
+                merged[key] = merged[key].merge(h) if key in merged else h
+        for fp, d in (rep.get("per_query") or {}).items():
+            h = LatencyHistogram.from_dict(d)
+            per_query[fp] = per_query[fp].merge(h) if fp in per_query else h
+    out = {k: h.to_dict() for k, h in merged.items()}
+    out["per_query"] = {fp: h.to_dict() for fp, h in per_query.items()}
+    return out
+
+
+def percentile_table(report: Dict) -> Dict[str, Dict[str, float]]:
+    """``{"total": summary, "execution": ..., "queue_wait": ...}`` — the compact view for JSON/figures."""
+    return {k: report[k]["summary"] for k in REPORT_KEYS if k in report}
@@ -1,12 +1,11 @@
 import os
 import time
+import heapq
 import psutil
+import numpy as np
 import threading
 from dataclasses import dataclass, asdict
-from typing import Dict, Tuple, Callable, Any, List
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from typing import Dict, Tuple, Callable, Any, List, Optional
 from datetime import datetime
 
 @dataclass
@@ -50,65 +49,178 @@ def _rate_over(window_sec: float, getter: Callable[[], int]) -> float:
     dt = max(time.perf_counter() - t0, 1e-6)
     return max(0.0, (v1 - v0) / dt)
 
-class DuringSampler:
-    def __init__(self, interval_sec: float = 0.1):
+# ---------------- Shared resource collector ----------------
+# یک sampler برای کل پروسه (به‌جای یک thread برای هر کوئری) که در ring buffer ثابت NumPy می‌نویسد؛
+# pre/during/post هر کوئری بعداً از روی timestamp های شروع/پایانش محاسبه می‌شود.
+# production: روی مسیر درخواست فقط timestamp ها ثبت می‌شوند.
+# benchmark:  snapshot های بلاک‌کننده‌ی pre/post + post_sleep مثل قبل (during از همین collector).
+METRICS_MODE = os.getenv("METRICS_MODE", "production")
+COLLECTOR_INTERVAL_S = float(os.getenv("COLLECTOR_INTERVAL_S", "0.1"))
+COLLECTOR_HISTORY_S = float(os.getenv("COLLECTOR_HISTORY_S", "600"))
+PRE_WINDOW_S = 0.2     # مثل پنجره‌ی _rate_over قبل از کوئری
+POST_WINDOW_S = 0.45   # post_sleep + پنجره‌ی _rate_over بعد از کوئری
+
+# ستون‌های ring buffer
+_TS, _CPU, _MEM, _THR, _FDS, _NET = range(6)
+
+@dataclass
+class QueryWindow:
+    start: float                            # wall clock
+    end: float
+    metrics: Optional[QueryMetrics] = None  # فقط در حالت benchmark فوراً پر است
+
+class RingBuffer:
+    """Fixed ``capacity × fields`` float64 array allocated once; the oldest row is overwritten."""
+
+    def __init__(self, capacity: int, fields: int):
+        self._buf = np.zeros((capacity, fields), dtype=np.float64)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        self._buf[self._next] = row
+        self._next = (self._next + 1) % len(self._buf)
+        self._count = min(self._count + 1, len(self._buf))
+
+    def ordered(self) -> np.ndarray:
+        """Copy of the rows, oldest first."""
+        if self._count < len(self._buf):
+            return self._buf[:self._count].copy()
+        return np.concatenate((self._buf[self._next:], self._buf[:self._next]))
+
+class ResourceCollector:
+    """One sampler thread per process; query metrics are derived from its history after the fact."""
+
+    def __init__(self, interval_sec: float = COLLECTOR_INTERVAL_S, history_sec: float = COLLECTOR_HISTORY_S):
         self.interval = interval_sec
-        self._stop = threading.Event()
-        self._cpu: List[float] = []
-        self._mem: List[float] = []
-        self._thr: List[float] = []
-        self._fds: List[float] = []
-        self._net: List[int] = [] 
-        self._t = None
-        self._len = 0
-
-    def start(self):
-        self._t = threading.Thread(target=self._run, daemon=True)
+        self._ring = RingBuffer(max(16, int(history_sec / interval_sec)), 6)
+        self._pending: List[Tuple[float, int, float, float, Callable]] = []
+        self._seq = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._proc = psutil.Process()
+        self._t = threading.Thread(target=self._run, daemon=True, name="resource-collector")
+
+    def start(self) -> "ResourceCollector":
+        psutil.cpu_percent(interval=None)  # warm-up
         self._t.start()
+        return self
+
+    def _sample(self):
+        p = self._proc
+        return (
+            time.time(),
+            psutil.cpu_percent(interval=None),
+            p.memory_info().rss / (1024 ** 2),
+            p.num_threads(),
+            p.num_fds() if hasattr(p, "num_fds") else 0,
+            _net_bytes_total(),
+        )
 
     def _run(self):
-        psutil.cpu_percent(interval=None)  # warm-up
-        while not self._stop.is_set():
-            cpu, mem, thr, fds = _snap_proc()
-            self._cpu.append(cpu)
-            self._mem.append(mem)
-            self._thr.append(thr)
-            self._fds.append(fds)
-            self._net.append(_net_bytes_total())
-            self._len += 1
+        while True:
+            sample = self._sample()
+            with self._cond:
+                self._ring.append(sample)
+                ready = []
+                while self._pending and self._pending[0][0] <= sample[_TS]:
+                    ready.append(heapq.heappop(self._pending))
+                self._in_flight = len(ready)
+                data = self._ring.ordered() if ready else None
+            for _, _, start, end, callback in ready:
+                try:
+                    callback(self._metrics_from(data, start, end))
+                except Exception as e:
+                    print(f"[metrics] callback failed: {e}")
+            if ready:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
             time.sleep(self.interval)
 
-    def stop(self):
-        self._stop.set()
-        if self._t is not None:
-            self._t.join(timeout=1.0)
-
-    def stats(self) -> Dict[str, float]:
-        net_kbps = 0.0
-        if self._len >= 2:
-            span = max((self._len - 1) * self.interval, 1e-6)
-            delta_bytes = max(0.0, float(self._net[-1] - self._net[0]))
-            net_kbps = (delta_bytes / span) / 1024.0
-
-        return dict(
-            cpu=_avg(self._cpu),
-            mem=_avg(self._mem),
-            thr=_avg(self._thr),
-            fds=_avg(self._fds),
-            net_kbps=net_kbps,
+    def submit(self, start: float, end: float, callback: Callable[[QueryMetrics], None]):
+        """``callback(metrics)`` runs on the collector thread once the post window has passed."""
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._pending, (end + POST_WINDOW_S, self._seq, start, end, callback))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Waits until every submitted query has its metrics."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout=timeout)
+
+    def history(self) -> np.ndarray:
+        with self._cond:
+            return self._ring.ordered()
+
+    def window(self, start: float, end: float) -> Dict[str, float]:
+        """Mean cpu/mem/thr/fds and network rate over ``[start, end]`` (same keys as the old sampler)."""
+        return self._window(self.history(), start, end)
+
+    def metrics_for(self, start: float, end: float) -> QueryMetrics:
+        return self._metrics_from(self.history(), start, end)
+
+    @staticmethod
+    def _window(data: np.ndarray, a: float, b: float) -> Dict[str, float]:
+        ts = data[:, _TS]
+        i = int(np.searchsorted(ts, a, side="left"))
+        j = int(np.searchsorted(ts, b, side="right"))
+        # کوئری کوتاه‌تر از فاصله‌ی نمونه‌ها: نزدیک‌ترین نمونه‌ی قبلی
+        window = data[i:j] if j > i else data[max(0, j - 1):j]
+        if not len(window):
+            return dict(cpu=0.0, mem=0.0, thr=0.0, fds=0.0, net_kbps=0.0)
+        cpu, mem, thr, fds = window[:, _CPU:_NET].mean(axis=0)
+        base, last = max(0, i - 1), max(0, j - 1)
+        dt = ts[last] - ts[base]
+        net_kbps = max(0.0, (data[last, _NET] - data[base, _NET]) / dt / 1024.0) if dt > 0 else 0.0
+        return dict(cpu=float(cpu), mem=float(mem), thr=float(thr), fds=float(fds), net_kbps=float(net_kbps))
+
+    def _metrics_from(self, data: np.ndarray, start: float, end: float) -> QueryMetrics:
+        pre = self._window(data, start - PRE_WINDOW_S, start)
+        dur = self._window(data, start, end)
+        post = self._window(data, end, end + POST_WINDOW_S)
+        return QueryMetrics(
+            cpu=PhaseMetrics(pre["cpu"], dur["cpu"], post["cpu"]),
+            memory_mb=PhaseMetrics(pre["mem"], dur["mem"], post["mem"]),
+            threads=PhaseMetrics(pre["thr"], dur["thr"], post["thr"]),
+            fds=PhaseMetrics(pre["fds"], dur["fds"], post["fds"]),
+            net_kbps=PhaseMetrics(pre["net_kbps"], dur["net_kbps"], post["net_kbps"]),
         )
 
-def run_query_with_metrics(run_query_fn: Callable[[], Any], post_sleep: float = 0.25):
+# singleton فقط وقتی یکی است که ماژول یک بار load شود؛ import با نام خالی (با sys.path به query_scenarios/)
+# نسخه‌ی دومی با collector و QueryMetrics جدا می‌ساخت و flush_metrics کالکتور اشتباه را flush می‌کرد
+if __name__ == "metrics_recorder":
+    raise ImportError("import query_scenarios.metrics_recorder, not metrics_recorder: "
+                      "a second copy would start its own collector")
+
+_collector: Optional[ResourceCollector] = None
+_collector_pid = 0
+_collector_lock = threading.Lock()
+
+def collector() -> ResourceCollector:
+    """Process-wide collector, started lazily (and again in a forked child)."""
+    global _collector, _collector_pid
+    with _collector_lock:
+        if _collector is None or _collector_pid != os.getpid():
+            _collector = ResourceCollector().start()
+            _collector_pid = os.getpid()
+        return _collector
+
+def _run_with_metrics(run_query_fn: Callable[[], Any], post_sleep: float = 0.25):
+    # (result, metrics, start, latency)؛ start درست قبل از اجرا، بعد از snapshot پیش از کوئری (~0.2s)
+    sampler = collector()
     cpu_pre, mem_pre, thr_pre, fds_pre = _snap_proc()
     pre_net_rate_kbps = (_rate_over(0.2, _net_bytes_total)) / 1024.0  # bytes/s → KB/s
 
-    sampler = DuringSampler(interval_sec=0.1)
-    sampler.start()
+    start = time.time()
     t0 = time.perf_counter()
     result = run_query_fn()
     latency = time.perf_counter() - t0
-    sampler.stop()
-    during_stats = sampler.stats()
+    # during از ring buffer مشترک؛ دیگر thread جدا برای هر کوئری ساخته نمی‌شود
+    during_stats = sampler.window(start, start + latency)
 
     time.sleep(post_sleep)
     cpu_post, mem_post, thr_post, fds_post = _snap_proc()
@@ -121,8 +233,38 @@ def run_query_with_metrics(run_query_fn: Callable[[], Any], post_sleep: float =
         fds=PhaseMetrics(fds_pre, during_stats["fds"], fds_post),
         net_kbps=PhaseMetrics(pre_net_rate_kbps, during_stats["net_kbps"], post_net_rate_kbps),
     )
+    return result, m, start, latency
+
+def run_query_with_metrics(run_query_fn: Callable[[], Any], post_sleep: float = 0.25):
+    result, m, _, latency = _run_with_metrics(run_query_fn, post_sleep)
     return result, m, latency
 
+def measure_query(run_query_fn: Callable[[], Any], post_sleep: float = 0.25):
+    """
+    ``(result, QueryWindow, latency)``. In benchmark mode the window already carries metrics;
+    in production mode only the timestamps are taken — hand the window to ``when_metrics_ready``.
+    """
+    if METRICS_MODE == "benchmark":
+        result, m, start, latency = _run_with_metrics(run_query_fn, post_sleep=post_sleep)
+        return result, QueryWindow(start, start + latency, m), latency
+    collector()  # باید از قبل در حال نمونه‌برداری باشد تا پنجره‌ی pre خالی نماند
+    start = time.time()
+    t0 = time.perf_counter()
+    result = run_query_fn()
+    latency = time.perf_counter() - t0
+    return result, QueryWindow(start, start + latency), latency
+
+def when_metrics_ready(window: QueryWindow, callback: Callable[[QueryMetrics], None]):
+    if window.metrics is not None:
+        callback(window.metrics)
+    else:
+        collector().submit(window.start, window.end, callback)
+
+def flush_metrics(timeout: float = 5.0) -> bool:
+    if _collector is None or _collector_pid != os.getpid():
+        return True
+    return _collector.flush(timeout)
+
 def _agg_phase(values: List[PhaseMetrics]) -> PhaseMetrics:
     return PhaseMetrics(
         pre=_avg([v.pre for v in values]),
@@ -141,6 +283,13 @@ def aggregate_metrics(metrics_list: List[QueryMetrics]) -> QueryMetrics:
 
 SAVE_LOCK = threading.Lock()
 
+def _pyplot():
+    # matplotlib فقط موقع رسم import می‌شود (سرورها و runner با آن بالا نمی‌آیند)
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
 def _beautify(ax, title, ylabel=None):
     ax.set_title(title, pad=10, fontsize=12)
     if ylabel:
@@ -162,9 +311,13 @@ def save_scenario_figure(
     out_dir: str,
     kpi_avg_latency_s: float | None = None,
     kpi_avg_throughput_rps: float | None = None,
+    server_stats: Dict | None = None,
+    latency_pcts: Dict | None = None,
+    name: str | None = None,
 ) -> str:
+    plt = _pyplot()
     os.makedirs(out_dir, exist_ok=True)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    ts = name or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     out_path = os.path.join(out_dir, f"{ts}.png")
 
     fig = plt.figure(figsize=(16, 8), constrained_layout=True)
@@ -192,17 +345,46 @@ def save_scenario_figure(
     _bar(ax_net, x, [agg.net_kbps.pre, agg.net_kbps.during, agg.net_kbps.post], fmt="%.1f")
     _beautify(ax_net, "Network Rate (avg)", "KB/s")
 
+    # آمار سمت ClickHouse (summarize_query_log)؛ فقط وقتی query_log در دسترس بود
+    if server_stats and server_stats.get("queries"):
+        ax_srv = fig.add_subplot(gs[1, 2])
+        _bar(ax_srv, ["Read", "Mem (avg)", "Mem (max)"], [
+            server_stats["avg_read_bytes"] / (1024 ** 2),
+            server_stats["avg_memory_usage"] / (1024 ** 2),
+            server_stats["max_memory_usage"] / (1024 ** 2),
+        ], fmt="%.1f")
+        _beautify(ax_srv, f"ClickHouse per query ({server_stats['avg_read_rows']:,.0f} rows read)", "MB")
+        projections = ", ".join(f"{k}×{v}" for k, v in server_stats.get("projections_used", {}).items())
+        ax_srv.text(0.0, -0.18, f"projections: {projections or '-'}", transform=ax_srv.transAxes, fontsize=9)
+
     fig.suptitle(f"Scenario Averages over queries", fontsize=14, y=0.98)
     if kpi_avg_latency_s is not None:
         fig.text(0.01, 0.995, f"Avg Latency: {kpi_avg_latency_s*1000:.2f} ms", va="top", fontsize=11)
     if kpi_avg_throughput_rps is not None:
         fig.text(0.26, 0.995, f"Avg Throughput: {kpi_avg_throughput_rps:.2f} rows/s", va="top", fontsize=11)
+    if latency_pcts:
+        # percentile_table: دم توزیع که میانگین پنهانش می‌کند
+        fig.text(0.01, -0.01, "\n".join(
+            f"{name}: p50 {s['p50_sec']*1000:.1f} / p90 {s['p90_sec']*1000:.1f} / p99 {s['p99_sec']*1000:.1f}"
+            f" / max {s['max_sec']*1000:.1f} ms" for name, s in latency_pcts.items()), va="top", fontsize=10)
 
     with SAVE_LOCK:
         fig.savefig(out_path, dpi=150, bbox_inches="tight")
     plt.close(fig)
     return out_path
 
+def metrics_from_dict(d: Dict) -> QueryMetrics:
+    """Inverse of :func:`metrics_to_dict`."""
+    def _pm(obj):
+        return PhaseMetrics(pre=float(obj["pre"]), during=float(obj["during"]), post=float(obj["post"]))
+    return QueryMetrics(
+        cpu=_pm(d["cpu"]),
+        memory_mb=_pm(d["memory_mb"]),
+        threads=_pm(d["threads"]),
+        fds=_pm(d["fds"]),
+        net_kbps=_pm(d["net_kbps"]),
+    )
+
 def metrics_to_dict(m: QueryMetrics) -> Dict:
     return {
         "cpu": asdict(m.cpu),
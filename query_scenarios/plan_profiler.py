@@ -0,0 +1,206 @@
+import argparse
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import load_queries
+from query_scenarios.sql_fingerprint import shape_fingerprint
+
+# ---------------- Plan / index-usage profiler ----------------
+# برای هر کوئری queries.sql و optimized_queries.sql سه EXPLAIN اجرا می‌شود (هیچ‌کدام کوئری را اجرا نمی‌کند):
+#   EXPLAIN PLAN indexes = 1 [, projections = 1]  → برای هر ReadFromMergeTree: parts/granules قبل و بعد از
+#                                                    MinMax، Partition، PrimaryKey و skip index ها + projection
+#   EXPLAIN PIPELINE                               → حداکثر موازی‌سازی (× N) و تعداد stream های خواندن
+#   EXPLAIN PLAN                                   → متن plan برای مقایسه بین نسخه‌ها
+# full scan: خواندنی که هیچ granule ای را حذف نکرده (selected == total)؛ روی جدول‌های بزرگ یعنی
+# کلید ORDER BY، partition و projection هیچ‌کدام به این کوئری کمک نکرده‌اند.
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+QUERY_FILES = {
+    "normal": PROJECT_ROOT / "query_scenarios" / "queries.sql",
+    "optimized": PROJECT_ROOT / "optimizations" / "optimized_queries.sql",
+}
+RESULTS_BASE = PROJECT_ROOT / "query_scenarios" / "results"
+
+_READ_RE = re.compile(r"^(\s*)ReadFromMergeTree\s*\((.*)\)\s*$")
+_INDEX_KINDS = ("MinMax", "Partition", "PrimaryKey", "Skip")
+_RATIO_RE = re.compile(r"^\s*(Parts|Granules|Marks|Ranges):\s*(\d+)(?:/(\d+))?\s*$")
+_NAME_RE = re.compile(r"^\s*Name:\s*(\S+)")
+_PROJECTION_TEXT_RE = re.compile(r"projection\s+['`\"]?(\w+)", re.IGNORECASE)
+_PARALLEL_RE = re.compile(r"×\s*(\d+)")
+
+
+def _explain(client, kind: str, sql: str) -> List[str]:
+    res = client.query(f"EXPLAIN {kind} {sql.strip().rstrip(';')}")
+    return [str(r[0]) for r in res.result_rows]
+
+
+def parse_index_usage(lines: List[str]) -> List[Dict[str, Any]]:
+    """One entry per ``ReadFromMergeTree`` step: table, per-index parts/granules and projections."""
+    reads: List[Dict[str, Any]] = []
+    cur: Optional[Dict[str, Any]] = None
+    index: Optional[Dict[str, Any]] = None
+    in_projections = False
+    for line in lines:
+        m = _READ_RE.match(line)
+        if m:
+            cur = {"table": m.group(2), "indexes": [], "projections": []}
+            reads.append(cur)
+            index, in_projections = None, False
+            continue
+        if cur is None:
+            continue
+        stripped = line.strip()
+        if stripped == "Indexes:":
+            in_projections = False
+            continue
+        if stripped == "Projections:":
+            in_projections, index = True, None
+            continue
+        if stripped in _INDEX_KINDS and not in_projections:
+            index = {"type": stripped}
+            cur["indexes"].append(index)
+            continue
+        if in_projections and stripped.startswith("Description:") and "not used" in stripped and cur["projections"]:
+            cur["projections"].pop()  # projection بررسی شد ولی انتخاب نشد
+            continue
+        name = _NAME_RE.match(line)
+        if name:
+            if in_projections:
+                cur["projections"].append(name.group(1))
+            elif index is not None:
+                index["name"] = name.group(1)
+            continue
+        ratio = _RATIO_RE.match(line)
+        if ratio and index is not None and not in_projections:
+            key = ratio.group(1).lower()
+            index[key] = int(ratio.group(2))
+            if ratio.group(3) is not None:
+                index[f"{key}_total"] = int(ratio.group(3))
+    for r in reads:
+        # نسخه‌های قدیمی‌تر ClickHouse: خواندن از projection فقط در توضیح ReadFromMergeTree دیده می‌شود
+        p = _PROJECTION_TEXT_RE.search(r["table"])
+        if p and p.group(1) not in r["projections"]:
+            r["projections"].append(p.group(1))
+        with_counts = [i for i in r["indexes"] if "granules_total" in i]
+        if with_counts:
+            r["parts_total"] = with_counts[0].get("parts_total")
+            r["granules_total"] = with_counts[0]["granules_total"]
+            r["parts_selected"] = with_counts[-1].get("parts")
+            r["granules_selected"] = with_counts[-1]["granules"]
+            r["full_scan"] = r["granules_selected"] >= r["granules_total"] > 0 and not r["projections"]
+        else:
+            r["full_scan"] = None  # اطلاعات index نیامد (مثلاً جدول خالی)
+    return reads
+
+
+def parse_pipeline(lines: List[str]) -> Dict[str, Any]:
+    counts = [int(m.group(1)) for line in lines for m in _PARALLEL_RE.finditer(line)]
+    sources = [int(m.group(1)) for line in lines if "MergeTree" in line for m in _PARALLEL_RE.finditer(line)]
+    return {
+        "max_parallelism": max(counts) if counts else 1,
+        "read_streams": max(sources) if sources else (1 if any("MergeTree" in ln for ln in lines) else 0),
+    }
+
+
+def profile_query(client, sql: str) -> Dict[str, Any]:
+    try:
+        index_lines = _explain(client, "PLAN indexes = 1, projections = 1", sql)
+    except Exception:
+        # projections = 1 فقط در نسخه‌های جدیدتر ClickHouse وجود دارد
+        index_lines = _explain(client, "PLAN indexes = 1", sql)
+    reads = parse_index_usage(index_lines)
+    pipeline_lines = _explain(client, "PIPELINE", sql)
+    plan_lines = _explain(client, "PLAN", sql)
+    pipeline = parse_pipeline(pipeline_lines)
+    projections = sorted({p for r in reads for p in r["projections"]})
+    return {
+        "fingerprint": shape_fingerprint(sql),
+        "reads": reads,
+        "projections": projections,
+        "full_scan_tables": [r["table"] for r in reads if r["full_scan"]],
+        "parts_selected": sum(r.get("parts_selected") or 0 for r in reads),
+        "parts_total": sum(r.get("parts_total") or 0 for r in reads),
+        "granules_selected": sum(r.get("granules_selected") or 0 for r in reads),
+        "granules_total": sum(r.get("granules_total") or 0 for r in reads),
+        **pipeline,
+        "explain_indexes": index_lines,
+        "explain_pipeline": pipeline_lines,
+        "explain_plan": plan_lines,
+    }
+
+
+def profile_files(client, profiles: List[str]) -> List[Dict[str, Any]]:
+    out = []
+    for profile in profiles:
+        for i, sql in enumerate(load_queries(QUERY_FILES[profile]), 1):
+            row = {"profile": profile, "query_no": i, "query": sql}
+            try:
+                row.update(profile_query(client, sql))
+            except Exception as e:
+                row["error"] = str(e)
+            out.append(row)
+    return out
+
+
+def plan_row(p: Dict[str, Any]) -> Dict[str, Any]:
+    """``plans`` table row for :class:`~query_scenarios.results_db.ResultsDB`."""
+    return {
+        "profile": p["profile"],
+        "query_no": p["query_no"],
+        "fingerprint": p.get("fingerprint"),
+        "parts_selected": p.get("parts_selected"),
+        "parts_total": p.get("parts_total"),
+        "granules_selected": p.get("granules_selected"),
+        "granules_total": p.get("granules_total"),
+        "projections": ",".join(p.get("projections") or []),
+        "max_parallelism": p.get("max_parallelism"),
+        "read_streams": p.get("read_streams"),
+        "full_scan": int(bool(p.get("full_scan_tables"))) if "error" not in p else None,
+        "error": p.get("error"),
+    }
+
+
+def main():
+    from query_scenarios.results_db import ResultsDB, RESULTS_DB, new_run_id
+    from serving.replicas import shared_pool
+
+    ap = argparse.ArgumentParser(description="EXPLAIN-based index/projection/pipeline profile of the scenario queries.")
+    ap.add_argument("--profiles", nargs="+", choices=sorted(QUERY_FILES), default=sorted(QUERY_FILES))
+    ap.add_argument("--run-id", default=None, help="attach the plans to this results-db run (e.g. a benchmark run)")
+    ap.add_argument("--db", default=RESULTS_DB)
+    ap.add_argument("--no-db", action="store_true", help="only write the JSON")
+    args = ap.parse_args()
+
+    with shared_pool().connection() as client:
+        plans = profile_files(client, args.profiles)
+
+    for p in plans:
+        tag = f"{p['profile']:<9} Q{p['query_no']:<2}"
+        if "error" in p:
+            print(f"[plan] {tag} error: {p['error']}")
+            continue
+        flag = "FULL SCAN " + ",".join(p["full_scan_tables"]) if p["full_scan_tables"] else "pruned"
+        print(f"[plan] {tag} parts {p['parts_selected']}/{p['parts_total']} "
+              f"granules {p['granules_selected']}/{p['granules_total']} "
+              f"projection={','.join(p['projections']) or '-'} threads={p['max_parallelism']}  {flag}")
+
+    # کنار نتایج benchmark: query_scenarios/results/plans و جدول plans در همان results_db
+    out_dir = RESULTS_BASE / "plans"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out = out_dir / f"plans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(plans, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"🧾 saved json: {out}")
+    if not args.no_db:
+        db = ResultsDB(args.db)
+        run_id = args.run_id or db.start_run(new_run_id(), "plan_profiler", "+".join(args.profiles))
+        db.append_plans(run_id, [plan_row(p) for p in plans])
+        db.close()
+        print(f"[results-db] {len(plans)} plans → run {run_id}")
+    full = [p for p in plans if p.get("full_scan_tables")]
+    print(f"[plan] {len(full)}/{len(plans)} queries fall back to a full scan")
+
+
+if __name__ == "__main__":
+    main()
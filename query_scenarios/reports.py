@@ -0,0 +1,152 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+# ---------------- Scenario reports ----------------
+# مسیر پاسخ فقط داده‌ی خام را جمع می‌کند؛ JSON بلافاصله نوشته می‌شود و غنی‌سازی (system.query_log)
+# و رسم شکل در pool پس‌زمینه انجام می‌شود. رسم در یک پروسه‌ی جدا (همین ماژول به‌عنوان CLI) است تا
+# matplotlib نه GIL سرور را بگیرد و نه موقع بالا آمدن سرور import شود.
+#   subprocess: پیش‌فرض؛ thread: رسم در همان پروسه (بدون پروسه‌ی جدا)؛
+#   off: فقط JSON — بعداً با «python -m query_scenarios.reports render <json...>»
+REPORT_RENDER = os.getenv("REPORT_RENDER", "subprocess")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_RENDER_TIMEOUT_S = float(os.getenv("REPORT_RENDER_TIMEOUT_S", "120"))
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+STATUS_PENDING = "pending"    # JSON خام نوشته شده، شکل هنوز نه
+STATUS_RENDERED = "rendered"
+STATUS_FAILED = "failed"
+
+
+def new_report_id() -> str:
+    # همان قالب نام شکل‌ها؛ JSON و PNG هم‌نام می‌مانند
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    # نوشتن اتمیک: خواننده (combined_scenarios، CLI) هیچ‌وقت فایل نیمه‌کاره نمی‌بیند
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def write_report(result_dir: Path, report_id: str, data: Dict[str, Any]) -> Path:
+    """Writes the raw scenario JSON (``report_status = pending``) and returns its path."""
+    result_dir.mkdir(parents=True, exist_ok=True)
+    path = result_dir / f"{report_id}.json"
+    _write_json(path, {"report_id": report_id, "report_status": STATUS_PENDING, "figure_path": None, **data})
+    return path
+
+
+def render_report(json_path: Path) -> str:
+    """Draws the figure for one scenario JSON into ``<dir>/plots/<report_id>.png`` and marks it rendered."""
+    from query_scenarios.metrics_recorder import save_scenario_figure, metrics_from_dict
+
+    json_path = Path(json_path)
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    report_id = data.get("report_id") or json_path.stem
+    plot_path = save_scenario_figure(
+        metrics_from_dict(data["aggregated_metrics"]),
+        out_dir=str(json_path.parent / "plots"),
+        kpi_avg_latency_s=data.get("avg_latency_sec"),
+        kpi_avg_throughput_rps=data.get("avg_throughput_rows_per_sec"),
+        server_stats=data.get("server_stats"),
+        latency_pcts=data.get("latency_percentiles"),
+        name=report_id,
+    )
+    data.update(report_status=STATUS_RENDERED, figure_path=plot_path)
+    _write_json(json_path, data)
+    return plot_path
+
+
+def _render_subprocess(json_path: Path):
+    subprocess.run([sys.executable, "-m", "query_scenarios.reports", "render", str(json_path)],
+                   cwd=str(PROJECT_ROOT), check=True, timeout=REPORT_RENDER_TIMEOUT_S,
+                   stdout=subprocess.DEVNULL)
+
+
+class ReportPipeline:
+    """
+    ``submit(collect)`` returns a report ID at once; in the background ``collect()`` gathers the
+    scenario data, the raw JSON is written, ``enrich(data)`` may add slow parts, then the figure is drawn.
+    """
+
+    def __init__(self, result_dir: Path, workers: int = REPORT_WORKERS, render: str = REPORT_RENDER):
+        self.result_dir = Path(result_dir)
+        self.render = render
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._lock = threading.Lock()
+        self.status: Dict[str, str] = {}
+
+    def submit(self, collect: Callable[[], Optional[Dict[str, Any]]],
+               enrich: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> tuple[str, Future]:
+        report_id = new_report_id()
+        with self._lock:
+            self.status[report_id] = "collecting"
+        return report_id, self._executor.submit(self._run, report_id, collect, enrich)
+
+    def _set(self, report_id: str, status: str):
+        with self._lock:
+            self.status[report_id] = status
+
+    def _run(self, report_id: str, collect, enrich) -> Optional[Path]:
+        try:
+            data = collect()
+            if data is None:
+                self._set(report_id, "empty")
+                return None
+            path = write_report(self.result_dir, report_id, data)
+            print(f"[report] {report_id}: raw json saved: {path}")
+            if enrich is not None:
+                data = enrich(data)
+                write_report(self.result_dir, report_id, data)
+            self._set(report_id, STATUS_PENDING)
+            if self.render == "subprocess":
+                _render_subprocess(path)
+            elif self.render == "thread":
+                render_report(path)
+            else:
+                return path  # off: CLI بعداً رسم می‌کند
+            self._set(report_id, STATUS_RENDERED)
+            print(f"[report] {report_id}: figure rendered")
+            return path
+        except Exception as e:
+            self._set(report_id, STATUS_FAILED)
+            print(f"[report] {report_id} failed: {e}")
+            return None
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Render figures for scenario JSONs written by the report pipeline.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("render", help="render the given JSONs (globs allowed)")
+    r.add_argument("inputs", nargs="+")
+    r.add_argument("--pending-only", action="store_true", help="skip reports that already have a figure")
+    args = ap.parse_args()
+
+    files = sorted({Path(p) for pat in args.inputs for p in glob.glob(pat) if p.endswith(".json")})
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if "aggregated_metrics" not in data:
+            continue
+        if args.pending_only and data.get("report_status") == STATUS_RENDERED:
+            continue
+        print(f"[report] {path.name}: {render_report(path)}")
+
+
+if __name__ == "__main__":
+    main()
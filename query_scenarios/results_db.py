@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# ---------------- Benchmark results store ----------------
+# یک فایل SQLite فقط-افزودنی برای همه‌ی اجراها (runner، server1، server2): هر اجرای کوئری یک ردیف با
+# run_id، git revision، fingerprint، schema profile و متریک‌ها. UPDATE/DELETE با trigger ممنوع است؛
+# WAL تا worker های prefork هم‌زمان بنویسند.
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DB = os.getenv("RESULTS_DB", str(PROJECT_ROOT / "results" / "benchmarks.sqlite"))
+RESULTS_DB_ENABLED = os.getenv("RESULTS_DB_ENABLED", "1") == "1"
+RESULTS_DB_QUEUE = int(os.getenv("RESULTS_DB_QUEUE", "10000"))  # سقف صف نوشتن سرورها
+RESULTS_DB_FLUSH_S = 1.0
+BOOTSTRAP_ITERATIONS = 2000
+REGRESSION_THRESHOLD = 0.05  # تغییر کمتر از 5% حتی با CI معنادار گزارش نمی‌شود
+
+# ستون‌های هر اجرا (به‌جز run_id)؛ متریک‌های منبع فقط فاز during
+EXEC_COLUMNS = (
+    "recorded_at", "report_id", "fingerprint", "query_id", "source",
+    "latency_s", "queue_wait_s", "rows", "throughput", "ttfr_s",
+    "cpu_during", "memory_mb_during", "net_kbps_during",
+    "read_rows", "read_bytes", "memory_usage",
+)
+# خروجی plan_profiler (EXPLAIN) برای هر کوئری
+PLAN_COLUMNS = (
+    "profile", "query_no", "fingerprint", "parts_selected", "parts_total", "granules_selected",
+    "granules_total", "projections", "max_parallelism", "read_streams", "full_scan", "error",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    git_rev TEXT,
+    git_dirty INTEGER,
+    source TEXT,
+    schema_profile TEXT,
+    host TEXT,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS executions (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    recorded_at REAL NOT NULL,
+    report_id TEXT,
+    fingerprint TEXT,
+    query_id TEXT,
+    source TEXT,
+    latency_s REAL,
+    queue_wait_s REAL,
+    rows INTEGER,
+    throughput REAL,
+    ttfr_s REAL,
+    cpu_during REAL,
+    memory_mb_during REAL,
+    net_kbps_during REAL,
+    read_rows INTEGER,
+    read_bytes INTEGER,
+    memory_usage INTEGER
+);
+CREATE INDEX IF NOT EXISTS executions_run_fp ON executions(run_id, fingerprint);
+CREATE TABLE IF NOT EXISTS plans (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    recorded_at REAL NOT NULL,
+    profile TEXT,
+    query_no INTEGER,
+    fingerprint TEXT,
+    parts_selected INTEGER,
+    parts_total INTEGER,
+    granules_selected INTEGER,
+    granules_total INTEGER,
+    projections TEXT,
+    max_parallelism INTEGER,
+    read_streams INTEGER,
+    full_scan INTEGER,
+    error TEXT
+);
+CREATE TRIGGER IF NOT EXISTS executions_no_update BEFORE UPDATE ON executions
+    BEGIN SELECT RAISE(ABORT, 'executions is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS executions_no_delete BEFORE DELETE ON executions
+    BEGIN SELECT RAISE(ABORT, 'executions is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS plans_no_update BEFORE UPDATE ON plans
+    BEGIN SELECT RAISE(ABORT, 'plans is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS plans_no_delete BEFORE DELETE ON plans
+    BEGIN SELECT RAISE(ABORT, 'plans is append-only'); END;
+"""
+
+
+def git_revision() -> tuple[str, bool]:
+    """``(sha, dirty)`` of the working tree; ``("unknown", False)`` outside git."""
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                             text=True, timeout=5, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, timeout=5).stdout.strip() != ""
+        return rev, dirty
+    except Exception:
+        return "unknown", False
+
+
+def execution_row(record: Dict[str, Any], report_id: Optional[str] = None,
+                  server: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Maps a scenario record (runner/server result dict) to an ``executions`` row."""
+    m = record.get("metrics")
+    if m is not None and not isinstance(m, dict):
+        from query_scenarios.metrics_recorder import metrics_to_dict
+        m = metrics_to_dict(m)
+    server = server or {}
+    return {
+        "recorded_at": time.time(),
+        "report_id": report_id,
+        "fingerprint": record.get("fingerprint"),
+        "query_id": record.get("query_id"),
+        "source": record.get("source", "db"),
+        "latency_s": record.get("latency_s"),
+        "queue_wait_s": record.get("queue_wait_s", 0.0),
+        "rows": record.get("rows"),
+        "throughput": record.get("throughput"),
+        "ttfr_s": record.get("ttfr_s"),
+        "cpu_during": m["cpu"]["during"] if m else None,
+        "memory_mb_during": m["memory_mb"]["during"] if m else None,
+        "net_kbps_during": m["net_kbps"]["during"] if m else None,
+        "read_rows": server.get("read_rows"),
+        "read_bytes": server.get("read_bytes"),
+        "memory_usage": server.get("memory_usage"),
+    }
+
+
+class ResultsDB:
+    """Thin wrapper over the SQLite file; one connection per instance (use one per thread)."""
+
+    def __init__(self, path: str = RESULTS_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+
+    def start_run(self, run_id: str, source: str, schema_profile: str, meta: Optional[Dict] = None,
+                  shared: bool = False) -> str:
+        """Registers *run_id*; an existing id raises ``sqlite3.IntegrityError`` unless *shared*."""
+        rev, dirty = git_revision()
+        with self.conn:
+            # shared: worker های prefork همه همان run_id را ثبت می‌کنند (INSERT OR IGNORE)؛
+            # در غیر این صورت run تکراری خطاست تا دو اجرای جدا در یک run ادغام نشوند
+            self.conn.execute(
+                f"INSERT {'OR IGNORE ' if shared else ''}INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, time.time(), rev, int(dirty), source, schema_profile, socket.gethostname(),
+                 json.dumps(meta or {}, ensure_ascii=False)),
+            )
+        return run_id
+
+    def append(self, run_id: str, rows: Iterable[Dict[str, Any]]) -> int:
+        data = [(run_id, *[r.get(c) for c in EXEC_COLUMNS]) for r in rows]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO executions (run_id, {', '.join(EXEC_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(EXEC_COLUMNS) + 1))})", data)
+        return len(data)
+
+    def append_plans(self, run_id: str, rows: Iterable[Dict[str, Any]]) -> int:
+        now = time.time()
+        data = [(run_id, now, *[r.get(c) for c in PLAN_COLUMNS]) for r in rows]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO plans (run_id, recorded_at, {', '.join(PLAN_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(PLAN_COLUMNS) + 2))})", data)
+        return len(data)
+
+    def runs(self) -> List[Dict[str, Any]]:
+        cur = self.conn.execute(
+            "SELECT r.run_id, r.started_at, r.git_rev, r.git_dirty, r.source, r.schema_profile, count(e.run_id) "
+            "FROM runs r LEFT JOIN executions e USING (run_id) GROUP BY r.run_id ORDER BY r.started_at")
+        keys = ("run_id", "started_at", "git_rev", "git_dirty", "source", "schema_profile", "executions")
+        return [dict(zip(keys, row)) for row in cur]
+
+    def samples(self, run_id: str, column: str) -> Dict[str, np.ndarray]:
+        """``{fingerprint: values}`` of one metric column for a run (cache hits excluded)."""
+        if column not in EXEC_COLUMNS:
+            raise ValueError(f"unknown column {column}")
+        out: Dict[str, List[float]] = {}
+        cur = self.conn.execute(
+            f"SELECT fingerprint, {column} FROM executions "
+            f"WHERE run_id = ? AND source = 'db' AND {column} IS NOT NULL", (run_id,))
+        for fp, value in cur:
+            out.setdefault(fp, []).append(value)
+        return {fp: np.asarray(v, dtype=float) for fp, v in out.items()}
+
+    def close(self):
+        self.conn.close()
+
+
+def new_run_id() -> str:
+    """``<timestamp>-<git rev>-<random>``; two runs started in the same second get different ids."""
+    rev, _ = git_revision()
+    # بدون پسوند تصادفی، دو اجرای هم‌ثانیه (مثلاً runner و plan_profiler در run.sh) با INSERT OR IGNORE یکی می‌شدند
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{rev[:7]}-{os.urandom(3).hex()}"
+
+
+class ExecutionWriter:
+    """
+    Background batch writer for the servers: ``submit`` only enqueues (bounded; dropped rows are
+    counted), a daemon thread inserts every ``RESULTS_DB_FLUSH_S``.
+    """
+
+    def __init__(self, source: str, schema_profile: str, run_id: Optional[str] = None, path: str = RESULTS_DB):
+        self.run_id = run_id  # None: موقع اولین submit (بعد از fork) تعیین می‌شود
+        self.source = source
+        self.schema_profile = schema_profile
+        self.path = path
+        self.dropped = 0
+        self._q: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=RESULTS_DB_QUEUE)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # thread بعد از fork در هر worker دوباره ساخته می‌شود
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # BENCH_RUN_ID: در prefork قبل از fork تنظیم می‌شود تا همه‌ی worker ها یک run باشند
+                self.run_id = self.run_id or os.getenv("BENCH_RUN_ID") or new_run_id()
+                self._thread = threading.Thread(target=self._run, daemon=True, name="results-db")
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, row: Dict[str, Any]):
+        if not RESULTS_DB_ENABLED:
+            return
+        self._ensure_started()
+        try:
+            self._q.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        try:
+            db = ResultsDB(self.path)
+            db.start_run(self.run_id, self.source, self.schema_profile, {"pid": os.getpid()}, shared=True)
+        except Exception as e:
+            print(f"[results-db] disabled: {e}")
+            return
+        print(f"[results-db] run {self.run_id} → {self.path}")
+        while True:
+            batch = [self._q.get()]
+            time.sleep(RESULTS_DB_FLUSH_S)
+            while True:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                db.append(self.run_id, batch)
+            except Exception as e:
+                print(f"[results-db] append failed ({len(batch)} rows): {e}")
+
+
+# ---------------- Comparison ----------------
+def bootstrap_ratio_ci(a: np.ndarray, b: np.ndarray, stat=np.median, iterations: int = BOOTSTRAP_ITERATIONS,
+                       alpha: float = 0.05, seed: int = 0) -> tuple[float, float, float]:
+    """``stat(b) / stat(a)`` and its percentile-bootstrap ``(1 - alpha)`` CI."""
+    rng = np.random.default_rng(seed)
+    ia = rng.integers(0, len(a), size=(iterations, len(a)))
+    ib = rng.integers(0, len(b), size=(iterations, len(b)))
+    ratios = stat(b[ib], axis=1) / np.maximum(stat(a[ia], axis=1), 1e-12)
+    lo, hi = np.quantile(ratios, [alpha / 2, 1 - alpha / 2])
+    return float(stat(b) / max(stat(a), 1e-12)), float(lo), float(hi)
+
+
+def compare_runs(db: ResultsDB, base: str, cand: str, iterations: int = BOOTSTRAP_ITERATIONS,
+                 threshold: float = REGRESSION_THRESHOLD, min_samples: int = 3) -> List[Dict[str, Any]]:
+    """
+    Per fingerprint: median latency ratio and mean throughput ratio (cand / base) with bootstrap CIs.
+    ``regression`` when the whole CI is beyond ``threshold`` in the bad direction, ``improvement`` likewise.
+    """
+    out = []
+    for column, stat, higher_is_worse in (("latency_s", np.median, True), ("throughput", np.mean, False)):
+        sa, sb = db.samples(base, column), db.samples(cand, column)
+        for fp in sorted(set(sa) & set(sb)):
+            a, b = sa[fp], sb[fp]
+            row = {"fingerprint": fp, "metric": column, "n_base": len(a), "n_cand": len(b)}
+            if len(a) < min_samples or len(b) < min_samples:
+                out.append({**row, "verdict": "too few samples"})
+                continue
+            ratio, lo, hi = bootstrap_ratio_ci(a, b, stat, iterations)
+            worse = lo > 1 + threshold if higher_is_worse else hi < 1 - threshold
+            better = hi < 1 - threshold if higher_is_worse else lo > 1 + threshold
+            out.append({**row, "base": float(stat(a)), "cand": float(stat(b)), "ratio": ratio, "ci_low": lo,
+                        "ci_high": hi, "verdict": "regression" if worse else "improvement" if better else "ok"})
+    return out
+
+
+def import_json(db: ResultsDB, paths: Iterable[str], run_id: str, source: str, schema_profile: str) -> int:
+    """Loads legacy scenario JSONs (the ones with a per-query ``queries`` list) into one run."""
+    db.start_run(run_id, source, schema_profile, {"imported_from": "json"})
+    n = 0
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            data = json.load(f)
+        rows = [execution_row({"latency_s": q.get("latency_sec"), "queue_wait_s": q.get("queue_wait_sec", 0.0),
+                               "rows": q.get("rows"), "throughput": q.get("throughput_rows_per_sec"),
+                               "ttfr_s": q.get("ttfr_sec"), "fingerprint": q.get("fingerprint")},
+                              report_id=Path(p).stem, server=q.get("server"))
+                for q in data.get("queries") or []]
+        n += db.append(run_id, rows)
+    return n
+
+
+def main():
+    import glob
+
+    ap = argparse.ArgumentParser(description="Benchmark results store: list runs, compare two runs, import JSON.")
+    ap.add_argument("--db", default=RESULTS_DB)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("runs", help="list recorded runs")
+    c = sub.add_parser("compare", help="per-query regressions of CAND against BASE")
+    c.add_argument("base")
+    c.add_argument("cand")
+    c.add_argument("--iterations", type=int, default=BOOTSTRAP_ITERATIONS)
+    c.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    c.add_argument("--json", action="store_true", help="print rows as JSON")
+    i = sub.add_parser("import", help="import legacy scenario JSON files as one run")
+    i.add_argument("inputs", nargs="+")
+    i.add_argument("--run-id", default=None)
+    i.add_argument("--source", default="scenario_runner")
+    i.add_argument("--schema-profile", default="normal")
+    args = ap.parse_args()
+
+    db = ResultsDB(args.db)
+    if args.cmd == "runs":
+        for r in db.runs():
+            dirty = "+dirty" if r["git_dirty"] else ""
+            print(f"{r['run_id']:<32} {r['git_rev'][:10]}{dirty:<7} {r['source']:<16} "
+                  f"{r['schema_profile']:<10} {r['executions']:>7} executions")
+    elif args.cmd == "compare":
+        rows = compare_runs(db, args.base, args.cand, args.iterations, args.threshold)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            for r in rows:
+                if "ratio" not in r:
+                    print(f"{r['fingerprint'][:16]:<16} {r['metric']:<11} {r['verdict']}")
+                    continue
+                print(f"{r['fingerprint'][:16]:<16} {r['metric']:<11} {r['base']:>12.4f} → {r['cand']:>12.4f}  "
+                      f"×{r['ratio']:.3f} [{r['ci_low']:.3f}, {r['ci_high']:.3f}]  {r['verdict']}")
+        regressions = sum(r["verdict"] == "regression" for r in rows)
+        print(f"[compare] {regressions} regression(s) over {len(rows)} query/metric pairs")
+        sys.exit(1 if regressions else 0)
+    else:
+        files = sorted({p for pat in args.inputs for p in glob.glob(pat) if p.endswith(".json")})
+        run_id = args.run_id or new_run_id()
+        print(f"[import] {import_json(db, files, run_id, args.source, args.schema_profile)} executions → {run_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from query_scenarios.latency_histogram import LatencyHistogram
+from query_scenarios.metrics_recorder import PhaseMetrics, QueryMetrics, metrics_to_dict
+
+# ---------------- Online scenario aggregation ----------------
+# به‌جای لیست همه‌ی نتایج (که زیر بار مداوم بی‌حد رشد می‌کند) فقط جمع‌ها، شمارنده‌ها و هیستوگرام‌ها
+# نگه داشته می‌شوند؛ حافظه مستقل از تعداد کوئری‌هاست. snapshot فقط پنجره‌ی فعلی را با یک پنجره‌ی
+# خالی عوض می‌کند (O(1) زیر lock)؛ گزارش‌سازی بیرون از lock انجام می‌شود.
+AGG_MAX_FINGERPRINTS = int(os.getenv("AGG_MAX_FINGERPRINTS", "1000"))
+AGG_QUERY_ID_SAMPLE = int(os.getenv("AGG_QUERY_ID_SAMPLE", "1000"))  # برای system.query_log
+OTHER_FINGERPRINT = "__other__"  # بعد از AGG_MAX_FINGERPRINTS شکل مختلف
+
+METRIC_FIELDS = ("cpu", "memory_mb", "threads", "fds", "net_kbps")
+PHASES = ("pre", "during", "post")
+
+
+class ScenarioWindow:
+    """Mergeable, JSON-serializable aggregate of the results recorded in one time window."""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = time.time() if started_at is None else started_at
+        self.ended_at: Optional[float] = None
+        self.count = 0
+        self.sources: Counter = Counter()
+        self.sums = {"rows": 0.0, "throughput": 0.0, "ttfr_s": 0.0}
+        self.metrics_count = 0
+        self.metric_sums = {f: {p: 0.0 for p in PHASES} for f in METRIC_FIELDS}
+        self.execution = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+        self.total = LatencyHistogram()
+        # fingerprint → {"count", "rows", "throughput", "execution": LatencyHistogram}
+        self.per_query: Dict[str, Dict[str, Any]] = {}
+        self.query_ids: deque = deque(maxlen=AGG_QUERY_ID_SAMPLE)  # آخرین اجراهای واقعی
+
+    def _fp_entry(self, fp: str) -> Dict[str, Any]:
+        entry = self.per_query.get(fp)
+        if entry is None:
+            if len(self.per_query) >= AGG_MAX_FINGERPRINTS:
+                fp = OTHER_FINGERPRINT
+                entry = self.per_query.get(fp)
+            if entry is None:
+                entry = self.per_query[fp] = {"count": 0, "rows": 0.0, "throughput": 0.0,
+                                              "execution": LatencyHistogram()}
+        return entry
+
+    def add(self, record: Dict[str, Any]):
+        exec_s = float(record.get("latency_s", 0.0))
+        wait_s = float(record.get("queue_wait_s", 0.0))
+        self.count += 1
+        self.sources[record.get("source", "db")] += 1
+        self.sums["rows"] += int(record.get("rows", 0))
+        self.sums["throughput"] += float(record.get("throughput", 0.0))
+        self.sums["ttfr_s"] += float(record.get("ttfr_s", 0.0))
+        self.execution.record(exec_s)
+        self.queue_wait.record(wait_s)
+        self.total.record(exec_s + wait_s)
+        entry = self._fp_entry(record.get("fingerprint") or OTHER_FINGERPRINT)
+        entry["count"] += 1
+        entry["rows"] += int(record.get("rows", 0))
+        entry["throughput"] += float(record.get("throughput", 0.0))
+        entry["execution"].record(exec_s)
+        if record.get("query_id"):
+            self.query_ids.append(record["query_id"])
+        if record.get("metrics"):
+            self.add_metrics(record["metrics"])
+
+    def add_metrics(self, m):
+        """``m`` is a :class:`QueryMetrics` or its ``metrics_to_dict`` form."""
+        d = metrics_to_dict(m) if isinstance(m, QueryMetrics) else m
+        self.metrics_count += 1
+        for f in METRIC_FIELDS:
+            for p in PHASES:
+                self.metric_sums[f][p] += float(d[f][p])
+
+    def merge(self, other: "ScenarioWindow") -> "ScenarioWindow":
+        self.started_at = min(self.started_at, other.started_at)
+        if other.ended_at is not None:
+            self.ended_at = max(self.ended_at or 0.0, other.ended_at)
+        self.count += other.count
+        self.sources.update(other.sources)
+        for k, v in other.sums.items():
+            self.sums[k] += v
+        self.metrics_count += other.metrics_count
+        for f in METRIC_FIELDS:
+            for p in PHASES:
+                self.metric_sums[f][p] += other.metric_sums[f][p]
+        self.execution.merge(other.execution)
+        self.queue_wait.merge(other.queue_wait)
+        self.total.merge(other.total)
+        for fp, src in other.per_query.items():
+            entry = self._fp_entry(fp)
+            entry["count"] += src["count"]
+            entry["rows"] += src["rows"]
+            entry["throughput"] += src["throughput"]
+            entry["execution"].merge(src["execution"])
+        self.query_ids.extend(other.query_ids)
+        return self
+
+    # ---- views
+    def mean(self, key: str) -> float:
+        return self.sums[key] / self.count if self.count else 0.0
+
+    def metrics(self) -> QueryMetrics:
+        n = self.metrics_count or 1
+        return QueryMetrics(**{
+            f: PhaseMetrics(**{p: self.metric_sums[f][p] / n for p in PHASES}) for f in METRIC_FIELDS
+        })
+
+    def latency_histograms(self) -> Dict:
+        """Same layout as :func:`latency_report` (``client`` is added by the caller)."""
+        return {
+            "total": self.total.to_dict(),
+            "execution": self.execution.to_dict(),
+            "queue_wait": self.queue_wait.to_dict(),
+            "per_query": {fp: e["execution"].to_dict() for fp, e in self.per_query.items()},
+        }
+
+    def per_query_table(self) -> Dict[str, Dict]:
+        return {fp: {
+            "count": e["count"],
+            "avg_rows": e["rows"] / e["count"] if e["count"] else 0.0,
+            "avg_throughput_rows_per_sec": e["throughput"] / e["count"] if e["count"] else 0.0,
+            **e["execution"].summary(),
+        } for fp, e in self.per_query.items()}
+
+    # ---- (de)serialization: انتقال بین worker های prefork از طریق result_store
+    def to_dict(self) -> Dict:
+        return {
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "count": self.count,
+            "sources": dict(self.sources),
+            "sums": dict(self.sums),
+            "metrics_count": self.metrics_count,
+            "metric_sums": self.metric_sums,
+            "execution": self.execution.to_dict(),
+            "queue_wait": self.queue_wait.to_dict(),
+            "total": self.total.to_dict(),
+            "per_query": {fp: {"count": e["count"], "rows": e["rows"], "throughput": e["throughput"],
+                               "execution": e["execution"].to_dict()} for fp, e in self.per_query.items()},
+            "query_ids": list(self.query_ids),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "ScenarioWindow":
+        w = cls(started_at=float(d["started_at"]))
+        w.ended_at = d.get("ended_at")
+        w.count = int(d["count"])
+        w.sources = Counter(d["sources"])
+        w.sums = {k: float(v) for k, v in d["sums"].items()}
+        w.metrics_count = int(d["metrics_count"])
+        w.metric_sums = {f: {p: float(d["metric_sums"][f][p]) for p in PHASES} for f in METRIC_FIELDS}
+        w.execution = LatencyHistogram.from_dict(d["execution"])
+        w.queue_wait = LatencyHistogram.from_dict(d["queue_wait"])
+        w.total = LatencyHistogram.from_dict(d["total"])
+        w.per_query = {fp: {"count": int(e["count"]), "rows": float(e["rows"]), "throughput": float(e["throughput"]),
+                            "execution": LatencyHistogram.from_dict(e["execution"])}
+                       for fp, e in d["per_query"].items()}
+        w.query_ids.extend(d["query_ids"])
+        return w
+
+
+class ScenarioAggregator:
+    """Thread-safe current window; ``snapshot()`` hands it over and starts a new one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window = ScenarioWindow()
+
+    def add(self, record: Dict[str, Any]):
+        with self._lock:
+            self._window.add(record)
+
+    def add_metrics(self, m):
+        # server1: متریک‌ها (production) بعد از پاسخ و جدا از خود رکورد می‌رسند
+        with self._lock:
+            self._window.add_metrics(m)
+
+    def merge(self, window: ScenarioWindow):
+        with self._lock:
+            self._window.merge(window)
+
+    def __len__(self):
+        with self._lock:
+            return self._window.count
+
+    def snapshot(self, reset: bool = True) -> ScenarioWindow:
+        """``reset=True``: the window so far (new one starts now); ``False``: a copy, nothing is reset."""
+        with self._lock:
+            if not reset:
+                return ScenarioWindow.from_dict(self._window.to_dict())
+            window, self._window = self._window, ScenarioWindow()
+        window.ended_at = time.time()
+        return window
+
+
+def merge_windows(windows: List[ScenarioWindow]) -> ScenarioWindow:
+    out = ScenarioWindow()
+    for w in windows:
+        out.merge(w)
+    return out
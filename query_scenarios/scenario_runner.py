@@ -1,18 +1,30 @@
-import time, json, argparse, os, sys
+import time, json, argparse, os, sys, contextlib
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 import clickhouse_connect
 
 BASE_DIR = Path(__file__).parent
-if str(BASE_DIR) not in sys.path:
-    sys.path.append(str(BASE_DIR))
-
-from metrics_recorder import (
-    run_query_with_metrics,
+PROJECT_ROOT = BASE_DIR.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+# همیشه با نام پکیج: server1 همین ماژول‌ها را از query_scenarios.* می‌گیرد؛ import با نام خالی
+# یک نسخه‌ی دوم از metrics_recorder می‌ساخت (QueryMetrics و collector جدا در همان پروسه)
+from query_scenarios.metrics_recorder import (
+    measure_query,
+    when_metrics_ready,
+    flush_metrics,
     aggregate_metrics,
-    save_scenario_figure,
     metrics_to_dict,
 )
+from query_scenarios.sql_fingerprint import shape_fingerprint
+from query_scenarios.latency_histogram import latency_report, percentile_table
+from query_scenarios.reports import ReportPipeline
+from query_scenarios.results_db import ResultsDB, RESULTS_DB_ENABLED, execution_row, new_run_id
+from serving.streaming import count_rows_streaming
+from benchmarks.common import load_queries
+from serving.replicas import shared_pool
+from serving.query_log import new_query_id, with_query_id, fetch_query_log, summarize_query_log
 
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "localhost")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
@@ -25,85 +37,133 @@ OPTIMIZED_QUERY_FILE = BASE_DIR.parent / "optimizations" / "optimized_queries.sq
 DEFAULT_NUM_CLIENTS = 5
 DEFAULT_NUM_SCENARIOS = 1 
 
-def load_queries(path: Path):
-    text = path.read_text(encoding="utf-8")
-    raw_queries = text.split("\n\n")
-    queries = []
-    for chunk in raw_queries:
-        lines = [ln for ln in chunk.strip().splitlines() if ln.strip() and not ln.strip().startswith("--")]
-        if lines:
-            queries.append("\n".join(lines))
-    return queries
-
-def exec_one_query(client, query):
+def exec_one_query(client, query, enqueued_at=None, on_metrics=None):
     print("query = ", query)
     if client == None:
-        client = clickhouse_connect.get_client(host='localhost', port=8123, username='default', password='')
-
-    result, m, latency_s = run_query_with_metrics(lambda: client.query(query), post_sleep=0.25)
-    rows = len(result.result_rows)
+        # اتصال از pool مشترک و گرم؛ زمان ساخت اتصال داخل latency اندازه‌گیری نمی‌شود
+        with shared_pool().connection() as pooled:
+            return exec_one_query(pooled, query, enqueued_at, on_metrics)
+
+    # queue wait: از submit به executor (perf_counter) تا شروع اجرا، شامل انتظار برای اتصال
+    queue_wait_s = time.perf_counter() - enqueued_at if enqueued_at is not None else 0.0
+
+    # row count از روی block stream؛ کل نتیجه در حافظه ساخته نمی‌شود
+    # query_id صریح تا بعداً آمار همین اجرا از system.query_log خوانده شود
+    query_id = new_query_id()
+    stats, window, latency_s = measure_query(
+        lambda: count_rows_streaming(client, query, settings=with_query_id(query_id)), post_sleep=0.25)
+    rows = stats.rows
     throughput = rows / latency_s if latency_s > 0 else 0.0
-    return {
-        "metrics": m,
+    out = {
         "latency_s": latency_s,
         "rows": rows,
         "throughput": throughput,
+        "ttfr_s": stats.ttfr_s,
+        "fingerprint": shape_fingerprint(query),
+        "query_id": query_id,
+        "queue_wait_s": queue_wait_s,
     }
-
-def run_scenario(queries: list[str], scenario_id: int, clients: int, results_base: Path):
+    # METRICS_MODE=benchmark: همین حالا؛ production: وقتی collector پنجره‌ی post را دید
+    def _metrics_ready(m):
+        out["metrics"] = m
+        if on_metrics is not None:
+            on_metrics(m)
+    when_metrics_ready(window, _metrics_ready)
+    return out
+
+def run_scenario(queries: list[str], scenario_id: int, clients: int, results_base: Path,
+                 reports: ReportPipeline | None = None, results_db: ResultsDB | None = None,
+                 run_id: str | None = None):
     print(f"\n🚀 Running Scenario {scenario_id}")
     max_workers = min(clients, len(queries))
     results: list[dict] = []
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(exec_one_query, None, q) for q in queries]
+        futures = [executor.submit(exec_one_query, None, q, time.perf_counter()) for q in queries]
         for f in futures:
             results.append(f.result())
+    flush_metrics()
 
-    metrics_list = [r["metrics"] for r in results]
+    metrics_list = [r["metrics"] for r in results if "metrics" in r]
     agg = aggregate_metrics(metrics_list)
     lat_list = [r["latency_s"] for r in results]
     thr_list = [r["throughput"] for r in results]
     rows_list = [r["rows"] for r in results]
+    fp_list = [r["fingerprint"] for r in results]
+    ttfr_list = [r["ttfr_s"] for r in results]
+    wait_list = [r["queue_wait_s"] for r in results]
+    # هیستوگرام‌های قابل merge (combined_scenarios)؛ میانگین دم توزیع را پنهان می‌کند
+    latency = latency_report(lat_list, wait_list, fp_list)
+    server_stats = fetch_query_log(shared_pool(), [r["query_id"] for r in results])
+    server_list = [server_stats.get(r["query_id"]) for r in results]
+    server_summary = summarize_query_log([st for st in server_list if st])
 
     avg_latency = sum(lat_list) / len(lat_list)
     avg_throughput = sum(thr_list) / len(thr_list)
+    avg_ttfr = sum(ttfr_list) / len(ttfr_list)
 
-    RESULT_DIR = results_base
-    PLOTS_DIR = RESULT_DIR / "plots"
-    RESULT_DIR.mkdir(parents=True, exist_ok=True)
-    PLOTS_DIR.mkdir(parents=True, exist_ok=True)
-
-    plot_path = save_scenario_figure(
-        agg,
-        out_dir=str(PLOTS_DIR),
-        kpi_avg_latency_s=avg_latency,
-        kpi_avg_throughput_rps=avg_throughput
-    )
-
-    base = Path(plot_path).stem
-    json_path = RESULT_DIR / f"{base}.json"
     out = {
         "scenario_id": scenario_id,
         "avg_latency_sec": avg_latency,
         "avg_throughput_rows_per_sec": avg_throughput,
-        "queries": [{"latency_sec": l, "throughput_rows_per_sec": t, "rows": r} for l, t, r in zip(lat_list, thr_list, rows_list)],
+        "avg_ttfr_sec": avg_ttfr,
+        "latency_percentiles": percentile_table(latency),
+        "latency_histograms": latency,
+        "queries": [{"latency_sec": l, "queue_wait_sec": w, "throughput_rows_per_sec": t, "rows": r, "ttfr_sec": ttfr, "fingerprint": fp, "server": st} for l, w, t, r, ttfr, fp, st in zip(lat_list, wait_list, thr_list, rows_list, ttfr_list, fp_list, server_list)],
         "aggregated_metrics": metrics_to_dict(agg),
+        "server_stats": server_summary,
+        "pool": shared_pool().stats(),
     }
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
-
-    print(f"[scenario] saved figure: {plot_path}")
-    print(f"[scenario] saved json:   {json_path}")
+    # JSON خام همین حالا؛ شکل در پس‌زمینه تا سناریوی بعدی منتظر matplotlib نماند
+    own = reports is None
+    reports = reports or ReportPipeline(results_base)
+    report_id, _ = reports.submit(lambda: out)
+    if own:
+        reports.close(wait=True)
+    if results_db is not None:
+        # هر اجرا با متریک‌ها و آمار query_log اش؛ run ها با results_db compare مقایسه می‌شوند
+        results_db.append(run_id, [execution_row(r, report_id, st) for r, st in zip(results, server_list)])
+
+    print(f"[scenario] report {report_id}: {results_base / (report_id + '.json')}")
     print(f"✅ Scenario {scenario_id} complete. Avg latency: {avg_latency:.4f}s, Avg throughput: {avg_throughput:.2f} rows/s")
 
+class _StubClient:
+    """Two-row ``query_row_block_stream`` stand-in; no ClickHouse needed."""
+
+    def query_row_block_stream(self, sql, settings=None):
+        return contextlib.nullcontext([[(1,), (2,)]])
+
+def self_check():
+    """server1-style round trip: exec_one_query → ScenarioAggregator.add_metrics → flush_metrics."""
+    from query_scenarios.scenario_aggregator import ScenarioAggregator
+    aggregator = ScenarioAggregator()
+    result = exec_one_query(_StubClient(), "SELECT 1", on_metrics=aggregator.add_metrics)
+    aggregator.add({k: v for k, v in result.items() if k != "metrics"})
+    # نسخه‌ی دوم metrics_recorder یعنی collector دوم و TypeError در add_metrics
+    assert "metrics_recorder" not in sys.modules, "metrics_recorder imported under a bare name"
+    assert flush_metrics(), "metrics collector did not flush"
+    window = aggregator.snapshot()
+    assert window.count == 1 and window.metrics_count == 1, (window.count, window.metrics_count)
+    print("[self-check] exec_one_query → add_metrics ok")
+
 def main():
     import argparse
     p = argparse.ArgumentParser()
     p.add_argument("--optimized", action="store_true", help="Use optimized queries")
     p.add_argument("--clients", type=int, default=DEFAULT_NUM_CLIENTS, help="Number of concurrent clients")
     p.add_argument("--scenarios", type=int, default=DEFAULT_NUM_SCENARIOS, help="Number of scenarios (repetitions)")
+    p.add_argument("--benchmark", action="store_true",
+                   help="Concurrency sweep per query (1, 2, 4, … --clients) on a warmed pool instead of scenarios")
+    p.add_argument("--warmup", type=int, default=None, help="Benchmark: warmup executions per query")
+    p.add_argument("--repetitions", type=int, default=None, help="Benchmark: executions per client per level (K)")
+    p.add_argument("--drop-caches", action="store_true", help="Benchmark: drop ClickHouse caches before the cold run")
+    p.add_argument("--self-check", action="store_true",
+                   help="Run exec_one_query against a stub client into a ScenarioAggregator and exit")
     args = p.parse_args()
 
+    if args.self_check:
+        self_check()
+        return
+
     if args.optimized:
         query_path = OPTIMIZED_QUERY_FILE
         results_base = BASE_DIR / "results" / "optimized"
@@ -113,8 +173,34 @@ def main():
 
     queries = load_queries(query_path)
 
-    for i in range(1, args.scenarios + 1):
-        run_scenario(queries, i, clients=args.clients, results_base=results_base)
+    reports = ReportPipeline(results_base)
+    results_db, run_id = None, None
+    if RESULTS_DB_ENABLED:
+        results_db = ResultsDB()
+        run_id = results_db.start_run(new_run_id(), "sweep" if args.benchmark else "scenario_runner",
+                                      "optimized" if args.optimized else "normal",
+                                      {"clients": args.clients, "scenarios": args.scenarios, "benchmark": args.benchmark})
+        print(f"[results-db] run {run_id} → {results_db.path}")
+    if args.benchmark:
+        from query_scenarios.concurrency_sweep import run_sweep, SWEEP_WARMUP, SWEEP_REPETITIONS
+        try:
+            run_sweep(queries, args.clients, results_base,
+                      warmup=SWEEP_WARMUP if args.warmup is None else args.warmup,
+                      repetitions=SWEEP_REPETITIONS if args.repetitions is None else args.repetitions,
+                      cold_drop_caches=args.drop_caches, results_db=results_db, run_id=run_id)
+        finally:
+            reports.close(wait=False)
+            if results_db is not None:
+                results_db.close()
+        return
+    try:
+        for i in range(1, args.scenarios + 1):
+            run_scenario(queries, i, clients=args.clients, results_base=results_base, reports=reports,
+                         results_db=results_db, run_id=run_id)
+    finally:
+        reports.close(wait=True)  # شکل‌های باقی‌مانده قبل از خروج
+        if results_db is not None:
+            results_db.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,340 @@
+import re
+import hashlib
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+# ---- Tokenizer
+# یک regex واحد؛ ترتیب شاخه‌ها مهم است (کامنت قبل از عملگر، رشته قبل از شناسه)
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*')
+  | (?P<quoted_ident>`[^`]*`|"[^"]*")
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|==|\|\||::|->|[-+*/%=<>(),.;\[\]{}?:])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# کلمات کلیدی case-insensitive هستند؛ نام ستون/تابع در ClickHouse ممکن است case-sensitive باشد
+KEYWORDS = frozenset("""
+    select from where group by order having limit offset with as on join inner left right full
+    outer cross any all semi anti asof using and or not in is null between like ilike case when
+    then else end distinct union intersect except asc desc nulls prewhere final sample
+    settings format interval array global exists true false
+""".split())
+# این‌ها فقط در جایگاه کلمه‌ی کلیدی upper می‌شوند (INTERVAL 7 DAY، EXTRACT(MONTH FROM ..)، NULLS LAST)؛
+# در بقیه‌ی جاها شناسه‌اند (مثلاً AS month در Query 5) و شناسه در ClickHouse case-sensitive است
+# کلمات کلیدی که نام تابع هم هستند: left(s, 3)، right(s, 2)، any(x)، array(1, 2)
+FUNCTION_KEYWORDS = frozenset(("LEFT", "RIGHT", "ANY", "ARRAY"))
+# نام جایگزین alias های جدول/CTE؛ شناسه‌ی کاربر با همین پیشوند در متن کانونیکال با backtick می‌آید،
+# پس هیچ شناسه‌ی واقعی با alias جایگزین‌شده یکی نمی‌شود
+ALIAS_PREFIX = "__a"
+INTERVAL_UNITS = frozenset("second minute hour day week month quarter year".split())
+NULLS_ORDER = frozenset(("first", "last"))
+
+# پایان یک clause شرطی در همان عمق پرانتز
+_PLAIN_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+_CLAUSE_END = frozenset({
+    "GROUP", "ORDER", "LIMIT", "HAVING", "WHERE", "PREWHERE", "JOIN", "INNER", "LEFT", "RIGHT",
+    "FULL", "CROSS", "ANY", "ALL", "SEMI", "ANTI", "ASOF", "GLOBAL", "UNION", "INTERSECT",
+    "EXCEPT", "SETTINGS", "FORMAT", "WINDOW", "QUALIFY", "USING", "SAMPLE", "FINAL", ";",
+})
+_CONDITION_START = frozenset({"WHERE", "PREWHERE", "HAVING", "ON"})
+_TABLE_START = frozenset({"FROM", "JOIN"})
+
+Token = Tuple[str, str]  # (kind, text)
+_AND: Token = ("kw", "AND")
+_OR: Token = ("kw", "OR")
+_EQ: Token = ("op", "=")
+_NOT_ATOM = frozenset(("kw", w) for w in ("CASE", "WHEN", "THEN", "ELSE", "END", "NOT", "OR"))
+_COMPARISON_OPS = frozenset(("<", ">", "<=", ">=", "<>", "!=", "=="))
+
+
+def _canonical_number(text: str) -> str:
+    # 007 → 7 ، 0.950 → 0.95 ، 1. → 1.0 ، 1E3 → 1e3 ؛ نوع literal (صحیح/اعشاری) عوض نمی‌شود:
+    # 1.0 در ClickHouse Float64 است و 1 یک UInt8
+    mant, _, exp = text.lower().partition("e")
+    whole, dot, frac = mant.partition(".")
+    whole = whole.lstrip("0") or "0"
+    out = f"{whole}.{frac.rstrip('0') or '0'}" if dot else whole
+    if exp:
+        sign = "-" if exp.startswith("-") else ""
+        digits = exp.lstrip("+-").lstrip("0") or "0"
+        out = f"{out}e{sign}{digits}"
+    return out
+
+
+def _canonical_string(text: str) -> str:
+    body = text[1:-1].replace("''", "\\'")
+    return f"'{body}'"
+
+
+def _canonical_ident(name: str) -> str:
+    if name.startswith(ALIAS_PREFIX) or not _PLAIN_IDENT_RE.fullmatch(name):
+        return "`" + name.replace("`", "\\`") + "`"
+    return name
+
+
+def _keyword_position(word: str, prev: List[Tuple[Token, str]]) -> bool:
+    last = prev[-1][0] if prev else None
+    if word in NULLS_ORDER:
+        return last == ("kw", "NULLS")
+    if word not in INTERVAL_UNITS:
+        return False
+    # INTERVAL 7 DAY ، INTERVAL '7' DAY
+    if len(prev) >= 2 and prev[-2][0] == ("kw", "INTERVAL") and last[0] in ("number", "string"):
+        return True
+    # EXTRACT(DAY FROM ...)
+    return last == ("op", "(") and len(prev) >= 2 and prev[-2][1].lower() == "extract"
+
+
+def lex(sql: str) -> List[Tuple[Token, str]]:
+    """Canonical tokens paired with their source text (for rewrites that must keep alias case)."""
+    out: List[Tuple[Token, str]] = []
+    for m in _TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        text = m.group()
+        if kind in ("ws", "line_comment", "block_comment"):
+            continue
+        if kind == "ident":
+            low = text.lower()
+            if low in KEYWORDS or _keyword_position(low, out):
+                out.append((("kw", low.upper()), text))
+            else:
+                out.append((("ident", _canonical_ident(text)), text))
+        elif kind == "quoted_ident":
+            out.append((("ident", _canonical_ident(text[1:-1])), text))
+        elif kind == "number":
+            out.append((("number", _canonical_number(text)), text))
+        elif kind == "string":
+            out.append((("string", _canonical_string(text)), text))
+        else:
+            out.append((("op", text), text))
+    while out and out[-1][0] == ("op", ";"):
+        out.pop()
+    # LEFT( / ANY( ... فراخوانی تابع است نه کلمه‌ی کلیدی: نام با همان املای اصلی
+    for i in range(len(out) - 1):
+        (kind, text), raw = out[i]
+        if kind == "kw" and text in FUNCTION_KEYWORDS and out[i + 1][0] == ("op", "("):
+            out[i] = (("ident", raw), raw)
+    return out
+
+
+@lru_cache(maxsize=4096)
+def literal_template(sql: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    ``(parts, literals)`` with the *original* text: ``parts[0] + literals[0] + parts[1] + ...`` is
+    exactly *sql*. Unlike :func:`query_shape` nothing is canonicalized, so it can be executed again.
+    """
+    parts, literals, last = [], [], 0
+    for m in _TOKEN_RE.finditer(sql):
+        if m.lastgroup in ("number", "string"):
+            parts.append(sql[last:m.start()])
+            literals.append(m.group())
+            last = m.end()
+    parts.append(sql[last:])
+    return tuple(parts), tuple(literals)
+
+
+def fill_template(parts: Iterable[str], literals: Iterable[str]) -> str:
+    """Inverse of :func:`literal_template`."""
+    parts, literals = list(parts), list(literals)
+    if len(parts) != len(literals) + 1:
+        raise ValueError(f"template has {len(parts) - 1} literal slots, got {len(literals)} literals")
+    out = [parts[0]]
+    for lit, part in zip(literals, parts[1:]):
+        out.append(lit)
+        out.append(part)
+    return "".join(out)
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Lexes *sql* into canonical tokens; comments and whitespace are dropped."""
+    return [tok for tok, _ in lex(sql)]
+
+
+def _rename_aliases(tokens: List[Token]) -> List[Token]:
+    # نام CTEها و aliasهای جدول در خروجی اثری ندارند → __a1, __a2, ... به ترتیب ظهور
+    # alias ستون‌ها عمداً دست نمی‌خورند چون نام ستون‌های نتیجه را تعیین می‌کنند
+    mapping = {}
+    ctes = set()
+    n = len(tokens)
+    for i, (kind, text) in enumerate(tokens):
+        if kind != "ident":
+            continue
+        prev = tokens[i - 1] if i > 0 else None
+        nxt = tokens[i + 1] if i + 1 < n else None
+        # WITH name AS (   یا   , name AS (
+        is_cte = (prev in (("kw", "WITH"), ("op", ","))
+                  and nxt == ("kw", "AS")
+                  and i + 2 < n and tokens[i + 2] == ("op", "("))
+        # FROM table [AS] alias
+        is_table_alias = False
+        if prev == ("kw", "AS") and i >= 3 and tokens[i - 3][1] in _TABLE_START:
+            is_table_alias = tokens[i - 2][0] == "ident"
+        elif prev is not None and prev[0] == "ident" and i >= 2 and tokens[i - 2][1] in _TABLE_START:
+            is_table_alias = True
+        if is_cte:
+            ctes.add(text)
+        if (is_cte or is_table_alias) and text not in mapping:
+            mapping[text] = f"{ALIAS_PREFIX}{len(mapping) + 1}"
+    if not mapping:
+        return tokens
+
+    out = list(tokens)
+    for i, (kind, text) in enumerate(tokens):
+        if kind != "ident" or text not in mapping:
+            continue
+        prev = tokens[i - 1] if i > 0 else None
+        nxt = tokens[i + 1] if i + 1 < n else None
+        # بعد از FROM/JOIN نام جدول است: فقط اگر خودش CTE باشد عوض می‌شود (FROM t1 AS t1 جدول t1 را نگه می‌دارد)
+        if prev is not None and prev[1] in _TABLE_START:
+            if text in ctes:
+                out[i] = ("ident", mapping[text])
+        # بقیه‌ی جایگاه‌های ارجاع به جدول: تعریف یا qualifier (x.col)
+        elif (nxt == ("op", ".") or nxt == ("kw", "AS") or prev == ("kw", "AS")
+                or (prev is not None and prev[0] == "ident")):
+            out[i] = ("ident", mapping[text])
+    return out
+
+
+def _depth_step(tok: Token) -> int:
+    # CASE ... END مثل یک جفت پرانتز: AND/OR/= داخلش مال شرط بیرونی نیست
+    if tok in (("op", "("), ("kw", "CASE")):
+        return 1
+    if tok in (("op", ")"), ("kw", "END")):
+        return -1
+    return 0
+
+
+def _clause_end(tokens: List[Token], start: int) -> int:
+    depth = 0
+    i = start
+    while i < len(tokens):
+        kind, text = tokens[i]
+        step = _depth_step(tokens[i])
+        if step < 0 and depth == 0:
+            return i  # پرانتز بسته‌ی subquery ای که شرط داخلش بود
+        depth += step
+        if depth == 0 and step == 0 and kind in ("kw", "op") and text in _CLAUSE_END:
+            return i
+        i += 1
+    return i
+
+
+def _split_top(tokens: List[Token], sep: Token) -> List[List[Token]]:
+    parts: List[List[Token]] = [[]]
+    depth = 0
+    pending_between = 0
+    for tok in tokens:
+        depth += _depth_step(tok)
+        if depth == 0 and tok == ("kw", "BETWEEN"):
+            pending_between += 1
+        if depth == 0 and tok == sep:
+            # AND داخل BETWEEN x AND y جزء همان عبارت است
+            if sep == _AND and pending_between:
+                pending_between -= 1
+            else:
+                parts.append([])
+                continue
+        parts[-1].append(tok)
+    return parts
+
+
+def _top_level(tokens: List[Token]) -> List[Token]:
+    out, depth = [], 0
+    for tok in tokens:
+        step = _depth_step(tok)
+        if depth == 0:
+            out.append(tok)
+        depth += step
+    return out
+
+
+def _join(tokens: List[Token]) -> str:
+    return " ".join(t[1] for t in tokens)
+
+
+def _is_atom(conjunct: List[Token]) -> bool:
+    # فقط مقایسه‌ی ساده جابه‌جا می‌شود؛ CASE/NOT/OR در سطح بالا اولویت عملگرها را وارد بازی می‌کند
+    return bool(conjunct) and not any(t in _NOT_ATOM for t in _top_level(conjunct))
+
+
+def _swap_eq(atom: List[Token]) -> List[Token]:
+    # a = b → ترتیب ثابت دو طرف؛ فقط وقتی سطح بالا جز همان یک = کلمه‌ی کلیدی/مقایسه‌ی دیگری ندارد
+    top = _top_level(atom)
+    if top.count(_EQ) != 1 or any(k == "kw" or t in _COMPARISON_OPS for k, t in top if (k, t) != _EQ):
+        return atom
+    left, right = _split_top(atom, _EQ)
+    if not left or not right:
+        return atom
+    left, right = sorted((left, right), key=_join)
+    return left + [_EQ] + right
+
+
+def _sort_predicates(tokens: List[Token]) -> List[Token]:
+    # از آخر به اول تا شرط‌های تو در تو (subquery) قبل از والدشان مرتب شوند
+    starts = [i for i, (k, t) in enumerate(tokens) if k == "kw" and t in _CONDITION_START]
+    out = list(tokens)
+    for s in reversed(starts):
+        end = _clause_end(out, s + 1)
+        body = out[s + 1:end]
+        if len(_split_top(body, _OR)) > 1:
+            continue  # اولویت OR/AND را به هم نمی‌زنیم
+        conjuncts = _split_top(body, _AND)
+        # فقط اتم‌ها بین جایگاه‌های خودشان مرتب می‌شوند؛ بقیه همان‌جا که نوشته شده‌اند می‌مانند
+        slots = [j for j, c in enumerate(conjuncts) if _is_atom(c)]
+        for j, atom in zip(slots, sorted((_swap_eq(conjuncts[j]) for j in slots), key=_join)):
+            conjuncts[j] = atom
+        rebuilt: List[Token] = []
+        for j, c in enumerate(conjuncts):
+            if j:
+                rebuilt.append(_AND)
+            rebuilt.extend(c)
+        out[s + 1:end] = rebuilt
+    return out
+
+
+@lru_cache(maxsize=4096)
+def _canonical_tokens(sql: str) -> Tuple[Token, ...]:
+    tokens = tokenize(sql)
+    tokens = _rename_aliases(tokens)
+    tokens = _sort_predicates(tokens)
+    return tuple(tokens)
+
+
+def canonicalize(sql: str) -> str:
+    """
+    Canonical text of *sql*: whitespace, comments, keyword case, number formatting, table/CTE aliases
+    and the order of simple ``AND``-ed comparisons are normalized. Meaning is preserved, but
+    equivalent queries written differently in other ways still get different strings.
+    """
+    return _join(_canonical_tokens(sql))
+
+
+@lru_cache(maxsize=4096)
+def query_shape(sql: str) -> Tuple[str, Tuple[str, ...]]:
+    """Canonical text with literals replaced by ``?`` plus the extracted literal values."""
+    shape, params = [], []
+    for kind, text in _canonical_tokens(sql):
+        if kind in ("number", "string"):
+            shape.append("?")
+            params.append(text)
+        else:
+            shape.append(text)
+    return " ".join(shape), tuple(params)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql: str) -> str:
+    """Stable SHA-1 of the canonical SQL; used as cache key."""
+    return hashlib.sha1(canonicalize(sql).encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def shape_fingerprint(sql: str) -> str:
+    """SHA-1 of the literal-free shape; groups executions for per-query statistics."""
+    return hashlib.sha1(query_shape(sql)[0].encode("utf-8")).hexdigest()
@@ -19,6 +19,11 @@ case "$ACTION" in
     python3 data_ingestion/run_service.py
     ;;
 
+  profile)
+    echo "🔍 Profiling query plans (EXPLAIN)..."
+    python3 -m query_scenarios.plan_profiler
+    ;;
+
   run)
     echo "📊 Running query scenarios..."
     if [ "$FLAG" == "--optimized" ]; then
@@ -43,6 +48,7 @@ case "$ACTION" in
     echo "Usage:"
     echo "  ./run.sh reset"
     echo "  ./run.sh preprocess"
+    echo "  ./run.sh profile"
     echo "  ./run.sh run [--optimized]"
     echo "  ./run.sh run [--server1]"
     echo "  ./run.sh run [--server2]"
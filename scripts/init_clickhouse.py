@@ -1,5 +1,39 @@
+import sys
+from pathlib import Path
+
 import clickhouse_connect
 
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from serving.replicas import parse_replicas
+from serving.approximate import APPROX_SOURCE_TABLE, APPROX_TABLE
+from data_ingestion.derived_tables import create_derived_tables
+from data_ingestion.zones import create_zone_dictionary
+
+TRIP_COLUMNS = """
+        vendor_id Int32,
+        tpep_pickup_datetime DateTime,
+        tpep_dropoff_datetime DateTime,
+        passenger_count Nullable(Int32),
+        trip_distance Float64,
+        ratecode_id Nullable(Int32),
+        store_and_fwd_flag Nullable(String),
+        pulocation_id Int32,
+        dolocation_id Int32,
+        payment_type Int32,
+        fare_amount Float64,
+        extra Float64,
+        mta_tax Float64,
+        tip_amount Float64,
+        tolls_amount Float64,
+        improvement_surcharge Float64,
+        total_amount Float64,
+        congestion_surcharge Nullable(Float64),
+        airport_fee Nullable(Float64),
+        cbd_congestion_fee Nullable(Float64)
+""".strip("\n")
+
 def create_users_and_roles():
     client = clickhouse_connect.get_client(
         host='localhost',
@@ -28,28 +62,9 @@ def create_users_and_roles():
     print("✅ ClickHouse users and roles initialized.")
 
 def create_taxi_table_if_not_exists(client):
-    client.command("""
+    client.command(f"""
     CREATE TABLE IF NOT EXISTS ny_taxi_trips (
-        vendor_id Int32,
-        tpep_pickup_datetime DateTime,
-        tpep_dropoff_datetime DateTime,
-        passenger_count Nullable(Int32),
-        trip_distance Float64,
-        ratecode_id Nullable(Int32),
-        store_and_fwd_flag Nullable(String),
-        pulocation_id Int32,
-        dolocation_id Int32,
-        payment_type Int32,
-        fare_amount Float64,
-        extra Float64,
-        mta_tax Float64,
-        tip_amount Float64,
-        tolls_amount Float64,
-        improvement_surcharge Float64,
-        total_amount Float64,
-        congestion_surcharge Nullable(Float64),
-        airport_fee Nullable(Float64),
-        cbd_congestion_fee Nullable(Float64)
+{TRIP_COLUMNS}
     ) ENGINE = MergeTree()
     PARTITION BY toYYYYMM(tpep_pickup_datetime)
     ORDER BY (pulocation_id, dolocation_id, tpep_pickup_datetime);
@@ -124,17 +139,52 @@ def create_views_and_projections(client):
 
     print("✅ Materialized views and projections created.")
 
+def create_sampled_table(client):
+    # نسخه‌ی قابل SAMPLE برای حالت تقریبی (serving/approximate.py). کلید نمونه باید در ORDER BY باشد؛
+    # بعد از (pulocation_id, dolocation_id) می‌آید تا فیلتر روی مکان‌ها مثل جدول اصلی از index استفاده کند
+    # و SAMPLE p داخل هر جفت مکان فقط بازه‌ی [0, p) از hash را بخواند. hash روی خود ردیف است (شناسه‌ی سفر نداریم)،
+    # پس نمونه deterministic است: SAMPLE 0.1 همیشه همان ردیف‌ها و SAMPLE 0.05 زیرمجموعه‌ی آن.
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {APPROX_TABLE} (
+{TRIP_COLUMNS},
+        sample_key UInt32 MATERIALIZED toUInt32(cityHash64(
+            tpep_pickup_datetime, tpep_dropoff_datetime, pulocation_id, dolocation_id,
+            vendor_id, trip_distance, total_amount) % 4294967296)
+    ) ENGINE = MergeTree()
+    PARTITION BY toYYYYMM(tpep_pickup_datetime)
+    ORDER BY (pulocation_id, dolocation_id, sample_key, tpep_pickup_datetime)
+    SAMPLE BY sample_key;
+    """)
+    client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_{APPROX_TABLE}
+        TO {APPROX_TABLE}
+        AS SELECT * FROM {APPROX_SOURCE_TABLE};
+    """)
+    # داده‌ی قبل از ساخت MV یک بار کپی می‌شود (setup بدون ingestion هم‌زمان اجرا می‌شود)
+    sampled_rows = int(client.query(f"SELECT count() FROM {APPROX_TABLE}").result_rows[0][0])
+    source_rows = int(client.query(f"SELECT count() FROM {APPROX_SOURCE_TABLE}").result_rows[0][0])
+    if sampled_rows == 0 and source_rows > 0:
+        client.command(f"INSERT INTO {APPROX_TABLE} SELECT * FROM {APPROX_SOURCE_TABLE}")
+        print(f"✅ Backfilled {source_rows} rows into {APPROX_TABLE}.")
+    print(f"✅ Sampled table {APPROX_TABLE} is ready.")
+
 def setup_project():
-    client = clickhouse_connect.get_client(
-        host='localhost',
-        port=8123,
-        user='default',
-        password='',
-        secure=False
-    )
-    # create_users_and_roles()
-    create_taxi_table_if_not_exists(client)
-    create_views_and_projections(client)
+    # همان schema روی هر replica (CLICKHOUSE_REPLICAS، پیش‌فرض فقط localhost:8123)
+    for host, port in parse_replicas():
+        print(f"🔧 Setting up {host}:{port}")
+        client = clickhouse_connect.get_client(
+            host=host,
+            port=port,
+            user='default',
+            password='',
+            secure=False
+        )
+        # create_users_and_roles()
+        create_taxi_table_if_not_exists(client)
+        create_views_and_projections(client)
+        create_sampled_table(client)
+        create_derived_tables(client)
+        create_zone_dictionary(client)
 
 if __name__ == "__main__":
     setup_project()
\ No newline at end of file
@@ -16,6 +16,9 @@ from data_ingestion.config import (
     CLICKHOUSE_PORT, CLICKHOUSE_USER,
     CLICKHOUSE_PASSWORD
 )
+from serving.approximate import APPROX_TABLE
+from data_ingestion.derived_tables import DERIVED_TABLES
+from data_ingestion.zones import ZONE_DICT, ZONE_TABLE
 
 RESULTS_DIR = Path(__file__).parent.parent / 'query_scenarios' / 'results'
 
@@ -44,6 +47,12 @@ def reset_clickhouse():
         client.command("DROP TABLE IF EXISTS mv_trip_stats_daily;")
         client.command("DROP TABLE IF EXISTS mv_trip_counts_daily;")
         client.command("DROP TABLE IF EXISTS mv_location_stats;")
+        client.command(f"DROP TABLE IF EXISTS mv_{APPROX_TABLE};")
+        client.command(f"DROP TABLE IF EXISTS {APPROX_TABLE};")
+        for name, _, _ in DERIVED_TABLES:
+            client.command(f"DROP TABLE IF EXISTS {name};")
+        client.command(f"DROP DICTIONARY IF EXISTS {ZONE_DICT};")
+        client.command(f"DROP TABLE IF EXISTS {ZONE_TABLE};")
         client.command(f"DROP TABLE IF EXISTS {CLICKHOUSE_TABLE};")
         print(f"✅ Table '{CLICKHOUSE_TABLE}' dropped.")
     except Exception as e:
@@ -5,9 +5,23 @@ import clickhouse_connect
 import time
 import time, json, argparse, os, sys
 from query_scenarios.scenario_runner import exec_one_query
+from query_scenarios.sql_fingerprint import shape_fingerprint
 from pathlib import Path
 
-from query_scenarios.metrics_recorder import run_query_with_metrics, aggregate_metrics, save_scenario_figure, metrics_to_dict
+from query_scenarios.metrics_recorder import (
+    measure_query, when_metrics_ready, flush_metrics, metrics_to_dict,
+)
+from query_scenarios.latency_histogram import LatencyHistogram, percentile_table
+from query_scenarios.scenario_aggregator import ScenarioAggregator
+from query_scenarios.reports import ReportPipeline
+from query_scenarios.results_db import ExecutionWriter, execution_row
+from serving.protocol import (
+    FramedSocket, ConnectionClosed, ProtocolError, encode_rows,
+    MSG_QUERY, MSG_RESULT, MSG_ERROR, MSG_MAINTENANCE, MSG_ACK, MSG_CHUNK, MSG_END, FLAG_STREAM,
+)
+from serving.streaming import stream_query
+from serving.replicas import shared_pool
+from serving.query_log import new_query_id, with_query_id, fetch_query_log, summarize_query_log
 
 # Server config
 HOST = 'localhost'
@@ -18,99 +32,141 @@ any_client = False
 # Global variables for client tracking
 active_clients = 0
 shutdown_flag = False 
-results = []
+# جمع‌ها و هیستوگرام‌ها به‌جای لیست همه‌ی نتایج؛ perform_maintenance_tasks پنجره را برمی‌دارد
+aggregator = ScenarioAggregator()
+# هر اجرا یک ردیف در results/benchmarks.sqlite (متریک‌های منبع اینجا ثبت نمی‌شوند)
+results_writer = ExecutionWriter("server1", os.getenv("SCHEMA_PROFILE", "normal"))
 
 def handle_client(conn, addr):
-    
+    framed = FramedSocket(conn)
     try:
-        # Receive priority (first line)
-        priority_line = conn.recv(64).decode().strip()
-        priority = int(priority_line) if priority_line.isdigit() else 1
-        print(f"[>] Client {addr} connected with priority {priority}")
-
-        if priority == 0:
-            data = conn.recv(4096).decode()  # Receive and decode
-            latency_list = json.loads(data)  # Convert back to list
-            perform_maintenance_tasks(latency_list)
-            return
-        
-        # Create a new ClickHouse client
-        client = clickhouse_connect.get_client(host='localhost', port=8123, username='default', password='')
-        
+        print(f"[>] Client {addr} connected")
+
         while True:
             try:
-                # Receive query
-                query = conn.recv(16384).decode().strip()
+                # Receive one framed request; None = clean EOF
+                frame = framed.recv()
+                if frame is None:
+                    print(f"[-] Client {addr} closed the connection")
+                    break
+
+                if frame.msg_type == MSG_MAINTENANCE:
+                    # ACK فوری با report_id؛ جمع‌آوری و رسم در پس‌زمینه
+                    ack = perform_maintenance_tasks(frame.json() or [])
+                    framed.send(MSG_ACK, frame.request_id, json.dumps(ack).encode())
+                    continue
 
-                if not query:
+                if frame.msg_type != MSG_QUERY:
+                    framed.send(MSG_ERROR, frame.request_id,
+                                json.dumps({"error": f"unexpected message type {frame.msg_type}"}).encode())
                     continue
 
-                # Execute query
-                result = exec_one_query(client, query)
-                results.append(result)
-                result_str = str(result)
-                conn.sendall(result_str.encode())
+                # Execute query on a pooled client; with FLAG_STREAM every block is forwarded as it arrives
+                if frame.flags & FLAG_STREAM:
+                    with shared_pool().connection() as client:
+                        result = exec_one_query_streaming(client, frame.text(), framed, frame.request_id,
+                                                          on_metrics=aggregator.add_metrics)
+                    reply_type = MSG_END
+                else:
+                    result = exec_one_query(None, frame.text(), on_metrics=aggregator.add_metrics)
+                    reply_type = MSG_RESULT
+                # متریک‌ها جدا (on_metrics) شمرده می‌شوند؛ در benchmark همین حالا در result هم هستند
+                record = {k: v for k, v in result.items() if k != "metrics"}
+                aggregator.add(record)
+                results_writer.submit(execution_row(record))
+                framed.send(reply_type, frame.request_id, json.dumps({
+                    "latency_s": result["latency_s"],
+                    "rows": result["rows"],
+                    "throughput": result["throughput"],
+                    "ttfr_s": result["ttfr_s"],
+                    "source": "db",
+                    # در حالت production متریک‌ها بعداً (خارج از مسیر پاسخ) می‌رسند
+                    "metrics": metrics_to_dict(result["metrics"]) if "metrics" in result else None,
+                }).encode())
                 print(f"[✓] Processed query from {addr}")
 
-            except (ConnectionResetError, BrokenPipeError):
+            except (ConnectionResetError, BrokenPipeError, ConnectionClosed):
                 print(f"[-] Client {addr} disconnected abruptly")
                 break
+            except ProtocolError as e:
+                print(f"[!] Bad frame from {addr}: {e}")
+                break
             except Exception as e:
-                error_msg = f"Error: {str(e)}"
                 try:
-                    conn.sendall(error_msg.encode())
+                    framed.send(MSG_ERROR, frame.request_id, json.dumps({"error": str(e)}).encode())
                 except (BrokenPipeError, ConnectionResetError):
                     print(f"[-] Client {addr} disconnected during error handling")
                     break
 
-    except (ConnectionResetError, BrokenPipeError):
-        print(f"[-] Client {addr} disconnected during initial handshake")
     except Exception as e:
         print(f"[!] Unexpected error with client {addr}: {e}")
     finally:
-        try:
-            conn.close()
-            client.close()
-        except:
-            pass
+        framed.close()
         
 
-def perform_maintenance_tasks(latency_list):
-    metrics_list = [r["metrics"] for r in results]
-    agg = aggregate_metrics(metrics_list)
-    thr_list = [r["throughput"] for r in results]
-    rows_list = [r["rows"] for r in results]
-
-    avg_latency = sum(latency_list) / len(latency_list)
-    avg_throughput = sum(thr_list) / len(thr_list)
-
-    results_base = BASE_DIR / "results" / "normal"
-    RESULT_DIR = results_base
-    PLOTS_DIR = RESULT_DIR / "plots"
-    RESULT_DIR.mkdir(parents=True, exist_ok=True)
-    PLOTS_DIR.mkdir(parents=True, exist_ok=True)
-
-    plot_path = save_scenario_figure(
-        agg,
-        out_dir=str(PLOTS_DIR),
-        kpi_avg_latency_s=avg_latency,
-        kpi_avg_throughput_rps=avg_throughput
-    )
-
-    base = Path(plot_path).stem
-    json_path = RESULT_DIR / f"{base}.json"
+def exec_one_query_streaming(client, query, framed, request_id, on_metrics=None):
+    def on_block(block):
+        data, flags = encode_rows(block)
+        framed.send(MSG_CHUNK, request_id, data, flags=flags)
+        return len(data)
+
+    query_id = new_query_id()
+    stats, window, latency_s = measure_query(
+        lambda: stream_query(client, query, on_block=on_block, settings=with_query_id(query_id)), post_sleep=0.25)
     out = {
+        "latency_s": latency_s,
+        "rows": stats.rows,
+        "throughput": stats.rows / latency_s if latency_s > 0 else 0.0,
+        "ttfr_s": stats.ttfr_s,
+        "fingerprint": shape_fingerprint(query),
+        "query_id": query_id,
+    }
+    def _metrics_ready(m):
+        out["metrics"] = m
+        if on_metrics is not None:
+            on_metrics(m)
+    when_metrics_ready(window, _metrics_ready)
+    return out
+
+RESULT_DIR = BASE_DIR / "results" / "normal"
+reports = ReportPipeline(RESULT_DIR)
+
+def collect_scenario(latency_list):
+    if not flush_metrics():
+        print("[!] Metrics collector did not flush in time; the latest queries may lack metrics.")
+    # پنجره‌ی سناریوی جاری؛ نتایج بعدی در پنجره‌ی جدید جمع می‌شوند
+    window = aggregator.snapshot()
+    if not window.count:
+        print("[!] No results collected yet; skipping aggregation.")
+        return None
+    # server1 صف ندارد: execution = زمان ClickHouse، client = latency دیده شده توسط کلاینت
+    latency = window.latency_histograms()
+    latency["client"] = LatencyHistogram().extend(latency_list).to_dict()
+
+    avg_latency = sum(latency_list) / len(latency_list) if latency_list else 0.0
+    avg_throughput = window.mean("throughput")
+    print(f"✅ Scenario complete. Avg latency: {avg_latency:.4f}s, Avg throughput: {avg_throughput:.2f} rows/s")
+    return {
         "avg_latency_sec": avg_latency,
         "avg_throughput_rows_per_sec": avg_throughput,
-        "queries": [{"latency_sec": l, "throughput_rows_per_sec": t, "rows": r} for l, t, r in zip(latency_list, thr_list, rows_list)],
-        "aggregated_metrics": metrics_to_dict(agg),
+        "avg_ttfr_sec": window.mean("ttfr_s"),
+        "latency_percentiles": percentile_table(latency),
+        "latency_histograms": latency,
+        "query_count": window.count,
+        "window": {"started_at": window.started_at, "ended_at": window.ended_at},
+        "per_query": window.per_query_table(),
+        "aggregated_metrics": metrics_to_dict(window.metrics()),
+        "query_id_sample": list(window.query_ids),
+        "pool": shared_pool().stats(),
     }
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
 
-    print(f"[scenario] saved figure: {plot_path}")
-    print(f"[scenario] saved json:   {json_path}")
-    print(f"✅ Scenario complete. Avg latency: {avg_latency:.4f}s, Avg throughput: {avg_throughput:.2f} rows/s")
+def enrich_scenario(data):
+    server_stats = fetch_query_log(shared_pool(), data["query_id_sample"])
+    return {**data, "server_stats": summarize_query_log(list(server_stats.values()))}
+
+def perform_maintenance_tasks(latency_list):
+    report_id, _ = reports.submit(lambda: collect_scenario(latency_list), enrich_scenario)
+    return {"report_id": report_id, "json_path": str(RESULT_DIR / f"{report_id}.json")}
 
 def start_server():
     global shutdown_flag
@@ -120,6 +176,7 @@ def start_server():
         server.listen()
         server.settimeout(1.0)  # Allow periodic checking of shutdown_flag
 
+        shared_pool()  # warm connections before the first client arrives
         print(f"[✓] Server listening on {HOST}:{PORT}")
         
         try:
@@ -1,7 +1,9 @@
 import socket
 import threading
 from queue import Queue
-import queue, uuid, time, json, os, sys, hashlib
+import queue, uuid, time, json, os, sys
+import multiprocessing as mp
+from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime, timezone
 
@@ -9,20 +11,47 @@ import clickhouse_connect
 
 # ---- Metrics & plotting
 from query_scenarios.metrics_recorder import (
-    run_query_with_metrics,
-    aggregate_metrics,
-    save_scenario_figure,
+    measure_query,
+    when_metrics_ready,
+    flush_metrics,
+    QueryWindow,
+    POST_WINDOW_S,
+    COLLECTOR_INTERVAL_S,
     metrics_to_dict,
 )
-# برای ساخت مجدد dataclass از dict روی cache-hit
-from query_scenarios.metrics_recorder import PhaseMetrics  # type: ignore
 from query_scenarios.metrics_recorder import QueryMetrics  # type: ignore
+from query_scenarios.latency_histogram import LatencyHistogram, percentile_table
+from query_scenarios.scenario_aggregator import ScenarioAggregator, ScenarioWindow, merge_windows
+from query_scenarios.reports import ReportPipeline
+from query_scenarios.results_db import ExecutionWriter, execution_row, new_run_id
+from query_scenarios.sql_fingerprint import canonicalize, fingerprint, shape_fingerprint
+from serving.scheduler import BlockingScheduler, parse_class_weights
+from serving.protocol import (
+    FramedSocket, encode_rows,
+    MSG_QUERY, MSG_RESULT, MSG_ERROR, MSG_MAINTENANCE, MSG_ACK, MSG_CHUNK, MSG_END, FLAG_STREAM, FLAG_APPROX,
+)
+from serving.streaming import stream_query, count_rows_streaming
+from serving.admission import AdmissionControl, CODE_SHED, CODE_TIMEOUT
+from serving.replicas import ReplicaPoolSet, replica_registry
+from serving.lanes import LaneRouter, build_router
+from serving.prefork import Supervisor, listen_socket
+from serving.result_store import RedisResultStore, ManagedResultStore
+from serving.trace import TraceWriter
+from serving.approximate import rewrite_for_request, approximation_of
+# query_id صریح: هم برای KILL QUERY و هم برای خواندن آمار همین اجرا از system.query_log
+from serving.query_log import with_query_id, fetch_query_log, summarize_query_log
 
 # ---------------- Config ----------------
 HOST = '0.0.0.0'
 PORT = int(os.getenv("SERVER2_PORT", "9001"))
 BASE_DIR = Path(__file__).parent
 POOL_SIZE = int(os.getenv("POOL_SIZE", "10"))
+# threaded (thread-per-connection) یا asyncio (یک event loop + executor محدود)
+SERVER_MODE = os.getenv("SERVER2_MODE", "threaded")
+# بیش از 1: prefork — این تعداد پروسه با SO_REUSEPORT روی همان پورت، هر کدام با SERVER_MODE
+SERVER2_WORKERS = int(os.getenv("SERVER2_WORKERS", "1"))
+# وزن کلاس‌های priority، مثلاً "9:20,1:0.5"؛ پیش‌فرض وزن = خود priority
+SCHED_CLASS_WEIGHTS = parse_class_weights(os.getenv("SCHED_CLASS_WEIGHTS", ""))
 
 # Cache settings
 REDIS_ENABLED = os.getenv("REDIS_ENABLED", "1") == "1"
@@ -33,6 +62,8 @@ REDIS_TTL = int(os.getenv("REDIS_TTL", "300"))  # ثانیه
 
 # اگر نتایج کش در سناریو هم تجمیع شوند
 COUNT_CACHE_IN_SCENARIO = "1"
+# prefork: هر worker پنجره‌ی aggregator خودش را با این فاصله در result_store مشترک می‌گذارد
+AGG_PUBLISH_INTERVAL_S = float(os.getenv("AGG_PUBLISH_INTERVAL_S", "1.0"))
 
 # -------------- Optional Redis --------------
 redis_client = None
@@ -71,49 +102,81 @@ def _mem_setex(key: str, ttl: int, value: str):
         _mem_cache[key] = {"value": value, "exp": time.time() + ttl}
 
 # ---------------- Task Queue & Results ----------------
-task_queue = []
-task_lock = threading.Lock()
-
-results = []
-results_lock = threading.Lock()
+@dataclass
+class Task:
+    framed: FramedSocket
+    client_id: str
+    request_id: int
+    priority: int
+    ts: float
+    query: str
+    flags: int
+    deadline: float
+    lane: str
+
+# lane های fast/slow (یا یک lane پیش‌فرض)؛ هر lane صف و dispatcher های خودش را دارد
+router: LaneRouter | None = None
+# heap per priority class + fair queueing بین کلاینت‌ها؛ get() بدون polling بلاک می‌شود
+lane_queues: dict[str, BlockingScheduler] = {}
+
+def queued_tasks() -> int:
+    return sum(len(q) for q in lane_queues.values())
+
+# deadline هر درخواست، سقف عمق صف، و KILL QUERY برای اجراهای منقضی/رها شده
+def _kill_query(query_id: str):
+    # کلاینت‌های جدا از pool (روی هر replica) تا KILL پشت کوئری‌های سنگین منتظر نماند
+    replica_registry().kill_query(query_id)
+
+admission = AdmissionControl(kill_fn=_kill_query)
+
+# جمع‌ها/هیستوگرام‌های سناریوی جاری (حافظه‌ی ثابت)؛ perform_maintenance_tasks پنجره را برمی‌دارد
+aggregator = ScenarioAggregator()
+# TRACE_ENABLED=1: هر درخواست ورودی در results/traces (بازپخش با benchmarks/replay_trace.py)
+tracer = TraceWriter()
+# هر اجرا یک ردیف در results/benchmarks.sqlite (batch در پس‌زمینه؛ مقایسه با results_db compare)
+results_writer = ExecutionWriter("server2", os.getenv("SCHEMA_PROFILE", "optimized"))
+# فقط در prefork (Redis یا Manager): پنجره‌های worker ها تا perform_maintenance_tasks همه را ببیند
+result_store = None
 
 shutdown_flag = False
 
 # ---------------- Helpers ----------------
-def create_client_pool(pool_size: int) -> Queue:
-    pool = Queue()
-    for _ in range(pool_size):
-        client = clickhouse_connect.get_client(host='localhost', port=8123, username='default', password='')
-        pool.put(client)
-    return pool
-
 def normalize_sql(sql: str) -> str:
-    # حذف space اضافی/خط جدید/; انتهایی
-    s = " ".join(sql.strip().split())
-    if s.endswith(";"):
-        s = s[:-1]
-    return s
+    # tokenizer-based: case، کامنت، فرمت literal، alias جدول و ترتیب شرط‌ها یکسان می‌شوند
+    return canonicalize(sql)
 
 def cache_key_for_sql(sql: str) -> str:
-    s = normalize_sql(sql)
-    h = hashlib.sha1(s.encode("utf-8")).hexdigest()
-    return f"ch:query:{h}"
-
-def metrics_from_dict(d: dict) -> QueryMetrics:
-    # d ساختار metrics_to_dict دارد
-    def _pm(obj):
-        return PhaseMetrics(pre=float(obj["pre"]), during=float(obj["during"]), post=float(obj["post"]))
-    return QueryMetrics(
-        cpu=_pm(d["cpu"]),
-        memory_mb=_pm(d["memory_mb"]),
-        threads=_pm(d["threads"]),
-        fds=_pm(d["fds"]),
-        net_kbps=_pm(d["net_kbps"]),
-    )
-
-def exec_query_with_metrics(db_client, sql: str) -> dict:
+    return f"ch:query:{fingerprint(sql)}"
+
+def request_sql(sql: str, flags: int) -> str:
+    # FLAG_APPROX (یا APPROX_MODE=all): نسخه‌ی نمونه‌گیری‌شده؛ lane، کش و fingerprint روی همان SQL جدید
+    return rewrite_for_request(sql, bool(flags & FLAG_APPROX))
+
+def scenario_record(payload: dict, m: QueryMetrics) -> dict:
+    return {**payload, "metrics": metrics_to_dict(m)}
+
+def record_result(record: dict):
+    aggregator.add(record)
+    results_writer.submit(execution_row(record))
+
+def record_when_ready(window: QueryWindow, payload: dict):
+    # production: callback روی thread ی collector، بعد از پنجره‌ی post؛ مسیر پاسخ منتظر نمی‌ماند
+    when_metrics_ready(window, lambda m: record_result(scenario_record(payload, m)))
+
+def publish_results_loop(interval: float = AGG_PUBLISH_INTERVAL_S):
+    # prefork: پنجره‌ی این worker → result_store مشترک (فقط اگر چیزی ثبت شده)
+    while True:
+        time.sleep(interval)
+        if len(aggregator):
+            try:
+                result_store.append(aggregator.snapshot().to_dict())
+            except Exception as e:
+                print(f"[scenario] publishing results failed: {e}")
+
+def exec_query_with_metrics(db_client, sql: str, query_id: str | None = None, settings: dict | None = None,
+                            queue_wait_s: float = 0.0) -> dict:
     """
-    خروجی: {"metrics": QueryMetrics, "latency_s": float, "rows": int, "throughput": float, "source": "db|cache"}
+    خروجی: {"metrics": QueryMetrics | None, "latency_s": float, "rows": int, "throughput": float, "source": "db|cache"}
     """
     # ---- Cache check
     print("query =", sql)
@@ -133,43 +196,57 @@ def exec_query_with_metrics(db_client, sql: str) -> dict:
             payload = json.loads(cached_json)
             # اگر خواستی cache-hit هم در سناریو لحاظ شود
             if COUNT_CACHE_IN_SCENARIO:
-                m = metrics_from_dict(payload["metrics"])
-                with results_lock:
-                    results.append({
-                        "metrics": m,
-                        "latency_s": float(payload.get("latency_s", 0.0)),
-                        "rows": int(payload.get("rows", 0)),
-                        "throughput": float(payload.get("throughput", 0.0)),
-                        "source": "cache",
-                    })
+                record = {
+                    "latency_s": float(payload.get("latency_s", 0.0)),
+                    "rows": int(payload.get("rows", 0)),
+                    "throughput": float(payload.get("throughput", 0.0)),
+                    "ttfr_s": float(payload.get("ttfr_s", 0.0)),
+                    "fingerprint": shape_fingerprint(sql),
+                    "query_id": None,  # به ClickHouse نرسید
+                    "queue_wait_s": queue_wait_s,
+                    "source": "cache",
+                }
+                if payload.get("metrics"):
+                    record_result({**record, "metrics": payload["metrics"]})
+                else:
+                    # در production متریکی کش نشده؛ پنجره‌ی همین cache-hit را collector می‌سنجد
+                    now = time.time()
+                    record_when_ready(QueryWindow(now, now), record)
                 payload["source"] = "cache"
+                payload["approximate"] = approximation_of(sql)
                 return payload
         except Exception:
             pass  # اگر خراب بود، می‌رویم سراغ اجرای واقعی
 
-    # ---- Real execution + metrics
-    result, m, latency_s = run_query_with_metrics(lambda: db_client.query(sql), post_sleep=0.25)
-    rows = len(result.result_rows)
+    # ---- Real execution + metrics (row count via block stream; نتیجه materialize نمی‌شود)
+    stats, window, latency_s = measure_query(lambda: count_rows_streaming(db_client, sql, settings=with_query_id(query_id, settings)),
+                                             post_sleep=0.25)
+    rows = stats.rows
     thr = rows / latency_s if latency_s > 0 else 0.0
 
     payload = {
-        "metrics": m,  # برای append به results
+        "metrics": window.metrics,  # None در حالت production
         "latency_s": latency_s,
         "rows": rows,
         "throughput": thr,
+        "ttfr_s": stats.ttfr_s,
+        "fingerprint": shape_fingerprint(sql),
+        "query_id": query_id,
+        "queue_wait_s": queue_wait_s,
         "source": "db",
     }
 
     # ---- Save to scenario store (always for real DB runs)
-    with results_lock:
-        results.append(payload)
+    record_when_ready(window, {k: v for k, v in payload.items() if k != "metrics"})
+    payload["approximate"] = approximation_of(sql)  # فقط در پاسخ، نه در رکورد سناریو
 
     # ---- Save to cache (store dict-ified metrics)
     cache_value = {
-        "metrics": metrics_to_dict(m),
+        "metrics": metrics_to_dict(window.metrics) if window.metrics else None,
         "latency_s": latency_s,
         "rows": rows,
         "throughput": thr,
+        "ttfr_s": stats.ttfr_s,
         "generated_at": datetime.now(timezone.utc).isoformat(),
     }
     try:
@@ -183,149 +260,234 @@ def exec_query_with_metrics(db_client, sql: str) -> dict:
 
     return payload
 
+def exec_query_streaming(db_client, sql: str, on_block, query_id: str | None = None,
+                         settings: dict | None = None, queue_wait_s: float = 0.0) -> dict:
+    """
+    مسیر streaming: هر بلوک بلافاصله با on_block به سوکت فرستاده می‌شود؛ کش استفاده نمی‌شود
+    چون کش فقط متریک نگه می‌دارد نه ردیف‌ها.
+    """
+    stats, window, latency_s = measure_query(lambda: stream_query(db_client, sql, on_block=on_block,
+                                                                 settings=with_query_id(query_id, settings)),
+                                             post_sleep=0.25)
+    payload = {
+        "metrics": window.metrics,
+        "latency_s": latency_s,
+        "rows": stats.rows,
+        "throughput": stats.rows / latency_s if latency_s > 0 else 0.0,
+        "ttfr_s": stats.ttfr_s,
+        "chunks": stats.chunks,
+        "bytes_sent": stats.bytes_sent,
+        "fingerprint": shape_fingerprint(sql),
+        "query_id": query_id,
+        "queue_wait_s": queue_wait_s,
+        "source": "db",
+    }
+    record_when_ready(window, {k: v for k, v in payload.items() if k != "metrics"})
+    payload["approximate"] = approximation_of(sql)
+    return payload
+
+def send_block(framed: FramedSocket, request_id: int, block) -> int:
+    data, flags = encode_rows(block)
+    framed.send(MSG_CHUNK, request_id, data, flags=flags)
+    return len(data)
+
+def encode_response(result: dict) -> bytes:
+    return json.dumps({
+        "latency_s": result["latency_s"],
+        "rows": result["rows"],
+        "throughput": result["throughput"],
+        "ttfr_s": result.get("ttfr_s", 0.0),
+        "source": result["source"],
+        # نرخ نمونه و نام ستون‌های stderr برای پاسخ تقریبی؛ None برای اجرای دقیق
+        "approximate": result.get("approximate"),
+        # dataclass (benchmark)، dict (cache) یا None (production: خارج از مسیر پاسخ جمع می‌شود)
+        "metrics": (metrics_to_dict(result["metrics"]) if isinstance(result["metrics"], QueryMetrics)
+                    else result["metrics"]),
+    }).encode()
+
+def send_error(framed: FramedSocket, request_id: int, message: str, code: str = "error"):
+    try:
+        framed.send(MSG_ERROR, request_id, json.dumps({"error": message, "code": code}).encode())
+    except OSError:
+        pass
+
 # ---------------- Dispatcher ----------------
-def dispatcher(db_pool: Queue):
-    print("[dispatcher] started")
+def dispatcher(lane: str, db_pool: ReplicaPoolSet):
+    print(f"[dispatcher:{lane}] started")
+    queue_ = lane_queues[lane]
+    settings = router.settings(lane)
     while True:
-        db_client = db_pool.get()
-        with task_lock:
-            if not task_queue:
-                db_pool.put(db_client)
-                time.sleep(0.05)
-                continue
-            now = time.time()
-            scored = [(priority * (now - ts), idx)
-                      for idx, (_, _, priority, ts, _) in enumerate(task_queue)]
-            _, best_idx = max(scored)
-            conn, client_id, priority, ts, query = task_queue.pop(best_idx)
-
+        task = queue_.get()
+        # اتصال بسته شده: اجرای کوئری بی‌فایده است
+        if task.framed.closed:
+            admission.stats.incr("abandoned")
+            continue
+        if admission.expired(task.deadline):
+            send_error(task.framed, task.request_id, "deadline exceeded while queued", CODE_TIMEOUT)
+            print(f"[⏱] Dropped expired task from {task.client_id}")
+            continue
+
+        query_id = str(uuid.uuid4())
+        admission.watchdog.register(query_id, task.deadline, lambda: task.framed.closed)
+        started_at = time.time()
         try:
-            result = exec_query_with_metrics(db_client, query)
-            # پاسخ به کلاینت (JSON)
+            # replica ی کم‌بارتر (یا sticky برای این کلاینت)؛ اتصال خراب بعد از خطا به pool برنمی‌گردد
+            with db_pool.connection(session=task.client_id) as db_client:
+                if task.flags & FLAG_STREAM:
+                    result = exec_query_streaming(db_client, task.query,
+                                                  lambda block: send_block(task.framed, task.request_id, block),
+                                                  query_id=query_id, settings=settings,
+                                                  queue_wait_s=started_at - task.ts)
+                    reply_type = MSG_END
+                else:
+                    result = exec_query_with_metrics(db_client, task.query, query_id=query_id, settings=settings,
+                                                     queue_wait_s=started_at - task.ts)
+                    reply_type = MSG_RESULT
+            router.record(lane, task.query, task.ts, started_at, time.time(),
+                          result["latency_s"] if result["source"] == "db" else None)
+            # پاسخ به کلاینت (JSON) با همان request_id
             try:
-                conn.sendall(json.dumps({
-                    "latency_s": result["latency_s"],
-                    "rows": result["rows"],
-                    "throughput": result["throughput"],
-                    "source": result["source"],
-                    # متریک‌ها اگر از DB است dataclass هستند؛ برای ارسال باید dict شوند
-                    "metrics": (metrics_to_dict(result["metrics"]) if result["source"] == "db" else result["metrics"]),
-                }).encode())
-            except Exception:
+                task.framed.send(reply_type, task.request_id, encode_response(result))
+            except OSError:
                 pass
-            print(f"[✓] Query done for {client_id} (prio={priority}, source={result['source']})")
+            print(f"[✓] Query done for {task.client_id} (lane={lane}, prio={task.priority}, source={result['source']})")
 
         except Exception as e:
-            print(f"[!] Error executing query for {client_id}: {e}")
+            reason = admission.watchdog.unregister(query_id)
+            print(f"[!] Error executing query for {task.client_id} ({reason or 'error'}): {e}")
+            send_error(task.framed, task.request_id, str(e), reason or "error")
 
         finally:
-            db_pool.put(db_client)
+            admission.watchdog.unregister(query_id)
 
 # ---------------- Client Handler ----------------
 def handle_client(conn, addr):
+    framed = FramedSocket(conn)
+    client_id = str(uuid.uuid4())
+    print(f"[>] Client {client_id} connected from {addr}")
+    tracer.connect(client_id, addr)
     try:
-        priority_data = conn.recv(64).decode().strip()
-        priority = int(priority_data) if priority_data.isdigit() else 1
-        client_id = str(uuid.uuid4())
-        print(f"[>] Client {client_id} connected from {addr} with priority {priority}")
+        while True:
+            frame = framed.recv()
+            if frame is None:
+                break  # EOF: کلاینت اتصال را بست
+
+            # پیام نگه‌داری/خاتمه سناریو
+            if frame.msg_type == MSG_MAINTENANCE:
+                tracer.maintenance(client_id)
+                # ACK فوری با report_id؛ جمع‌آوری و رسم در پس‌زمینه
+                ack = perform_maintenance_tasks(frame.json() or [])
+                framed.send(MSG_ACK, frame.request_id, json.dumps(ack).encode())
+                continue
 
-        # پیام نگه‌داری/خاتمه سناریو
-        if priority == 0:
-            data = conn.recv(8192).decode()
-            latency_list = json.loads(data)
-            perform_maintenance_tasks(latency_list)
-            return
+            if frame.msg_type != MSG_QUERY:
+                send_error(framed, frame.request_id, f"unexpected message type {frame.msg_type}")
+                continue
 
+            # قبل از admission: درخواست‌های ردشده هم بخشی از ترافیک واقعی‌اند
+            tracer.query(client_id, frame.text(), frame.priority or 1, frame.flags)
 
-        while True:
-            query_data = conn.recv(16384).decode().strip()
-            if not query_data:
+            # load shedding: صف پر است → رد فوری به‌جای انتظار بی‌پایان
+            if not admission.admit(queued_tasks()):
+                send_error(framed, frame.request_id, "server overloaded", CODE_SHED)
                 continue
+
+            priority = frame.priority or 1
             ts = time.time()
-            with task_lock:
-                task_queue.append((conn, client_id, priority, ts, query_data))
-            print(f"[+] Task queued from {client_id}")
+            sql = request_sql(frame.text(), frame.flags)
+            # تخمین هزینه (تاریخچه‌ی latency یا EXPLAIN ESTIMATE) → fast/slow
+            lane = router.route(sql)
+            lane_queues[lane].put(Task(framed, client_id, frame.request_id, priority, ts, sql,
+                                       frame.flags, admission.deadline_for(ts), lane),
+                                  client_id, priority, ts)
+            print(f"[+] Task queued from {client_id} (req={frame.request_id}, prio={priority}, lane={lane})")
 
     except Exception as e:
         print(f"[!] Client error ({addr}): {e}")
     finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+        framed.close()
+        router.forget(client_id)
+        tracer.close(client_id)
         print(f"[-] Disconnected {addr}")
 
 # ---------------- Scenario Aggregation ----------------
-def perform_maintenance_tasks(latency_list: list[float]):
-    with results_lock:
-        snap = list(results)
-
-    print(f"{len(results)}")
-    if not snap:
+RESULT_DIR = BASE_DIR / "results" / "optimized"
+# JSON خام فوراً، system.query_log و شکل در پس‌زمینه (query_scenarios/reports.py)
+reports = ReportPipeline(RESULT_DIR)
+
+def collect_scenario(latency_list: list[float]) -> dict | None:
+    # متریک کوئری‌های آخر بعد از پنجره‌ی post می‌رسند (در prefork روی پروسه‌های دیگر هم)
+    flush_metrics()
+    windows = [aggregator.snapshot()]  # پنجره‌ی این پروسه؛ کار جدید از همین حالا در پنجره‌ی بعدی
+    if result_store is not None:
+        # prefork: صبر تا بقیه‌ی worker ها هم متریک‌ها و پنجره‌شان را منتشر کنند
+        time.sleep(POST_WINDOW_S + COLLECTOR_INTERVAL_S + AGG_PUBLISH_INTERVAL_S)
+        windows += [ScenarioWindow.from_dict(d) for d in result_store.drain()]
+    window = merge_windows(windows)
+
+    print(f"{window.count}")
+    if not window.count:
         print("[!] No results collected yet; skipping aggregation.")
-        return
-
-    # some entries may come from cache with metrics as dict not dataclass
-    metrics_list = []
-    thr_list, rows_list = [], []
-    for r in snap:
-        m = r["metrics"]
-        if isinstance(m, dict):
-            m = metrics_from_dict(m)
-        metrics_list.append(m)
-        thr_list.append(float(r.get("throughput", 0.0)))
-        rows_list.append(int(r.get("rows", 0)))
-
-    agg = aggregate_metrics(metrics_list)
+        return None
+
+    # execution و queue_wait (صف lane) از همه‌ی worker ها؛ client = latency_list کلاینت
+    latency = window.latency_histograms()
+    latency["client"] = LatencyHistogram().extend(latency_list).to_dict()
     avg_latency = sum(latency_list) / len(latency_list) if latency_list else 0.0
-    avg_throughput = sum(thr_list) / len(thr_list) if thr_list else 0.0
-
-    results_base = BASE_DIR / "results" / "optimized"
-    RESULT_DIR = results_base
-    PLOTS_DIR = RESULT_DIR / "plots"
-    RESULT_DIR.mkdir(parents=True, exist_ok=True)
-    PLOTS_DIR.mkdir(parents=True, exist_ok=True)
-
-    plot_path = save_scenario_figure(
-        agg,
-        out_dir=str(PLOTS_DIR),
-        kpi_avg_latency_s=avg_latency,
-        kpi_avg_throughput_rps=avg_throughput
-    )
-
-    base = Path(plot_path).stem
-    json_path = RESULT_DIR / f"{base}.json"
-    out = {
+    avg_throughput = window.mean("throughput")
+    print(f"✅ Scenario complete. Avg latency: {avg_latency:.4f}s, Avg throughput: {avg_throughput:.2f} rows/s")
+    return {
         "avg_latency_sec": avg_latency,
         "avg_throughput_rows_per_sec": avg_throughput,
-        "queries": [
-            {"latency_sec": l, "throughput_rows_per_sec": t, "rows": r}
-            for l, t, r in zip(latency_list, thr_list, rows_list)
-        ],
-        "aggregated_metrics": metrics_to_dict(agg),
+        "avg_ttfr_sec": window.mean("ttfr_s"),
+        "latency_percentiles": percentile_table(latency),
+        "latency_histograms": latency,
+        "query_count": window.count,
+        "sources": dict(window.sources),
+        "window": {"started_at": window.started_at, "ended_at": window.ended_at},
+        # به‌جای لیست تک‌تک کوئری‌ها: جدول per fingerprint
+        "per_query": window.per_query_table(),
+        "aggregated_metrics": metrics_to_dict(window.metrics()),
+        # نمونه‌ی محدود اجراهای واقعی برای system.query_log
+        "query_id_sample": list(window.query_ids),
+        "admission": admission.stats.snapshot(),
+        # latency هر lane (صف + اجرا) + pool هر lane
+        **router.snapshot(),
         "count_cache_in_scenario": COUNT_CACHE_IN_SCENARIO,
+        # admission/lanes/pools مال همین worker هستند؛ نتایج کوئری‌ها از همه‌ی worker ها
+        "worker_pid": os.getpid(),
+        "server_workers": SERVER2_WORKERS,
     }
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
 
-    print(f"[scenario] saved figure: {plot_path}")
-    print(f"[scenario] saved json:   {json_path}")
-    print(f"✅ Scenario complete. Avg latency: {avg_latency:.4f}s, Avg throughput: {avg_throughput:.2f} rows/s")
+def enrich_scenario(data: dict) -> dict:
+    # system.query_log: ردیف/بایت خوانده شده، حافظه، projection ها و MV ها (از همه‌ی replica ها)
+    server_stats = fetch_query_log(next(iter(router.pools.values())), data["query_id_sample"])
+    return {**data, "server_stats": summarize_query_log(list(server_stats.values()))}
 
-    with results_lock:
-        results.clear()
+def perform_maintenance_tasks(latency_list: list[float]) -> dict:
+    report_id, _ = reports.submit(lambda: collect_scenario(latency_list), enrich_scenario)
+    return {"report_id": report_id, "json_path": str(RESULT_DIR / f"{report_id}.json")}
 
 # ---------------- Server Bootstrap ----------------
-def start_server(host=HOST, port=PORT):
+def start_admission():
+    admission.start()
+
+def start_lanes() -> LaneRouter:
+    global router
+    router = build_router(POOL_SIZE)
+    return router
+
+def start_server(host=HOST, port=PORT, reuse_port=False):
     global shutdown_flag
 
-    db_pool = create_client_pool(pool_size=POOL_SIZE)
-    for _ in range(POOL_SIZE):
-        threading.Thread(target=dispatcher, args=(db_pool,), daemon=True).start()
+    start_lanes()
+    start_admission()
+    for name, lane in router.lanes.items():
+        lane_queues[name] = BlockingScheduler(SCHED_CLASS_WEIGHTS)
+        for _ in range(lane.slots):
+            threading.Thread(target=dispatcher, args=(name, router.pools[name]), daemon=True).start()
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((host, port))
-    server.listen()
+    server = listen_socket(host, port, reuse_port)
 
     print(f"[✓] Server listening on {host}:{port}")
 
@@ -341,5 +503,52 @@ def start_server(host=HOST, port=PORT):
         time.sleep(1.0)
         print("[✓] Server shutdown complete")
 
+def start_async_server(host=HOST, port=PORT, reuse_port=False):
+    from serving.async_server import run_async_server
+
+    start_lanes()
+    start_admission()
+    run_async_server(host, port, router,
+                     execute=exec_query_with_metrics,
+                     execute_stream=exec_query_streaming,
+                     encode=encode_response,
+                     maintenance=perform_maintenance_tasks,
+                     class_weights=SCHED_CLASS_WEIGHTS,
+                     admission=admission,
+                     trace=tracer,
+                     rewrite=request_sql,
+                     reuse_port=reuse_port)
+
+def _prefork_worker(serve, host, port):
+    threading.Thread(target=publish_results_loop, daemon=True, name="results-publisher").start()
+    serve(host, port, reuse_port=True)
+
+def start_prefork(host=HOST, port=PORT, workers=SERVER2_WORKERS):
+    global result_store, _mem_cache, _mem_lock
+    os.environ.setdefault("BENCH_RUN_ID", new_run_id())  # یک run برای همه‌ی worker ها
+    manager = None
+    if redis_client is not None:
+        # کش از قبل در Redis مشترک است؛ نتایج سناریو هم همان‌جا
+        result_store = RedisResultStore(redis_client)
+        result_store.drain()  # باقی‌مانده‌ی اجرای قبلی
+    else:
+        # بدون Redis: حافظه‌ی مشترک از طریق Manager (قبل از fork ساخته می‌شود)
+        manager = mp.get_context("fork").Manager()
+        result_store = ManagedResultStore(manager.list(), manager.Lock())
+        _mem_cache, _mem_lock = manager.dict(), manager.Lock()
+
+    # lanes، pool ها، admission و thread ها داخل هر worker بعد از fork ساخته می‌شوند
+    serve = start_async_server if SERVER_MODE == "asyncio" else start_server
+    try:
+        Supervisor(lambda idx: _prefork_worker(serve, host, port), workers, name="server2").run()
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
 if __name__ == "__main__":
-    start_server()
+    if SERVER2_WORKERS > 1:
+        start_prefork()
+    elif SERVER_MODE == "asyncio":
+        start_async_server()
+    else:
+        start_server()
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+# ---------------- Deadlines, load shedding, cancellation ----------------
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "120"))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "1000"))
+KILL_CHECK_INTERVAL_S = float(os.getenv("KILL_CHECK_INTERVAL_S", "0.5"))
+
+# کدهای خطا در payload فریم ERROR
+CODE_SHED = "shed"
+CODE_TIMEOUT = "timeout"
+CODE_CANCELLED = "cancelled"
+
+
+class AdmissionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"admitted": 0, "shed": 0, "timed_out": 0, "cancelled": 0, "abandoned": 0}
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] += n
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+@dataclass
+class _Inflight:
+    deadline: float
+    is_abandoned: Callable[[], bool]
+    reason: Optional[str] = None
+
+
+class QueryWatchdog:
+    """Kills (``KILL QUERY``) executions that pass their deadline or whose client went away."""
+
+    def __init__(self, kill_fn: Callable[[str], None], stats: AdmissionStats,
+                 interval_s: float = KILL_CHECK_INTERVAL_S):
+        self.kill_fn = kill_fn
+        self.stats = stats
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Inflight] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, query_id: str, deadline: float, is_abandoned: Callable[[], bool]):
+        with self._lock:
+            self._inflight[query_id] = _Inflight(deadline, is_abandoned)
+
+    def unregister(self, query_id: str) -> Optional[str]:
+        """Forget *query_id*; returns why it was cancelled (``timeout``/``abandoned``) or ``None``."""
+        with self._lock:
+            item = self._inflight.pop(query_id, None)
+        return item.reason if item else None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="query-watchdog")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_s)
+            self.check(time.time())
+
+    def check(self, now: float):
+        victims = []
+        with self._lock:
+            for qid, item in self._inflight.items():
+                if item.reason is not None:
+                    continue
+                if now > item.deadline:
+                    item.reason = CODE_TIMEOUT
+                elif item.is_abandoned():
+                    item.reason = "abandoned"
+                else:
+                    continue
+                victims.append((qid, item.reason))
+        # KILL بیرون از lock؛ یک رفت‌وبرگشت HTTP است
+        for qid, reason in victims:
+            try:
+                self.kill_fn(qid)
+                self.stats.incr("cancelled")
+                if reason == CODE_TIMEOUT:
+                    self.stats.incr("timed_out")
+                print(f"[watchdog] killed query {qid} ({reason})")
+            except Exception as e:
+                print(f"[watchdog] KILL QUERY failed for {qid}: {e}")
+
+
+class AdmissionControl:
+    def __init__(self, kill_fn: Callable[[str], None],
+                 deadline_s: float = REQUEST_DEADLINE_S, max_queue_depth: int = MAX_QUEUE_DEPTH):
+        self.deadline_s = deadline_s
+        self.max_queue_depth = max_queue_depth
+        self.stats = AdmissionStats()
+        self.watchdog = QueryWatchdog(kill_fn, self.stats)
+
+    def start(self):
+        self.watchdog.start()
+
+    def deadline_for(self, ts: float) -> float:
+        return ts + self.deadline_s
+
+    def admit(self, queue_depth: int) -> bool:
+        """Fast rejection when the queue is full (load shedding)."""
+        if queue_depth >= self.max_queue_depth:
+            self.stats.incr("shed")
+            return False
+        self.stats.incr("admitted")
+        return True
+
+    def expired(self, deadline: float, now: Optional[float] = None) -> bool:
+        if (time.time() if now is None else now) > deadline:
+            self.stats.incr("timed_out")
+            return True
+        return False
+
+
+def clickhouse_killer(admin_client) -> Callable[[str], None]:
+    """``kill_fn`` for :class:`QueryWatchdog` using a dedicated (non-pooled) client."""
+    def kill(query_id: str):
+        admin_client.command(f"KILL QUERY WHERE query_id = '{query_id}' ASYNC")
+    return kill
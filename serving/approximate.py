@@ -0,0 +1,298 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from query_scenarios.sql_fingerprint import lex, Token
+
+# ---------------- Approximate query mode ----------------
+# کوئری‌های داشبورد (مثل Q3، Q5، Q7، Q9) به عدد دقیق نیاز ندارند. بازنویسی در سطح token:
+#   FROM [db.]ny_taxi_trips [AS t] → FROM [db.]ny_taxi_trips_sampled [AS t] SAMPLE p   (جدول با SAMPLE BY، init_clickhouse.py)
+#   sum(x) → sum(x) / p ، count(x) → count(x) / p ، avg(x) بدون تغییر
+# و برای هر ستون تجمیعی یک ستون <alias>_stderr (خطای استاندارد؛ بازه‌ی 95% ≈ ±1.96·stderr):
+#   sum:   sqrt((1-p)·Σx²) / p        count: sqrt((1-p)·n) / p        avg: stddevSamp(x) / sqrt(n)
+# (نمونه‌گیری Bernoulli روی hash؛ برای عبارت خطی روی یک تجمیع، مثل avg(...) * 100، خطا هم خطی منتقل می‌شود)
+# quantile/median روی نمونه بدون ضریب تخمین زده می‌شوند (بدون ستون stderr). فقط SELECT تک‌جدولی از
+# APPROX_SOURCE_TABLE بدون JOIN/WITH/UNION/HAVING نمونه‌گیری می‌شود؛ جدا از آن توابع دقیق همیشه با
+# نسخه‌ی تقریبی عوض می‌شوند (uniqExact → uniq، count(DISTINCT) → uniq، quantileExact → quantileTDigest).
+#   APPROX_MODE: flag (پیش‌فرض؛ فقط درخواست‌های FLAG_APPROX) | all (هر کوئری واجد شرایط) | off
+APPROX_MODE = os.getenv("APPROX_MODE", "flag")
+APPROX_SAMPLE_RATE = float(os.getenv("APPROX_SAMPLE_RATE", "0.1"))
+APPROX_SOURCE_TABLE = os.getenv("APPROX_SOURCE_TABLE", "ny_taxi_trips")
+APPROX_TABLE = os.getenv("APPROX_TABLE", "ny_taxi_trips_sampled")
+APPROX_CONFIDENCE_Z = 1.96
+
+SCALABLE_AGGREGATES = frozenset({"sum", "count", "avg"})
+# روی نمونه بدون ضریب قابل استفاده‌اند ولی خطای بسته ندارند (فقط تخمین، بدون ستون stderr)
+SCALE_FREE_AGGREGATES = frozenset({"quantile", "quantiles", "quantiletdigest", "quantilestdigest",
+                                   "median", "mediantdigest"})
+# تجمیع‌هایی که روی نمونه قابل تخمین نیستند → نمونه‌گیری انجام نمی‌شود
+OTHER_AGGREGATES = frozenset("""
+    min max any anylast argmin argmax uniq uniqexact uniqcombined uniqhll12 uniqtheta quantileexact
+    quantilesexact quantiletiming medianexact grouparray groupuniqarray topk stddevpop stddevsamp varpop
+    varsamp corr covarpop covarsamp summap sumif countif avgif
+""".split())
+AGGREGATES = SCALABLE_AGGREGATES | SCALE_FREE_AGGREGATES | OTHER_AGGREGATES
+FUNCTION_APPROXIMATIONS = {
+    "uniqExact": "uniq",
+    "quantileExact": "quantileTDigest",
+    "quantilesExact": "quantilesTDigest",
+    "medianExact": "medianTDigest",
+}
+
+Lexeme = Tuple[Token, str]  # (token کانونیکال، متن اصلی) از sql_fingerprint.lex
+_OPEN: Token = ("op", "(")
+_CLOSE: Token = ("op", ")")
+_COMMA: Token = ("op", ",")
+# clause هایی که بعد از FROM <table> [AS alias] مجازند
+_AFTER_FROM = frozenset({"PREWHERE", "WHERE", "GROUP", "ORDER", "LIMIT", "SETTINGS", "FORMAT"})
+
+
+@dataclass
+class ApproxPlan:
+    sql: str
+    sample_rate: Optional[float]  # None: فقط جایگزینی توابع، بدون SAMPLE
+    table: Optional[str]
+    key_columns: List[str] = field(default_factory=list)
+    estimate_columns: List[str] = field(default_factory=list)
+    stderr_columns: Dict[str, str] = field(default_factory=dict)
+    functions: List[str] = field(default_factory=list)
+
+    def describe(self) -> Dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "table": self.table,
+            "estimate_columns": self.estimate_columns,
+            "stderr_columns": self.stderr_columns,
+            "confidence_z": APPROX_CONFIDENCE_Z if self.stderr_columns else None,
+            "functions": self.functions,
+        }
+
+
+def _join(lexemes: List[Lexeme]) -> str:
+    return " ".join(raw for _, raw in lexemes)
+
+
+def _match(lexemes: List[Lexeme], i: int) -> int:
+    """Index of the ``)`` closing the ``(`` at ``i``."""
+    depth = 0
+    for j in range(i, len(lexemes)):
+        if lexemes[j][0] == _OPEN:
+            depth += 1
+        elif lexemes[j][0] == _CLOSE:
+            depth -= 1
+            if depth == 0:
+                return j
+    raise ValueError("unbalanced parentheses")
+
+
+def _top_level(lexemes: List[Lexeme], target: Token) -> int:
+    depth = 0
+    for j, (tok, _) in enumerate(lexemes):
+        if tok == _OPEN:
+            depth += 1
+        elif tok == _CLOSE:
+            depth -= 1
+        elif depth == 0 and tok == target:
+            return j
+    return -1
+
+
+def _split_items(lexemes: List[Lexeme]) -> List[List[Lexeme]]:
+    items, depth, cur = [], 0, []
+    for lx in lexemes:
+        if lx[0] == _OPEN:
+            depth += 1
+        elif lx[0] == _CLOSE:
+            depth -= 1
+        if depth == 0 and lx[0] == _COMMA:
+            items.append(cur)
+            cur = []
+        else:
+            cur.append(lx)
+    items.append(cur)
+    return items
+
+
+def _aggregate_calls(expr: List[Lexeme]) -> List[Tuple[int, int, str]]:
+    """``(name index, index of the last closing paren, lowercase name)`` of every aggregate call."""
+    calls, j = [], 0
+    while j < len(expr) - 1:
+        (kind, text), _ = expr[j]
+        if kind == "ident" and expr[j + 1][0] == _OPEN and text.lower() in AGGREGATES:
+            end = _match(expr, j + 1)
+            # توابع پارامتری: quantile(0.9)(x)
+            if end + 1 < len(expr) and expr[end + 1][0] == _OPEN:
+                end = _match(expr, end + 1)
+            calls.append((j, end, text.lower()))
+            j = end + 1
+        else:
+            j += 1
+    return calls
+
+
+def _estimate(name: str, arg: str, p: str) -> Tuple[str, str]:
+    """Estimator of one aggregate over the sample and its standard error."""
+    if name == "sum":
+        return f"(sum({arg}) / {p})", f"(sqrt((1 - {p}) * sum(({arg}) * ({arg}))) / {p})"
+    if name == "count":
+        return f"(count({arg}) / {p})", f"(sqrt((1 - {p}) * count({arg})) / {p})"
+    return f"avg({arg})", f"ifNotFinite(stddevSamp({arg}) / sqrt(count({arg})), 0)"
+
+
+def _sampled_source(lexemes: List[Lexeme], f: int) -> Optional[Tuple[str, int]]:
+    """
+    ``FROM [db.]APPROX_SOURCE_TABLE [AS alias]`` (FROM at ``f``) → ``([db.]APPROX_TABLE [AS alias], index
+    after it)``; ``None`` for any other FROM shape, so nothing is sampled by a half-understood rewrite.
+    """
+    tokens = [tok for tok, _ in lexemes]
+    j, db = f + 1, ""
+    if tokens[j + 1:j + 2] == [("op", ".")]:
+        if tokens[j][0] != "ident":
+            return None
+        db, j = f"{lexemes[j][1]}.", j + 2
+    if tokens[j:j + 1] != [("ident", APPROX_SOURCE_TABLE)]:
+        return None
+    target, j = f"{db}{APPROX_TABLE}", j + 1
+    # ClickHouse: FROM t AS x SAMPLE p (alias قبل از SAMPLE)؛ alias بدون AS (FROM t x) پشتیبانی نمی‌شود
+    if tokens[j:j + 1] == [("kw", "AS")]:
+        if j + 1 >= len(tokens) or tokens[j + 1][0] != "ident":
+            return None
+        target, j = f"{target} AS {lexemes[j + 1][1]}", j + 2
+    if j < len(tokens) and not (tokens[j][0] == "kw" and tokens[j][1] in _AFTER_FROM):
+        return None
+    return target, j
+
+
+def _sampled(lexemes: List[Lexeme], sample_rate: float) -> Optional[ApproxPlan]:
+    tokens = [tok for tok, _ in lexemes]
+    if not tokens or tokens[0] != ("kw", "SELECT") or tokens.count(("kw", "SELECT")) != 1:
+        return None
+    if any(t[0] == "kw" and t[1] in ("JOIN", "WITH", "UNION", "HAVING", "SAMPLE", "FINAL", "DISTINCT")
+           for t in tokens):
+        return None
+    f = _top_level(lexemes, ("kw", "FROM"))
+    if f < 0 or f + 1 >= len(tokens):
+        return None
+    source = _sampled_source(lexemes, f)
+    if source is None:
+        return None
+    target, t_end = source
+
+    p = f"{sample_rate:g}"
+    plan = ApproxPlan(sql="", sample_rate=sample_rate, table=APPROX_TABLE)
+    items: List[str] = []
+    stderr_items: List[str] = []
+    for n, item in enumerate(_split_items(lexemes[1:f]), 1):
+        alias, expr = None, item
+        if len(item) >= 3 and item[-2][0] == ("kw", "AS"):
+            alias, expr = item[-1][1], item[:-2]
+        calls = _aggregate_calls(expr)
+        if not calls:
+            plan.key_columns.append(alias or _join(expr))
+            items.append(_join(item))
+            continue
+        names = {name for _, _, name in calls}
+        if names & OTHER_AGGREGATES:
+            return None
+        if any(expr[s + 2][0] == ("kw", "DISTINCT") for s, _, _ in calls):
+            return None  # count(DISTINCT) روی نمونه مقیاس‌پذیر نیست
+        alias = alias or f"agg{n}"
+        plan.estimate_columns.append(alias)
+        if names <= SCALE_FREE_AGGREGATES:
+            items.append(f"{_join(expr)} AS {alias}")
+            continue
+        if names & SCALE_FREE_AGGREGATES:
+            return None
+        # هر تجمیع با تخمینش؛ stderr عبارت = |f(تخمین + stderr) − f(تخمین)| (دقیق برای عبارت خطی)
+        est_parts, bumped_parts, last = [], [], 0
+        for s, e, name in calls:
+            est, se = _estimate(name, _join(expr[s + 2:e]), p)
+            prefix = _join(expr[last:s])
+            est_parts += [prefix, est]
+            bumped_parts += [prefix, f"({est} + {se})"]
+            last = e + 1
+        suffix = _join(expr[last:])
+        est_expr = " ".join(x for x in est_parts + [suffix] if x)
+        items.append(f"{est_expr} AS {alias}")
+        if len(calls) == 1:
+            if len(expr) == calls[0][1] + 1 and calls[0][0] == 0:
+                stderr = _estimate(calls[0][2], _join(expr[2:calls[0][1]]), p)[1]
+            else:
+                bumped = " ".join(x for x in bumped_parts + [suffix] if x)
+                stderr = f"abs(({bumped}) - ({est_expr}))"
+            stderr_items.append(f"{stderr} AS {alias}_stderr")
+            plan.stderr_columns[alias] = f"{alias}_stderr"
+    if not plan.estimate_columns:
+        return None
+    rest = _join(lexemes[t_end:])
+    plan.sql = f"SELECT {', '.join(items + stderr_items)} FROM {target} SAMPLE {p} {rest}".strip()
+    return plan
+
+
+def _approx_functions(lexemes: List[Lexeme]) -> Tuple[List[Lexeme], List[str]]:
+    out, used = [], []
+    i = 0
+    while i < len(lexemes):
+        (kind, text), _ = lexemes[i]
+        nxt = lexemes[i + 1][0] if i + 1 < len(lexemes) else None
+        if kind == "ident" and text in FUNCTION_APPROXIMATIONS and nxt == _OPEN:
+            repl = FUNCTION_APPROXIMATIONS[text]
+            out.append((("ident", repl), repl))
+            used.append(f"{text}→{repl}")
+        elif (kind == "ident" and text.lower() == "count" and nxt == _OPEN
+              and i + 2 < len(lexemes) and lexemes[i + 2][0] == ("kw", "DISTINCT")):
+            out += [(("ident", "uniq"), "uniq"), lexemes[i + 1]]
+            used.append("count(DISTINCT)→uniq")
+            i += 3
+            continue
+        else:
+            out.append(lexemes[i])
+        i += 1
+    return out, used
+
+
+def approximate(sql: str, sample_rate: float = APPROX_SAMPLE_RATE) -> Optional[ApproxPlan]:
+    """Approximate rewrite of ``sql``; ``None`` when nothing can be approximated."""
+    lexemes = lex(sql)
+    approx, used = _approx_functions(lexemes)
+    plan = _sampled(approx, sample_rate) if 0 < sample_rate < 1 else None
+    if plan is not None:
+        plan.functions = used
+        return plan
+    if not used:
+        return None
+    return ApproxPlan(sql=_join(approx), sample_rate=None, table=None, functions=used)
+
+
+# ---------------- Serving hook ----------------
+# server2 SQL بازنویسی‌شده را به‌جای SQL اصلی صف می‌کند (lane، کش و آمار هر fingerprint جدا می‌مانند)؛
+# توضیح بازنویسی برای پاسخ با SQL جدید در یک LRU کوچک نگه داشته می‌شود.
+_described: "OrderedDict[str, Dict]" = OrderedDict()
+_described_lock = threading.Lock()
+_DESCRIBED_MAX = 1024
+
+
+def rewrite_for_request(sql: str, approximate_requested: bool, mode: str = APPROX_MODE) -> str:
+    if mode == "off" or (mode == "flag" and not approximate_requested):
+        return sql
+    try:
+        plan = approximate(sql)
+    except Exception as e:
+        print(f"[approx] rewrite failed, running exact: {e}")
+        return sql
+    if plan is None:
+        return sql
+    with _described_lock:
+        _described[plan.sql] = plan.describe()
+        _described.move_to_end(plan.sql)
+        while len(_described) > _DESCRIBED_MAX:
+            _described.popitem(last=False)
+    return plan.sql
+
+
+def approximation_of(sql: str) -> Optional[Dict]:
+    """Description of the rewrite that produced ``sql`` (``None`` for exact queries)."""
+    with _described_lock:
+        return _described.get(sql)
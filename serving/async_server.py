@@ -0,0 +1,270 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from serving.scheduler import FairScheduler
+from serving.admission import AdmissionControl, CODE_SHED, CODE_TIMEOUT
+from serving.lanes import LaneRouter
+from serving.trace import TraceWriter
+from serving.protocol import (
+    read_frame_async, write_frame_async, encode_rows,
+    MSG_QUERY, MSG_RESULT, MSG_ERROR, MSG_MAINTENANCE, MSG_ACK, MSG_CHUNK, MSG_END, FLAG_STREAM,
+)
+
+# ---------------- asyncio server core ----------------
+# یک event loop همه‌ی سوکت‌ها را نگه می‌دارد؛ فقط اجرای ClickHouse در executor محدود انجام می‌شود.
+# هزاران اتصال بیکار ≈ هزاران StreamReader، نه هزاران thread.
+# کلاینت streaming که نمی‌خواند: بعد از این مدت (یا deadline درخواست، هر کدام زودتر) کوئری لغو می‌شود
+STREAM_WRITE_TIMEOUT_S = float(os.getenv("STREAM_WRITE_TIMEOUT_S", "30"))
+
+@dataclass
+class AsyncTask:
+    writer: asyncio.StreamWriter
+    client_id: str
+    request_id: int
+    priority: int
+    ts: float
+    query: str
+    flags: int = 0
+    deadline: float = float("inf")
+    lane: str = ""
+
+
+class AsyncWorkQueue:
+    """Event-driven work queue: workers sleep on a Condition instead of polling."""
+
+    def __init__(self, class_weights: Optional[Dict[int, float]] = None):
+        # همان scheduler حالت threaded (aging + fairness بین کلاینت‌ها)
+        self._sched = FairScheduler(class_weights)
+        self._cond = asyncio.Condition()
+
+    def __len__(self):
+        return len(self._sched)
+
+    async def put(self, task: AsyncTask):
+        async with self._cond:
+            self._sched.push(task, task.client_id, task.priority, task.ts)
+            self._cond.notify()
+
+    async def get(self) -> AsyncTask:
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self._sched) > 0)
+            return self._sched.pop()
+
+
+class AsyncQueryServer:
+    def __init__(
+        self,
+        router: LaneRouter,
+        execute: Callable[[Any, str], dict],
+        encode: Callable[[dict], bytes],
+        maintenance: Callable[[list], dict],
+        class_weights: Optional[Dict[int, float]] = None,
+        execute_stream: Optional[Callable[[Any, str, Callable], dict]] = None,
+        admission: Optional[AdmissionControl] = None,
+        trace: Optional[TraceWriter] = None,
+        rewrite: Optional[Callable[[str, int], str]] = None,
+    ):
+        self.router = router
+        self.trace = trace or TraceWriter(enabled=False)
+        # بازنویسی SQL بر اساس flags پیام (مثلاً FLAG_APPROX) قبل از route و صف
+        self.rewrite = rewrite
+        self.execute = execute
+        self.execute_stream = execute_stream
+        self.admission = admission
+        self.encode = encode
+        self.maintenance = maintenance
+        # هر lane صف و worker های خودش (= سهم اتصال همان lane) را دارد
+        self.queues = {name: AsyncWorkQueue(class_weights) for name in router.lanes}
+        self.workers = sum(lane.slots for lane in router.lanes.values())
+        # executor محدود: تعداد thread ها = سقف اتصال‌های ClickHouse
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ch-exec")
+        self.active_connections = 0
+        # event loop فقط weak reference به task ها نگه می‌دارد؛ بدون این لیست worker بیکار ممکن است GC شود
+        self._workers: list = []
+
+    # ---- Worker
+    def queued_tasks(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    async def _worker(self, lane: str, idx: int):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[lane]
+        settings = self.router.settings(lane)
+        print(f"[async-worker {lane}/{idx}] started")
+        while True:
+            task = await queue.get()
+            if task.writer.is_closing():
+                if self.admission is not None:
+                    self.admission.stats.incr("abandoned")
+                continue
+            if self.admission is not None and self.admission.expired(task.deadline):
+                await self._reply_error(task, "deadline exceeded while queued", CODE_TIMEOUT)
+                continue
+
+            query_id = str(uuid.uuid4())
+            if self.admission is not None:
+                self.admission.watchdog.register(query_id, task.deadline, task.writer.is_closing)
+            started_at = time.time()
+            try:
+                if task.flags & FLAG_STREAM and self.execute_stream is not None:
+                    on_block = self._block_sender(task, loop, query_id)
+                    run = partial(self._with_client, lane, self.execute_stream, task.query, on_block,
+                                  query_id=query_id, settings=settings, session=task.client_id,
+                                  queue_wait_s=started_at - task.ts)
+                    result = await loop.run_in_executor(self.executor, run)
+                    reply_type = MSG_END
+                else:
+                    run = partial(self._with_client, lane, self.execute, task.query,
+                                  query_id=query_id, settings=settings, session=task.client_id,
+                                  queue_wait_s=started_at - task.ts)
+                    result = await loop.run_in_executor(self.executor, run)
+                    reply_type = MSG_RESULT
+                self.router.record(lane, task.query, task.ts, started_at, time.time(),
+                                   result["latency_s"] if result["source"] == "db" else None)
+                await self._reply(task, reply_type, self.encode(result))
+                print(f"[✓] Query done for {task.client_id} (lane={lane}, prio={task.priority}, "
+                      f"source={result['source']})")
+            except Exception as e:
+                reason = self.admission.watchdog.unregister(query_id) if self.admission is not None else None
+                print(f"[!] Error executing query for {task.client_id} ({reason or 'error'}): {e}")
+                await self._reply_error(task, str(e), reason or "error")
+            finally:
+                if self.admission is not None:
+                    self.admission.watchdog.unregister(query_id)
+
+    def _with_client(self, lane: str, fn, *args, **kwargs):
+        # داخل thread executor: checkout از pool همان lane (replica ی کم‌بارتر یا sticky) → اجرا → checkin
+        with self.router.pools[lane].connection(session=kwargs.pop("session", None)) as db_client:
+            return fn(db_client, *args, **kwargs)
+
+    async def _reply_error(self, task: AsyncTask, message: str, code: str):
+        await self._reply(task, MSG_ERROR, json.dumps({"error": message, "code": code}).encode())
+
+    def _block_sender(self, task: AsyncTask, loop: asyncio.AbstractEventLoop, query_id: str):
+        # از thread اجرای کوئری صدا زده می‌شود؛ منتظر drain می‌ماند → backpressure تا ClickHouse.
+        # انتظار محدود است: وگرنه کلاینتی که نمی‌خواند thread و اتصال pool را برای همیشه نگه می‌دارد
+        def on_block(block) -> int:
+            data, flags = encode_rows(block)
+            fut = asyncio.run_coroutine_threadsafe(
+                write_frame_async(task.writer, MSG_CHUNK, task.request_id, data, flags=flags), loop)
+            timeout = max(0.0, min(STREAM_WRITE_TIMEOUT_S, task.deadline - time.time()))
+            try:
+                fut.result(timeout)
+            except FutureTimeout:
+                fut.cancel()
+                # بافر ارسال‌نشده دور ریخته می‌شود؛ بستن stream در stream_query هم HTTP را می‌بندد
+                loop.call_soon_threadsafe(task.writer.transport.abort)
+                if self.admission is not None:
+                    try:
+                        # خود watchdog هم (اتصال در حال بسته شدن) KILL می‌کرد؛ یک بار کافی است
+                        self.admission.watchdog.unregister(query_id)
+                        self.admission.watchdog.kill_fn(query_id)
+                        self.admission.stats.incr("cancelled")
+                    except Exception as e:
+                        print(f"[!] KILL QUERY failed for {query_id}: {e}")
+                raise TimeoutError(f"client did not read the stream within {timeout:.1f}s")
+            return len(data)
+        return on_block
+
+    @staticmethod
+    async def _reply(task: AsyncTask, msg_type: int, payload: bytes):
+        if task.writer.is_closing():
+            print(f"[-] Client {task.client_id} gone before response")
+            return
+        try:
+            await write_frame_async(task.writer, msg_type, task.request_id, payload)
+        except (ConnectionResetError, BrokenPipeError):
+            print(f"[-] Client {task.client_id} gone before response")
+
+    # ---- Connection handler
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        addr = writer.get_extra_info("peername")
+        client_id = str(uuid.uuid4())
+        self.active_connections += 1
+        print(f"[>] Client {client_id} connected from {addr}")
+        self.trace.connect(client_id, addr)
+        try:
+            while True:
+                frame = await read_frame_async(reader)
+                if frame is None:
+                    break  # EOF: peer بسته شد
+
+                if frame.msg_type == MSG_MAINTENANCE:
+                    self.trace.maintenance(client_id)
+                    loop = asyncio.get_running_loop()
+                    # فقط جمع‌آوری را زمان‌بندی می‌کند و report_id برمی‌گرداند
+                    ack = await loop.run_in_executor(None, self.maintenance, frame.json() or [])
+                    await write_frame_async(writer, MSG_ACK, frame.request_id, json.dumps(ack).encode())
+                    continue
+
+                if frame.msg_type != MSG_QUERY:
+                    await write_frame_async(writer, MSG_ERROR, frame.request_id, json.dumps(
+                        {"error": f"unexpected message type {frame.msg_type}"}).encode())
+                    continue
+
+                self.trace.query(client_id, frame.text(), frame.priority or 1, frame.flags)
+                if self.admission is not None and not self.admission.admit(self.queued_tasks()):
+                    await write_frame_async(writer, MSG_ERROR, frame.request_id, json.dumps(
+                        {"error": "server overloaded", "code": CODE_SHED}).encode())
+                    continue
+
+                priority = frame.priority or 1
+                ts = time.time()
+                deadline = self.admission.deadline_for(ts) if self.admission is not None else float("inf")
+                sql = frame.text()
+                if self.rewrite is not None:
+                    sql = self.rewrite(sql, frame.flags)
+                if self.router.cheap_to_route(sql):
+                    lane = self.router.route(sql)
+                else:
+                    # اولین بار برای این fingerprint: EXPLAIN ESTIMATE نباید event loop را بلاک کند
+                    lane = await asyncio.get_running_loop().run_in_executor(None, self.router.route, sql)
+                await self.queues[lane].put(AsyncTask(writer, client_id, frame.request_id, priority,
+                                                      ts, sql, frame.flags, deadline, lane))
+                print(f"[+] Task queued from {client_id} (req={frame.request_id}, prio={priority}, lane={lane})")
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except Exception as e:
+            print(f"[!] Client error ({addr}): {e}")
+        finally:
+            self.active_connections -= 1
+            self.router.forget(client_id)
+            self.trace.close(client_id)
+            writer.close()
+            print(f"[-] Disconnected {addr}")
+
+    async def serve(self, host: str, port: int, backlog: int = 4096, reuse_port: bool = False):
+        self._workers = [asyncio.create_task(self._worker(name, i))
+                         for name, lane in self.router.lanes.items() for i in range(lane.slots)]
+        try:
+            server = await asyncio.start_server(self.handle_client, host, port, backlog=backlog,
+                                                reuse_port=reuse_port or None)
+            print(f"[✓] Async server listening on {host}:{port} (workers={self.workers})")
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
+
+def run_async_server(host, port, router, execute, encode, maintenance,
+                     class_weights=None, execute_stream=None, admission=None, trace=None, reuse_port=False,
+                     rewrite=None):
+    srv = AsyncQueryServer(router, execute, encode, maintenance, class_weights,
+                           execute_stream, admission, trace, rewrite)
+    try:
+        asyncio.run(srv.serve(host, port, reuse_port=reuse_port))
+    except KeyboardInterrupt:
+        print("\n[!] Server shutdown requested...")
+    finally:
+        srv.executor.shutdown(wait=False, cancel_futures=True)
+        print("[✓] Server shutdown complete")
@@ -0,0 +1,212 @@
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from query_scenarios.sql_fingerprint import shape_fingerprint
+from serving.pool import POOL_MIN
+from serving.replicas import ReplicaPoolSet, replica_registry, shared_pool
+
+# ---------------- Cost-based lanes ----------------
+# کوئری ارزان (مثلاً lookup روی MV) نباید پشت self-join سنگین منتظر بماند:
+# هر lane صف، dispatcher ها (= سهم اتصال) و تنظیمات ClickHouse خودش را دارد.
+LANES_ENABLED = os.getenv("LANES_ENABLED", "1") == "1"
+FAST_LANE_MAX_S = float(os.getenv("FAST_LANE_MAX_S", "0.5"))            # از تاریخچه‌ی latency
+FAST_LANE_MAX_ROWS = int(os.getenv("FAST_LANE_MAX_ROWS", "1000000"))    # از EXPLAIN ESTIMATE
+COST_EWMA_ALPHA = float(os.getenv("COST_EWMA_ALPHA", "0.3"))
+LANE_LATENCY_WINDOW = int(os.getenv("LANE_LATENCY_WINDOW", "10000"))
+# اتصال‌های جدا برای EXPLAIN ESTIMATE (طبقه‌بندی اولین اجرای هر shape)؛ از سهم هیچ lane ی کم نمی‌کند
+EXPLAIN_POOL_SLOTS = int(os.getenv("EXPLAIN_POOL_SLOTS", "2"))
+
+FAST = "fast"
+SLOW = "slow"
+DEFAULT = "default"
+
+
+def _int_setting(name: str, default: str) -> int:
+    return int(os.getenv(name, default))
+
+
+@dataclass
+class Lane:
+    name: str
+    slots: int                       # تعداد dispatcher / اتصال هم‌زمان
+    settings: Dict[str, int] = field(default_factory=dict)
+
+
+def default_lanes(total_slots: int) -> List[Lane]:
+    fast_slots = _int_setting("FAST_LANE_SLOTS", str(max(1, total_slots // 2)))
+    slow_slots = _int_setting("SLOW_LANE_SLOTS", str(max(1, total_slots - fast_slots)))
+    return [
+        Lane(FAST, fast_slots, {
+            "max_threads": _int_setting("FAST_LANE_MAX_THREADS", "2"),
+            "max_memory_usage": _int_setting("FAST_LANE_MAX_MEMORY", str(1 * 1024 ** 3)),
+        }),
+        Lane(SLOW, slow_slots, {
+            "max_threads": _int_setting("SLOW_LANE_MAX_THREADS", "8"),
+            "max_memory_usage": _int_setting("SLOW_LANE_MAX_MEMORY", str(8 * 1024 ** 3)),
+        }),
+    ]
+
+
+class CostEstimator:
+    """
+    Per-fingerprint cost: EWMA of observed latency when we have history, otherwise the
+    number of rows ``EXPLAIN ESTIMATE`` says the query will read (asked once per fingerprint).
+    """
+
+    def __init__(self, explain_fn: Optional[Callable[[str], int]] = None):
+        self.explain_fn = explain_fn
+        self._lock = threading.Lock()
+        self._latency: Dict[str, float] = {}
+        self._est_rows: Dict[str, int] = {}
+
+    def observe(self, sql: str, latency_s: float):
+        fp = shape_fingerprint(sql)
+        with self._lock:
+            prev = self._latency.get(fp)
+            self._latency[fp] = latency_s if prev is None else (
+                COST_EWMA_ALPHA * latency_s + (1 - COST_EWMA_ALPHA) * prev)
+
+    def known(self, sql: str) -> bool:
+        fp = shape_fingerprint(sql)
+        with self._lock:
+            return fp in self._latency or fp in self._est_rows or self.explain_fn is None
+
+    def classify(self, sql: str) -> str:
+        fp = shape_fingerprint(sql)
+        with self._lock:
+            latency = self._latency.get(fp)
+            rows = self._est_rows.get(fp)
+        if latency is not None:
+            return FAST if latency <= FAST_LANE_MAX_S else SLOW
+        if rows is None and self.explain_fn is not None:
+            try:
+                rows = self.explain_fn(sql)
+            except Exception as e:
+                print(f"[lanes] EXPLAIN ESTIMATE failed ({e}); routing to slow lane")
+                rows = FAST_LANE_MAX_ROWS + 1
+            with self._lock:
+                self._est_rows[fp] = rows
+        if rows is None:
+            return SLOW  # بدون هیچ اطلاعاتی محتاط باش
+        return FAST if rows <= FAST_LANE_MAX_ROWS else SLOW
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {"latency_ewma_s": dict(self._latency), "explain_rows": dict(self._est_rows)}
+
+
+def explain_estimate_rows(client, sql: str) -> int:
+    """Sum of ``rows`` over all tables in ``EXPLAIN ESTIMATE`` (rows ClickHouse expects to read)."""
+    res = client.query(f"EXPLAIN ESTIMATE {sql.strip().rstrip(';')}")
+    cols = list(res.column_names)
+    idx = cols.index("rows") if "rows" in cols else len(cols) - 1
+    return int(sum(int(r[idx]) for r in res.result_rows))
+
+
+class LaneStats:
+    """Bounded per-lane window of end-to-end latencies (queue wait + execution)."""
+
+    def __init__(self, lanes: List[str], window: int = LANE_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._lat = {name: deque(maxlen=window) for name in lanes}
+        self._wait = {name: deque(maxlen=window) for name in lanes}
+        self._count = {name: 0 for name in lanes}
+
+    def record(self, lane: str, queue_wait_s: float, total_s: float):
+        with self._lock:
+            self._lat[lane].append(total_s)
+            self._wait[lane].append(queue_wait_s)
+            self._count[lane] += 1
+
+    @staticmethod
+    def _pct(vals: List[float], q: float) -> float:
+        if not vals:
+            return 0.0
+        return vals[min(len(vals) - 1, int(q * len(vals)))]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        out = {}
+        with self._lock:
+            for name, lat in self._lat.items():
+                vals = sorted(lat)
+                waits = list(self._wait[name])
+                out[name] = {
+                    "count": self._count[name],
+                    "mean_latency_sec": sum(vals) / len(vals) if vals else 0.0,
+                    "p50_latency_sec": self._pct(vals, 0.50),
+                    "p90_latency_sec": self._pct(vals, 0.90),
+                    "p99_latency_sec": self._pct(vals, 0.99),
+                    "mean_queue_wait_sec": sum(waits) / len(waits) if waits else 0.0,
+                }
+        return out
+
+
+class LaneRouter:
+    """
+    Lanes + one pool set per lane (the lane's connection quota on every replica) + cost estimator
+    + per-lane stats.
+    With ``LANES_ENABLED=0`` there is a single ``default`` lane on the process-wide shared pool.
+    """
+
+    def __init__(self, lanes: List[Lane], pools: Dict[str, ReplicaPoolSet], estimator: CostEstimator):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.pools = pools
+        self.estimator = estimator
+        self.stats = LaneStats(list(self.lanes))
+
+    def cheap_to_route(self, sql: str) -> bool:
+        """True when :meth:`route` will not hit ClickHouse (safe to call on an event loop)."""
+        return len(self.lanes) == 1 or self.estimator.known(sql)
+
+    def route(self, sql: str) -> str:
+        if len(self.lanes) == 1:
+            return next(iter(self.lanes))
+        return self.estimator.classify(sql)
+
+    def settings(self, lane: str) -> Dict[str, int]:
+        return self.lanes[lane].settings
+
+    def record(self, lane: str, sql: str, enqueued_at: float, started_at: float, finished_at: float,
+               exec_latency_s: Optional[float] = None):
+        self.stats.record(lane, started_at - enqueued_at, finished_at - enqueued_at)
+        if exec_latency_s is not None:
+            self.estimator.observe(sql, exec_latency_s)
+
+    def forget(self, session: str):
+        """Drops the sticky replica of a disconnected client."""
+        for pools in self.pools.values():
+            pools.registry.forget(session)
+
+    def snapshot(self) -> Dict:
+        return {
+            "lanes": self.stats.snapshot(),
+            "lane_settings": {name: lane.settings for name, lane in self.lanes.items()},
+            "pools": {name: pool.stats() for name, pool in self.pools.items()},
+        }
+
+
+def build_router(total_slots: int) -> LaneRouter:
+    if not LANES_ENABLED:
+        return LaneRouter([Lane(DEFAULT, total_slots)], {DEFAULT: shared_pool()}, CostEstimator())
+    lanes = default_lanes(total_slots)
+    registry = replica_registry()
+    pools = {
+        lane.name: ReplicaPoolSet(registry, f"lane-{lane.name}", min_size=min(POOL_MIN, lane.slots),
+                                  max_size=lane.slots).warm()
+        for lane in lanes
+    }
+
+    # EXPLAIN ESTIMATE فقط index را می‌خواند؛ pool کوچک خودش را دارد تا طبقه‌بندی با کوئری‌های
+    # lane سریع سر اتصال رقابت نکند
+    explain_pool = ReplicaPoolSet(registry, "lane-explain", min_size=min(1, EXPLAIN_POOL_SLOTS),
+                                  max_size=EXPLAIN_POOL_SLOTS).warm()
+
+    def explain(sql: str) -> int:
+        with explain_pool.connection() as client:
+            return explain_estimate_rows(client, sql)
+
+    print("[lanes] " + ", ".join(f"{l.name}: slots={l.slots} settings={l.settings}" for l in lanes))
+    return LaneRouter(lanes, pools, CostEstimator(explain))
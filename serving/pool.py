@@ -0,0 +1,283 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import clickhouse_connect
+
+# ---------------- Config ----------------
+CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "localhost")
+CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
+CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
+CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
+
+POOL_MIN = int(os.getenv("POOL_MIN", "2"))
+POOL_MAX = int(os.getenv("POOL_MAX", os.getenv("POOL_SIZE", "10")))
+# اگر بعد از این مدت اتصال آزاد پیدا نشد و به سقف نرسیده‌ایم، pool بزرگ می‌شود
+POOL_GROW_AFTER_WAIT_S = float(os.getenv("POOL_GROW_AFTER_WAIT_S", "0.05"))
+POOL_IDLE_TIMEOUT_S = float(os.getenv("POOL_IDLE_TIMEOUT_S", "60"))
+POOL_VALIDATE_AFTER_S = float(os.getenv("POOL_VALIDATE_AFTER_S", "30"))
+POOL_MAINTENANCE_INTERVAL_S = float(os.getenv("POOL_MAINTENANCE_INTERVAL_S", "5"))
+
+# مرزهای histogram زمان انتظار checkout (ثانیه)
+WAIT_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+
+
+def make_client(host: str = CLICKHOUSE_HOST, port: int = CLICKHOUSE_PORT, **kwargs):
+    return clickhouse_connect.get_client(host=host, port=port, username=CLICKHOUSE_USER,
+                                         password=CLICKHOUSE_PASSWORD, **kwargs)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectFailed(Exception):
+    """No new client could be opened (server down), as opposed to every client being busy."""
+
+
+@dataclass
+class _Conn:
+    client: Any
+    created: float
+    last_used: float
+    last_validated: float
+
+
+class WaitHistogram:
+    def __init__(self, bounds: List[float] = WAIT_BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+        self.sum_s += seconds
+        self.max_s = max(self.max_s, seconds)
+
+    def to_dict(self) -> Dict:
+        labels = [f"<={b * 1000:g}ms" for b in self.bounds] + [f">{self.bounds[-1] * 1000:g}ms"]
+        return {
+            "count": self.total,
+            "mean_ms": (self.sum_s / self.total * 1000) if self.total else 0.0,
+            "max_ms": self.max_s * 1000,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class ClickHousePool:
+    """
+    Elastic, self-healing pool: validates on checkout, replaces dead clients with backoff,
+    grows up to ``max_size`` when checkouts wait and shrinks idle clients back to ``min_size``.
+    """
+
+    def __init__(self, factory: Callable[[], Any] = make_client, min_size: int = POOL_MIN,
+                 max_size: int = POOL_MAX, name: str = "clickhouse"):
+        self.factory = factory
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.name = name
+        self._cond = threading.Condition()
+        self._idle: List[_Conn] = []
+        self._size = 0          # idle + checked out + در حال ساخت
+        self._backoff_s = 0.0
+        self._next_create_at = 0.0
+        self.wait_hist = WaitHistogram()
+        self.counters = {"created": 0, "closed_idle": 0, "replaced": 0, "create_failures": 0, "validations": 0}
+        self._maint: Optional[threading.Thread] = None
+
+    # ---- lifecycle
+    def warm(self) -> "ClickHousePool":
+        """Opens ``min_size`` clients up front and starts the background maintenance thread."""
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            conn = self._create()
+            if conn is not None:
+                self._release(conn)
+        print(f"[pool:{self.name}] warmed {len(self._idle)}/{self.min_size} (max={self.max_size})")
+        if self._maint is None:
+            self._maint = threading.Thread(target=self._maintenance_loop, daemon=True, name=f"pool-{self.name}")
+            self._maint.start()
+        return self
+
+    def _create(self) -> Optional[_Conn]:
+        # slot از قبل در _size رزرو شده؛ در صورت شکست آزادش می‌کنیم
+        now = time.time()
+        if now < self._next_create_at:
+            time.sleep(self._next_create_at - now)
+        try:
+            client = self.factory()
+        except Exception as e:
+            with self._cond:
+                self._size -= 1
+                self.counters["create_failures"] += 1
+                self._backoff_s = min(max(self._backoff_s * 2, 0.1), 10.0)
+                self._next_create_at = time.time() + self._backoff_s
+                self._cond.notify()
+            print(f"[pool:{self.name}] connect failed ({e}); backoff {self._backoff_s:.1f}s")
+            return None
+        with self._cond:
+            self._backoff_s = 0.0
+            self.counters["created"] += 1
+        t = time.time()
+        return _Conn(client, t, t, t)
+
+    def _discard(self, conn: _Conn):
+        try:
+            conn.client.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _release(self, conn: _Conn):
+        conn.last_used = time.time()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @staticmethod
+    def _alive(conn: _Conn) -> bool:
+        try:
+            return bool(conn.client.ping())
+        except Exception:
+            return False
+
+    # ---- checkout / checkin
+    def checkout(self, timeout: Optional[float] = None, fail_fast: bool = False) -> _Conn:
+        """``fail_fast``: raise :class:`ConnectFailed` when opening a client fails instead of retrying."""
+        t0 = time.perf_counter()
+        deadline = None if timeout is None else t0 + timeout
+        first = True  # دور اول همیشه امتحان می‌شود (timeout=0 یعنی «اگر همین الان آزاد است»)
+        while True:
+            # ساخت اتصال هم ممکن است مدام شکست بخورد (سرور down)، نه فقط انتظار برای idle
+            if not first and deadline is not None and time.perf_counter() > deadline:
+                raise PoolExhausted(f"no connection within {timeout}s (max={self.max_size})")
+            first = False
+            conn = None
+            grow = False
+            with self._cond:
+                if not self._idle:
+                    # اول کمی منتظر اتصال آزاد؛ اگر نشد و جا داریم، بزرگ می‌شویم
+                    self._cond.wait_for(lambda: bool(self._idle), timeout=POOL_GROW_AFTER_WAIT_S)
+                if self._idle:
+                    conn = self._idle.pop()  # LIFO: اتصال‌های گرم‌تر، و idle های قدیمی برای shrink
+                elif self._size < self.max_size:
+                    self._size += 1
+                    grow = True
+                else:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhausted(f"no connection within {timeout}s (max={self.max_size})")
+                    self._cond.wait(timeout=remaining)
+                    continue
+            if grow:
+                conn = self._create()
+                if conn is None:
+                    if fail_fast:
+                        raise ConnectFailed(f"[{self.name}] could not open a ClickHouse client")
+                    continue
+            elif time.time() - conn.last_validated > POOL_VALIDATE_AFTER_S:
+                with self._cond:
+                    self.counters["validations"] += 1
+                if not self._alive(conn):
+                    self._replace(conn)
+                    continue
+                conn.last_validated = time.time()
+            with self._cond:
+                self.wait_hist.record(time.perf_counter() - t0)
+            return conn
+
+    def checkin(self, conn: _Conn, broken: bool = False) -> bool:
+        """Returns *conn* to the pool; a broken one is pinged first. ``False`` = it was dead and dropped."""
+        if broken and not self._alive(conn):
+            self._replace(conn)
+            return False
+        self._release(conn)
+        return True
+
+    def _replace(self, conn: _Conn):
+        with self._cond:
+            self.counters["replaced"] += 1
+        print(f"[pool:{self.name}] dropping dead connection")
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """``with pool.connection() as client:`` — on error the client is pinged before reuse."""
+        conn = self.checkout(timeout)
+        broken = False
+        try:
+            yield conn.client
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, broken=broken)
+
+    # ---- background maintenance
+    def _maintenance_loop(self):
+        while True:
+            time.sleep(POOL_MAINTENANCE_INTERVAL_S)
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"[pool:{self.name}] maintenance error: {e}")
+
+    def maintain(self):
+        now = time.time()
+        stale, to_check = [], []
+        with self._cond:
+            keep = []
+            # shrink: idle قدیمی‌تر از IDLE_TIMEOUT تا رسیدن به min_size
+            for conn in sorted(self._idle, key=lambda c: c.last_used):
+                if now - conn.last_used > POOL_IDLE_TIMEOUT_S and self._size - len(stale) > self.min_size:
+                    stale.append(conn)
+                elif now - conn.last_validated > POOL_VALIDATE_AFTER_S:
+                    to_check.append(conn)
+                else:
+                    keep.append(conn)
+            self._idle = keep
+        for conn in stale:
+            with self._cond:
+                self.counters["closed_idle"] += 1
+            self._discard(conn)
+        for conn in to_check:
+            with self._cond:
+                self.counters["validations"] += 1
+            if self._alive(conn):
+                conn.last_validated = time.time()
+                self._release(conn)
+            else:
+                self._replace(conn)
+        # refill تا min_size (با همان backoff ساخت اتصال)
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    break
+                self._size += 1
+            conn = self._create()
+            if conn is None:
+                break
+            self._release(conn)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min": self.min_size,
+                "max": self.max_size,
+                **self.counters,
+                "checkout_wait": self.wait_hist.to_dict(),
+            }
+
@@ -0,0 +1,96 @@
+import multiprocessing as mp
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Dict
+
+# ---------------- Prefork ----------------
+# N پروسه‌ی worker هر کدام سوکت خودشان را با SO_REUSEPORT روی همان پورت باز می‌کنند؛
+# kernel اتصال‌های جدید را بین آن‌ها پخش می‌کند و هر worker GIL خودش را دارد.
+RESTART_BACKOFF_MAX_S = float(os.getenv("PREFORK_RESTART_BACKOFF_MAX_S", "30"))
+STABLE_AFTER_S = 10.0  # worker ی که این مدت زنده ماند، backoff اش صفر می‌شود
+
+
+def listen_socket(host: str, port: int, reuse_port: bool = False, backlog: int = 4096) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT is not available on this platform")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class Supervisor:
+    """Forks ``workers`` copies of ``target(index)`` and restarts any that exit, with backoff."""
+
+    def __init__(self, target: Callable[[int], None], workers: int, name: str = "worker"):
+        self.target = target
+        self.workers = workers
+        self.name = name
+        self._ctx = mp.get_context("fork")
+        self._procs: Dict[int, mp.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._backoff: Dict[int, float] = {}
+        self._stopping = False
+        self.restarts = 0
+
+    def _child(self, idx: int):
+        # handler های supervisor با fork به ارث می‌رسند؛ worker باید با SIGTERM واقعاً خارج شود
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self.target(idx)
+
+    def _spawn(self, idx: int):
+        proc = self._ctx.Process(target=self._child, args=(idx,), name=f"{self.name}-{idx}", daemon=False)
+        proc.start()
+        self._procs[idx] = proc
+        self._started_at[idx] = time.time()
+        print(f"[supervisor] {self.name}-{idx} started (pid={proc.pid})")
+
+    def _stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for idx in range(self.workers):
+            self._spawn(idx)
+        pending: Dict[int, float] = {}  # idx → زمان restart
+        try:
+            while not self._stopping:
+                running = [p.sentinel for i, p in self._procs.items() if i not in pending]
+                timeout = min([0.5] + [max(0.0, at - time.time()) for at in pending.values()])
+                wait(running, timeout=timeout)
+                now = time.time()
+                for idx, proc in list(self._procs.items()):
+                    if proc.is_alive() or idx in pending:
+                        continue
+                    alive_for = now - self._started_at[idx]
+                    delay = 0.0 if alive_for > STABLE_AFTER_S else min(
+                        max(self._backoff.get(idx, 0.0) * 2, 0.5), RESTART_BACKOFF_MAX_S)
+                    self._backoff[idx] = delay
+                    pending[idx] = now + delay
+                    print(f"[supervisor] {self.name}-{idx} exited (code={proc.exitcode}); restart in {delay:.1f}s")
+                for idx, at in list(pending.items()):
+                    if at <= now and not self._stopping:
+                        del pending[idx]
+                        self.restarts += 1
+                        self._spawn(idx)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout: float = 5.0):
+        for proc in self._procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        deadline = time.time() + timeout
+        for proc in self._procs.values():
+            proc.join(max(0.0, deadline - time.time()))
+            if proc.is_alive():
+                proc.kill()
+        print(f"[supervisor] all {self.name}s stopped (restarts={self.restarts})")
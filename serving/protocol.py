@@ -0,0 +1,391 @@
+import asyncio
+import itertools
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# ---------------- Wire protocol ----------------
+# هر پیام = header ثابت 12 بایتی + payload
+#   length     u32  طول payload
+#   request_id u32  پاسخ‌ها با همین شناسه به درخواست وصل می‌شوند (ترتیب پاسخ‌ها آزاد است)
+#   type       u8   MSG_*
+#   priority   u8   1..9 برای QUERY
+#   flags      u16  FLAG_*
+HEADER = struct.Struct("!IIBBH")
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+MSG_QUERY = 1
+MSG_RESULT = 2
+MSG_ERROR = 3
+MSG_MAINTENANCE = 4
+MSG_ACK = 5
+MSG_CHUNK = 6   # یک بلوک از نتیجه‌ی streaming
+MSG_END = 7     # پایان stream + خلاصه (latency، rows، ttfr، ...)
+
+FLAG_COMPRESSED = 0x0001
+FLAG_STREAM = 0x0002    # روی QUERY: نتیجه را به‌صورت CHUNK...END بفرست
+FLAG_APPROX = 0x0004    # روی QUERY: اجرای تقریبی (SAMPLE + ستون‌های stderr) در صورت امکان؛ serving/approximate.py
+
+COMPRESS_MIN_BYTES = 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ConnectionClosed(Exception):
+    """Peer closed the socket in the middle of a frame."""
+
+
+@dataclass
+class Frame:
+    msg_type: int
+    request_id: int
+    payload: bytes
+    priority: int = 0
+    flags: int = 0
+
+    def json(self):
+        if not self.payload:
+            return None
+        raw = zlib.decompress(self.payload) if self.flags & FLAG_COMPRESSED else self.payload
+        return json.loads(raw.decode("utf-8"))
+
+    def text(self) -> str:
+        return self.payload.decode("utf-8")
+
+
+def encode_frame(msg_type: int, request_id: int, payload: bytes = b"", priority: int = 0, flags: int = 0) -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"payload too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload), request_id, msg_type, priority, flags) + payload
+
+
+def encode_rows(rows) -> tuple[bytes, int]:
+    """JSON-encodes a block of rows; compresses it (zlib, level 1) above ``COMPRESS_MIN_BYTES``."""
+    raw = json.dumps(rows, default=str, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return zlib.compress(raw, 1), FLAG_COMPRESSED
+    return raw, 0
+
+
+def _decode_header(raw: bytes):
+    length, request_id, msg_type, priority, flags = HEADER.unpack(raw)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"payload too large: {length} bytes")
+    return length, request_id, msg_type, priority, flags
+
+
+# ---------------- Blocking sockets ----------------
+def _recv_exact(sock: socket.socket, n: int, allow_eof: bool = False) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            # EOF دقیقاً روی مرز فریم = بستن عادی؛ وسط فریم = خطا
+            if allow_eof and not buf:
+                return None
+            raise ConnectionClosed(f"peer closed after {len(buf)}/{n} bytes")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_frame(sock: socket.socket) -> Optional[Frame]:
+    """Next frame from *sock*, or ``None`` when the peer closed cleanly."""
+    raw = _recv_exact(sock, HEADER.size, allow_eof=True)
+    if raw is None:
+        return None
+    length, request_id, msg_type, priority, flags = _decode_header(raw)
+    payload = _recv_exact(sock, length) if length else b""
+    return Frame(msg_type, request_id, payload, priority, flags)
+
+
+class FramedSocket:
+    """Socket wrapper whose ``send`` is safe to call from several dispatcher threads."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+        self.closed = False  # پس از EOF/close، تسک‌های در صف این اتصال رها شده‌اند
+
+    def recv(self) -> Optional[Frame]:
+        return read_frame(self.sock)
+
+    def send(self, msg_type: int, request_id: int, payload: bytes = b"", priority: int = 0, flags: int = 0):
+        data = encode_frame(msg_type, request_id, payload, priority, flags)
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# ---------------- asyncio streams ----------------
+async def read_frame_async(reader: asyncio.StreamReader) -> Optional[Frame]:
+    try:
+        raw = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionClosed(f"peer closed after {len(e.partial)}/{HEADER.size} header bytes")
+    length, request_id, msg_type, priority, flags = _decode_header(raw)
+    try:
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionClosed(f"peer closed after {len(e.partial)}/{length} payload bytes")
+    return Frame(msg_type, request_id, payload, priority, flags)
+
+
+async def write_frame_async(writer: asyncio.StreamWriter, msg_type: int, request_id: int,
+                            payload: bytes = b"", priority: int = 0, flags: int = 0):
+    writer.write(encode_frame(msg_type, request_id, payload, priority, flags))
+    await writer.drain()
+
+
+# ---------------- Client helpers ----------------
+class QueryError(Exception):
+    pass
+
+
+def _response_value(frame: Frame):
+    if frame.msg_type == MSG_ERROR:
+        raise QueryError((frame.json() or {}).get("error", "unknown error"))
+    return frame.json()
+
+
+class ProtocolClient:
+    """Blocking client: many pipelined requests on one socket, responses matched by request ID."""
+
+    def __init__(self, host: str, port: int, timeout: Optional[float] = None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(None)
+        self._framed = FramedSocket(self.sock)
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Future] = {}
+        self._streams: Dict[int, queue.Queue] = {}
+        self._lock = threading.Lock()
+        # خطای پایانی read loop؛ بعد از آن درخواست جدید فوراً خطا می‌دهد (کسی جوابش را نمی‌خواند)
+        self._closed: Optional[Exception] = None
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        err: Exception = ConnectionClosed("connection closed")
+        try:
+            while True:
+                frame = self._framed.recv()
+                if frame is None:
+                    break
+                with self._lock:
+                    stream = self._streams.get(frame.request_id)
+                    if stream is not None and frame.msg_type in (MSG_END, MSG_ERROR):
+                        del self._streams[frame.request_id]
+                    fut = None if stream is not None else self._pending.pop(frame.request_id, None)
+                if stream is not None:
+                    stream.put(frame)
+                elif fut is not None:
+                    fut.set_result(frame)
+        except Exception as e:
+            err = e
+        with self._lock:
+            self._closed = err
+            pending, self._pending = self._pending, {}
+            streams, self._streams = self._streams, {}
+        for fut in pending.values():
+            fut.set_exception(err)
+        for stream in streams.values():
+            stream.put(err)
+
+    def _register(self, table: dict, value) -> int:
+        rid = next(self._ids) & 0xFFFFFFFF
+        with self._lock:
+            if self._closed is not None:
+                raise ConnectionClosed(f"connection closed ({self._closed!r})") from self._closed
+            table[rid] = value
+        return rid
+
+    def _send(self, table: dict, rid: int, *args):
+        try:
+            self._framed.send(*args)
+        except OSError:
+            with self._lock:
+                table.pop(rid, None)
+            raise
+
+    def _request(self, msg_type: int, payload: bytes, priority: int = 0, flags: int = 0) -> Future:
+        fut: Future = Future()
+        rid = self._register(self._pending, fut)
+        self._send(self._pending, rid, msg_type, rid, payload, priority, flags)
+        return fut
+
+    def submit(self, sql: str, priority: int = 1, approximate: bool = False) -> Future:
+        """Send *sql* without waiting; the future resolves to the response frame."""
+        return self._request(MSG_QUERY, sql.encode("utf-8"), priority, FLAG_APPROX if approximate else 0)
+
+    def query(self, sql: str, priority: int = 1, timeout: Optional[float] = None, approximate: bool = False):
+        return _response_value(self.submit(sql, priority, approximate).result(timeout))
+
+    def maintenance(self, latency_list: list, timeout: Optional[float] = None):
+        fut = self._request(MSG_MAINTENANCE, json.dumps(latency_list).encode("utf-8"))
+        return _response_value(fut.result(timeout))
+
+    def stream(self, sql: str, priority: int = 1, approximate: bool = False) -> "ResultStream":
+        """Streams *sql*; iterate the returned object for row blocks, then read ``.summary``."""
+        frames: queue.Queue = queue.Queue()
+        rid = self._register(self._streams, frames)
+        flags = FLAG_STREAM | (FLAG_APPROX if approximate else 0)
+        self._send(self._streams, rid, MSG_QUERY, rid, sql.encode("utf-8"), priority, flags)
+        return ResultStream(frames.get)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._framed.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultStream:
+    """Iterator over the row blocks of one streamed query."""
+
+    def __init__(self, next_frame):
+        self._next_frame = next_frame
+        self.summary = None
+        self.ttfr_s: Optional[float] = None
+        self._t0 = time.perf_counter()
+
+    def _handle(self, frame):
+        if isinstance(frame, Exception):
+            raise frame
+        if frame.msg_type == MSG_CHUNK:
+            if self.ttfr_s is None:
+                self.ttfr_s = time.perf_counter() - self._t0
+            return frame.json()
+        self.summary = _response_value(frame)
+        return None
+
+    def __iter__(self):
+        while self.summary is None:
+            rows = self._handle(self._next_frame())
+            if rows is not None:
+                yield rows
+
+
+class AsyncResultStream(ResultStream):
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        while self.summary is None:
+            rows = self._handle(await self._next_frame())
+            if rows is not None:
+                yield rows
+
+
+class AsyncProtocolClient:
+    """asyncio counterpart of :class:`ProtocolClient`."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._closed: Optional[Exception] = None
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> "AsyncProtocolClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _read_loop(self):
+        err: Exception = ConnectionClosed("connection closed")
+        try:
+            while True:
+                frame = await read_frame_async(self.reader)
+                if frame is None:
+                    break
+                stream = self._streams.get(frame.request_id)
+                if stream is not None:
+                    if frame.msg_type in (MSG_END, MSG_ERROR):
+                        del self._streams[frame.request_id]
+                    stream.put_nowait(frame)
+                    continue
+                fut = self._pending.pop(frame.request_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(frame)
+        except asyncio.CancelledError:
+            err = ConnectionClosed("client closed")
+            raise
+        except Exception as e:
+            err = e
+        finally:
+            # هم خروج عادی، هم خطا و هم close(): هیچ future ی بی‌جواب نمی‌ماند
+            self._closed = err
+            pending, self._pending = self._pending, {}
+            streams, self._streams = self._streams, {}
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(err)
+            for stream in streams.values():
+                stream.put_nowait(err)
+
+    def _register(self, table: dict, value) -> int:
+        if self._closed is not None:
+            raise ConnectionClosed(f"connection closed ({self._closed!r})") from self._closed
+        rid = next(self._ids) & 0xFFFFFFFF
+        table[rid] = value
+        return rid
+
+    async def _send(self, table: dict, rid: int, *args):
+        try:
+            await write_frame_async(self.writer, *args)
+        except (ConnectionError, OSError):
+            table.pop(rid, None)
+            raise
+
+    async def _request(self, msg_type: int, payload: bytes, priority: int = 0, flags: int = 0) -> Frame:
+        fut = asyncio.get_running_loop().create_future()
+        rid = self._register(self._pending, fut)
+        await self._send(self._pending, rid, msg_type, rid, payload, priority, flags)
+        return await fut
+
+    async def query(self, sql: str, priority: int = 1, approximate: bool = False):
+        flags = FLAG_APPROX if approximate else 0
+        return _response_value(await self._request(MSG_QUERY, sql.encode("utf-8"), priority, flags))
+
+    async def maintenance(self, latency_list: list):
+        return _response_value(await self._request(MSG_MAINTENANCE, json.dumps(latency_list).encode("utf-8")))
+
+    async def stream(self, sql: str, priority: int = 1, approximate: bool = False) -> AsyncResultStream:
+        frames: asyncio.Queue = asyncio.Queue()
+        rid = self._register(self._streams, frames)
+        flags = FLAG_STREAM | (FLAG_APPROX if approximate else 0)
+        await self._send(self._streams, rid, MSG_QUERY, rid, sql.encode("utf-8"), priority, flags)
+        return AsyncResultStream(frames.get)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        self._read_task.cancel()
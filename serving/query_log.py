@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+# ---------------- Server-side stats (system.query_log) ----------------
+# متریک‌های metrics_recorder مال پروسه‌ی پایتون هستند؛ اینجا می‌بینیم خود ClickHouse چه کرد
+# (چند ردیف/بایت خواند، حافظه، projection/MV استفاده شده). هر اجرا query_id صریح می‌گیرد و
+# بعد از سناریو همه یک‌جا از system.query_log خوانده می‌شوند.
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "1") == "1"
+QUERY_LOG_WAIT_S = float(os.getenv("QUERY_LOG_WAIT_S", "10"))  # سقف انتظار برای flush شدن لاگ
+QUERY_LOG_BATCH = 500  # تعداد query_id در هر SELECT
+# زیرمجموعه‌ای از ProfileEvents که در JSON نگه می‌داریم (کل map صدها کلید دارد)
+QUERY_LOG_PROFILE_EVENTS = [e.strip() for e in os.getenv(
+    "QUERY_LOG_PROFILE_EVENTS",
+    "SelectedParts,SelectedRanges,SelectedMarks,SelectedRows,SelectedBytes,ReadCompressedBytes,"
+    "RealTimeMicroseconds,UserTimeMicroseconds,SystemTimeMicroseconds,OSReadBytes,"
+    "MarkCacheHits,MarkCacheMisses",
+).split(",") if e.strip()]
+
+_QUERY_LOG_SQL = """
+SELECT
+    query_id,
+    query_duration_ms,
+    read_rows,
+    read_bytes,
+    result_rows,
+    memory_usage,
+    ProfileEvents,
+    projections,
+    views,
+    tables
+FROM system.query_log
+WHERE type = 'QueryFinish'
+  AND event_date >= yesterday()
+  AND query_id IN {ids:Array(String)}
+"""
+
+
+def new_query_id() -> str:
+    return str(uuid.uuid4())
+
+
+def with_query_id(query_id: Optional[str], settings: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Merges ``query_id`` into per-query ``settings`` (``None`` when both are empty)."""
+    out = dict(settings or {})
+    if query_id:
+        out["query_id"] = query_id
+    return out or None
+
+
+def _row_to_stats(row: Dict[str, Any]) -> Dict[str, Any]:
+    events = row.get("ProfileEvents") or {}
+    return {
+        "query_duration_ms": int(row["query_duration_ms"]),
+        "read_rows": int(row["read_rows"]),
+        "read_bytes": int(row["read_bytes"]),
+        "result_rows": int(row["result_rows"]),
+        "memory_usage": int(row["memory_usage"]),
+        "profile_events": {k: int(events[k]) for k in QUERY_LOG_PROFILE_EVENTS if k in events},
+        "projections": list(row.get("projections") or []),
+        "views": list(row.get("views") or []),
+        "tables": list(row.get("tables") or []),
+    }
+
+
+def _fetch_from(client, query_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for i in range(0, len(query_ids), QUERY_LOG_BATCH):
+        batch = query_ids[i:i + QUERY_LOG_BATCH]
+        result = client.query(_QUERY_LOG_SQL, parameters={"ids": batch})
+        for row in result.named_results():
+            out[row["query_id"]] = _row_to_stats(row)
+    return out
+
+
+def fetch_query_log(pools, query_ids: Iterable[Optional[str]], wait_s: float = QUERY_LOG_WAIT_S
+                    ) -> Dict[str, Dict[str, Any]]:
+    """
+    ``{query_id: stats}`` for finished queries. ``pools`` is a :class:`ReplicaPoolSet`; each replica
+    has its own query_log, so every replica is asked. Missing ids (failed/killed queries) are left out.
+    """
+    wanted = sorted({q for q in query_ids if q})
+    if not QUERY_LOG_ENABLED or not wanted:
+        return {}
+    found: Dict[str, Dict[str, Any]] = {}
+    deadline = time.time() + wait_s
+    while True:
+        missing = [q for q in wanted if q not in found]
+        for name, pool in pools.pools.items():
+            if not missing:
+                break
+            try:
+                with pool.connection(timeout=2.0) as client:
+                    try:
+                        # query_log به‌طور پیش‌فرض هر 7.5 ثانیه flush می‌شود
+                        client.command("SYSTEM FLUSH LOGS")
+                    except Exception:
+                        pass  # بدون دسترسی SYSTEM: منتظر flush دوره‌ای می‌مانیم
+                    found.update(_fetch_from(client, missing))
+            except Exception as e:
+                print(f"[query_log] fetch from {name} failed: {e}")
+            missing = [q for q in wanted if q not in found]
+        if not missing or time.time() >= deadline:
+            break
+        time.sleep(1.0)
+    if len(found) < len(wanted):
+        print(f"[query_log] {len(wanted) - len(found)}/{len(wanted)} query ids not found in system.query_log")
+    return found
+
+
+def summarize_query_log(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Scenario-level view: means per query, peak memory and how often each projection/MV was used."""
+    n = len(stats)
+    if not n:
+        return {"queries": 0}
+
+    def _mean(key):
+        return sum(s[key] for s in stats) / n
+
+    events = Counter()
+    for s in stats:
+        events.update(s["profile_events"])
+    return {
+        "queries": n,
+        "avg_read_rows": _mean("read_rows"),
+        "avg_read_bytes": _mean("read_bytes"),
+        "avg_memory_usage": _mean("memory_usage"),
+        "max_memory_usage": max(s["memory_usage"] for s in stats),
+        "avg_query_duration_ms": _mean("query_duration_ms"),
+        "avg_profile_events": {k: v / n for k, v in events.items()},
+        "projections_used": dict(Counter(p for s in stats for p in s["projections"])),
+        "views_used": dict(Counter(v for s in stats for v in s["views"])),
+        "tables_used": dict(Counter(t for s in stats for t in s["tables"])),
+    }
@@ -0,0 +1,306 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from serving.admission import clickhouse_killer
+from serving.pool import (
+    ClickHousePool, ConnectFailed, PoolExhausted, make_client, CLICKHOUSE_HOST, CLICKHOUSE_PORT, POOL_MIN, POOL_MAX,
+    POOL_GROW_AFTER_WAIT_S,
+)
+
+# ---------------- Replicas ----------------
+# مثلاً "localhost:8123,localhost:8124"؛ پیش‌فرض = همان یک سرور CLICKHOUSE_HOST:CLICKHOUSE_PORT
+CLICKHOUSE_REPLICAS = os.getenv("CLICKHOUSE_REPLICAS", f"{CLICKHOUSE_HOST}:{CLICKHOUSE_PORT}")
+REPLICA_HEALTH_INTERVAL_S = float(os.getenv("REPLICA_HEALTH_INTERVAL_S", "2"))
+REPLICA_FAIL_THRESHOLD = int(os.getenv("REPLICA_FAIL_THRESHOLD", "3"))
+# سقف انتظار برای اتصال آزاد؛ خالی = بی‌نهایت (مثل یک pool تکی). پر بودن pool خطای replica نیست
+REPLICA_CHECKOUT_TIMEOUT_S = float(os.getenv("REPLICA_CHECKOUT_TIMEOUT_S") or "inf")
+# any: هر replica سالم؛ latest: فقط replica هایی که به آخرین نسخه‌ی داده‌ی ingest شده رسیده‌اند
+REPLICA_READ_CONSISTENCY = os.getenv("REPLICA_READ_CONSISTENCY", "latest")
+# هر session (اتصال کلاینت) تا وقتی replica اش واجد شرایط است روی همان می‌ماند
+REPLICA_STICKY = os.getenv("REPLICA_STICKY", "1") == "1"
+# نسخه‌ی داده: جدول فقط append می‌شود، پس تعداد ردیف‌ها یکنوا است (از metadata خوانده می‌شود)
+REPLICA_VERSION_SQL = os.getenv("REPLICA_VERSION_SQL", "SELECT count() FROM ny_taxi_trips")
+STICKY_SESSIONS_MAX = 10000
+
+
+def parse_replicas(spec: str = CLICKHOUSE_REPLICAS) -> List[Tuple[str, int]]:
+    """``"h1:8123,h2:8124"`` → ``[("h1", 8123), ("h2", 8124)]``; a missing port means ``CLICKHOUSE_PORT``."""
+    out = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, port = item.rpartition(":")
+        out.append((host, int(port)) if sep else (item, CLICKHOUSE_PORT))
+    return out
+
+
+@dataclass
+class Replica:
+    name: str
+    host: str
+    port: int
+    healthy: bool = True       # تا اولین health check خوش‌بین
+    data_version: int = -1
+    outstanding: int = 0       # درخواست‌های در حال اجرا روی این replica
+    failures: int = 0          # خطاهای پشت سر هم
+    served: int = 0
+    last_error: str = ""
+    checked_at: float = 0.0
+
+
+class ReplicaRegistry:
+    """
+    Health and data version of every replica, least-outstanding-requests picking and
+    sticky sessions. Pools live in :class:`ReplicaPoolSet`; one registry is shared by all of them.
+    """
+
+    def __init__(self, endpoints: List[Tuple[str, int]], client_factory: Callable[..., Any] = make_client):
+        self.replicas = [Replica(f"{host}:{port}", host, port) for host, port in endpoints]
+        self.client_factory = client_factory
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, str]" = OrderedDict()
+        # کلاینت‌های جدا برای health check و KILL QUERY (هم‌زمانی در یک session مجاز نیست)
+        self._health_clients: Dict[str, Any] = {}
+        self._kill_clients: Dict[str, Any] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- health checks
+    def start(self) -> "ReplicaRegistry":
+        if self._thread is None:
+            self.check_all()
+            self._thread = threading.Thread(target=self._health_loop, daemon=True, name="replica-health")
+            self._thread.start()
+        return self
+
+    def _health_loop(self):
+        while True:
+            time.sleep(REPLICA_HEALTH_INTERVAL_S)
+            self.check_all()
+
+    def _client(self, cache: Dict[str, Any], replica: Replica):
+        client = cache.get(replica.name)
+        if client is None:
+            client = self.client_factory(replica.host, replica.port, connect_timeout=2, send_receive_timeout=5)
+            cache[replica.name] = client
+        return client
+
+    def check(self, replica: Replica):
+        try:
+            version = int(self._client(self._health_clients, replica).command(REPLICA_VERSION_SQL))
+        except Exception as e:
+            self._health_clients.pop(replica.name, None)
+            with self._lock:
+                if replica.healthy:
+                    print(f"[replicas] {replica.name} unhealthy: {e}")
+                replica.healthy = False
+                replica.failures += 1
+                replica.last_error = str(e)
+                replica.checked_at = time.time()
+            return
+        with self._lock:
+            if not replica.healthy:
+                print(f"[replicas] {replica.name} healthy again (version={version})")
+            replica.healthy = True
+            replica.failures = 0
+            replica.data_version = version
+            replica.checked_at = time.time()
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def latest_version(self) -> int:
+        with self._lock:
+            return max((r.data_version for r in self.replicas if r.healthy), default=-1)
+
+    # ---- routing
+    def _eligible(self, exclude: Tuple[str, ...]) -> List[Replica]:
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            # همه down: باز هم امتحان می‌کنیم؛ health check بعدی وضعیت را اصلاح می‌کند
+            return [r for r in self.replicas if r.name not in exclude]
+        if REPLICA_READ_CONSISTENCY == "latest":
+            # آخرین نسخه روی همه‌ی replica های سالم، نه فقط آن‌هایی که کنار گذاشته نشده‌اند:
+            # replica ی به‌روزِ مشغول نباید خواندن را به replica ی عقب‌مانده بفرستد
+            latest = max(r.data_version for r in healthy)
+            healthy = [r for r in healthy if r.data_version >= latest]
+        return [r for r in healthy if r.name not in exclude]
+
+    def pick(self, session: Optional[str] = None, exclude: Tuple[str, ...] = ()) -> Optional[Replica]:
+        """Least-loaded eligible replica, or ``None`` when *exclude* leaves none."""
+        with self._lock:
+            pool = self._eligible(exclude)
+            if not pool:
+                return None
+            chosen = None
+            if REPLICA_STICKY and session is not None:
+                name = self._sessions.get(session)
+                chosen = next((r for r in pool if r.name == name), None)
+            if chosen is None:
+                low = min(r.outstanding for r in pool)
+                chosen = random.choice([r for r in pool if r.outstanding == low])
+            if REPLICA_STICKY and session is not None:
+                self._sessions[session] = chosen.name
+                self._sessions.move_to_end(session)
+                while len(self._sessions) > STICKY_SESSIONS_MAX:
+                    self._sessions.popitem(last=False)
+            chosen.outstanding += 1
+            chosen.served += 1
+            return chosen
+
+    def release(self, replica: Replica, failed: bool = False, hard: bool = False):
+        """``failed``: the client was dead after an error; ``hard``: no client could be obtained at all."""
+        with self._lock:
+            replica.outstanding -= 1
+            if not failed:
+                replica.failures = 0
+                return
+            replica.failures += 1
+            if hard or replica.failures >= REPLICA_FAIL_THRESHOLD:
+                if replica.healthy:
+                    print(f"[replicas] {replica.name} marked unhealthy after {replica.failures} failures")
+                replica.healthy = False
+
+    def unpick(self, replica: Replica):
+        """Undoes :meth:`pick` without judging the replica (its pool was only busy)."""
+        with self._lock:
+            replica.outstanding -= 1
+
+    def forget(self, session: str):
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def kill_query(self, query_id: str):
+        # replica ی اجرا کننده را ثبت نمی‌کنیم؛ KILL ... ASYNC روی بقیه بی‌اثر است
+        for replica in self.replicas:
+            if not replica.healthy:
+                continue
+            try:
+                clickhouse_killer(self._client(self._kill_clients, replica))(query_id)
+            except Exception as e:
+                self._kill_clients.pop(replica.name, None)
+                print(f"[replicas] KILL QUERY on {replica.name} failed: {e}")
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {r.name: {
+                "healthy": r.healthy,
+                "data_version": r.data_version,
+                "outstanding": r.outstanding,
+                "served": r.served,
+                "failures": r.failures,
+                "last_error": r.last_error,
+            } for r in self.replicas}
+
+
+class ReplicaPoolSet:
+    """Pool-like facade (``connection()`` / ``stats()``) over one :class:`ClickHousePool` per replica."""
+
+    def __init__(self, registry: ReplicaRegistry, name: str, min_size: int = POOL_MIN, max_size: int = POOL_MAX):
+        self.registry = registry
+        self.name = name
+        self.pools = {
+            r.name: ClickHousePool(factory=partial(registry.client_factory, r.host, r.port), min_size=min_size,
+                                   max_size=max_size, name=f"{name}@{r.name}")
+            for r in registry.replicas
+        }
+
+    def warm(self) -> "ReplicaPoolSet":
+        for replica in self.registry.replicas:
+            if replica.healthy:
+                self.pools[replica.name].warm()
+        return self
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None, session: Optional[str] = None):
+        """
+        ``with pools.connection(session=client_id) as client:`` on the least-loaded eligible replica.
+        A full pool sends the request to another replica with a free client, otherwise it waits
+        (up to *timeout*, default unbounded); only failing to connect counts against a replica.
+        """
+        timeout = REPLICA_CHECKOUT_TIMEOUT_S if timeout is None else timeout
+        deadline = time.perf_counter() + timeout
+        down: Tuple[str, ...] = ()   # اتصال باز نشد
+        busy: Tuple[str, ...] = ()   # همه‌ی اتصال‌ها مشغول
+        while True:
+            # تا وقتی replica ی امتحان‌نشده هست فقط سرک می‌کشیم؛ بعد روی کم‌بارترین منتظر می‌مانیم
+            wait = len(self.pools) - len(down) - len(busy) <= 1
+            replica = None if wait else self.registry.pick(session, exclude=down + busy)
+            if replica is None:
+                # replica ی واجد شرایطِ امتحان‌نشده نمانده (مثلاً تنها replica ی به‌روز مشغول است): منتظر می‌مانیم
+                wait = True
+                replica = self.registry.pick(session, exclude=down) or self.registry.pick(session)
+            pool = self.pools[replica.name]
+            if not wait:
+                limit = POOL_GROW_AFTER_WAIT_S  # اتصال idle یا جا برای یکی جدید
+            elif deadline == float("inf"):
+                limit = None
+            else:
+                limit = max(0.0, deadline - time.perf_counter())
+            try:
+                conn = pool.checkout(limit, fail_fast=True)
+                break
+            except PoolExhausted:
+                self.registry.unpick(replica)
+                if wait:
+                    raise
+                busy += (replica.name,)
+            except ConnectFailed:
+                # replica جواب نمی‌دهد: سراغ بعدی
+                self.registry.release(replica, failed=True, hard=True)
+                down += (replica.name,)
+                busy = tuple(name for name in busy if name != replica.name)
+                if len(down) >= len(self.pools):
+                    raise
+        broken = False
+        try:
+            yield conn.client
+        except Exception:
+            broken = True
+            raise
+        finally:
+            alive = pool.checkin(conn, broken=broken)
+            self.registry.release(replica, failed=not alive)
+
+    def stats(self) -> Dict:
+        replicas = self.registry.stats()
+        for name, pool in self.pools.items():
+            replicas[name]["pool"] = pool.stats()
+        return {
+            "read_consistency": REPLICA_READ_CONSISTENCY,
+            "sticky": REPLICA_STICKY,
+            "latest_version": self.registry.latest_version(),
+            "replicas": replicas,
+        }
+
+
+# ---------------- Process-wide registry & shared pool ----------------
+_registry: Optional[ReplicaRegistry] = None
+_shared: Optional[ReplicaPoolSet] = None
+_shared_lock = threading.Lock()
+
+
+def replica_registry() -> ReplicaRegistry:
+    global _registry
+    with _shared_lock:
+        if _registry is None:
+            _registry = ReplicaRegistry(parse_replicas()).start()
+        return _registry
+
+
+def shared_pool() -> ReplicaPoolSet:
+    """One warmed pool per replica per process, used by server1, server2 and scenario_runner."""
+    global _shared
+    registry = replica_registry()
+    with _shared_lock:
+        if _shared is None:
+            _shared = ReplicaPoolSet(registry, "clickhouse").warm()
+        return _shared
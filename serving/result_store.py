@@ -0,0 +1,49 @@
+import json
+from typing import Any, Dict, List
+
+# ---------------- Shared scenario result stores (prefork) ----------------
+# هر worker پنجره‌ی ScenarioAggregator خودش را هر چند وقت یک‌بار (ScenarioWindow.to_dict) اینجا
+# می‌گذارد؛ perform_maintenance_tasks همه را یک‌جا drain و merge می‌کند. تعداد رکوردها به زمان و
+# تعداد worker بستگی دارد نه به تعداد کوئری‌ها.
+REDIS_RESULTS_KEY = "ch:scenario:windows"
+
+
+class RedisResultStore:
+    """Redis list shared by all worker processes; ``drain`` is one MULTI/EXEC (LRANGE + DEL)."""
+
+    def __init__(self, redis_client, key: str = REDIS_RESULTS_KEY):
+        self.redis = redis_client
+        self.key = key
+
+    def append(self, record: Dict[str, Any]):
+        self.redis.rpush(self.key, json.dumps(record, ensure_ascii=False))
+
+    def drain(self) -> List[Dict[str, Any]]:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, -1)
+        pipe.delete(self.key)
+        raw, _ = pipe.execute()
+        return [json.loads(item) for item in raw]
+
+    def __len__(self):
+        return int(self.redis.llen(self.key))
+
+
+class ManagedResultStore:
+    """``multiprocessing.Manager`` list + lock for prefork without Redis (created by the supervisor)."""
+
+    def __init__(self, items, lock):
+        self._items = items
+        self._lock = lock
+
+    def append(self, record: Dict[str, Any]):
+        self._items.append(record)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._items[:])
+            del self._items[:len(items)]
+        return items
+
+    def __len__(self):
+        return len(self._items)
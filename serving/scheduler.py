@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# ---------------- Priority scheduler ----------------
+# سیاست قدیمی دیسپچر: بیشترین priority * (now - ts) برنده است.
+# در یک کلاس priority قدیمی‌ترین تسک همیشه بیشترین امتیاز را دارد، پس امتیاز کلاس = امتیاز
+# قدیمی‌ترین تسکش: O(#classes) برای انتخاب کلاس + O(log n) برای heap ها.
+# داخل هر کلاس، start-time fair queueing بین کلاینت‌ها: هر کلاینت برچسب مجازی خودش را دارد
+# و یک کلاینت پرحجم نمی‌تواند بقیه‌ی کلاینت‌های همان کلاس را گرسنه نگه دارد.
+# ترتیب خروج داخل کلاس (برچسب SFQ) با ترتیب سن یکی نیست، پس سن با یک min-heap جدا روی ts
+# دنبال می‌شود (حذف تنبل: تسک خارج‌شده فقط وقتی به سر heap سن رسید دور ریخته می‌شود).
+
+
+def parse_class_weights(spec: str) -> Dict[int, float]:
+    """``"9:20,5:5,1:0.5"`` → ``{9: 20.0, 5: 5.0, 1: 0.5}``; missing classes weigh their priority."""
+    weights: Dict[int, float] = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        prio, _, weight = part.partition(":")
+        weights[int(prio)] = float(weight)
+    return weights
+
+
+class _PriorityClass:
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.heap: List[Tuple[float, int, float, str, Any]] = []  # (tag, seq, ts, client_id, item)
+        self._ages: List[Tuple[float, int]] = []                  # (ts, seq)
+        self._popped = set()                                      # seq های خارج‌شده‌ای که هنوز در _ages اند
+        self.vtime = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._queued: Dict[str, int] = {}
+
+    def push(self, item: Any, client_id: str, ts: float, seq: int):
+        tag = max(self.vtime, self._last_tag.get(client_id, 0.0)) + 1.0
+        self._last_tag[client_id] = tag
+        self._queued[client_id] = self._queued.get(client_id, 0) + 1
+        heapq.heappush(self.heap, (tag, seq, ts, client_id, item))
+        heapq.heappush(self._ages, (ts, seq))
+
+    def oldest_ts(self) -> float:
+        while self._ages[0][1] in self._popped:
+            self._popped.discard(heapq.heappop(self._ages)[1])
+        return self._ages[0][0]
+
+    def pop(self) -> Any:
+        tag, seq, _, client_id, item = heapq.heappop(self.heap)
+        self.vtime = tag
+        if self.heap:
+            self._popped.add(seq)
+        else:
+            self._ages.clear()
+            self._popped.clear()
+        left = self._queued[client_id] - 1
+        if left:
+            self._queued[client_id] = left
+        else:
+            # کلاینت بدون تسک در صف: حالتش را نگه نمی‌داریم (حافظه ∝ کلاینت‌های فعال)
+            del self._queued[client_id]
+            del self._last_tag[client_id]
+        return item
+
+
+class FairScheduler:
+    """Non-thread-safe core: weighted priority classes with aging and per-client fairness."""
+
+    def __init__(self, class_weights: Optional[Dict[int, float]] = None):
+        self.class_weights = dict(class_weights or {})
+        self._classes: Dict[int, _PriorityClass] = {}
+        self._seq = itertools.count()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def weight(self, priority: int) -> float:
+        return self.class_weights.get(priority, float(priority))
+
+    def push(self, item: Any, client_id: str, priority: int, ts: Optional[float] = None):
+        cls = self._classes.get(priority)
+        if cls is None:
+            cls = self._classes[priority] = _PriorityClass(self.weight(priority))
+        cls.push(item, client_id, time.time() if ts is None else ts, next(self._seq))
+        self._len += 1
+
+    def pop(self, now: Optional[float] = None) -> Any:
+        if not self._len:
+            raise IndexError("pop from empty scheduler")
+        now = time.time() if now is None else now
+        best, best_score = None, None
+        for cls in self._classes.values():
+            if not cls.heap:
+                continue
+            score = cls.weight * (now - cls.oldest_ts())
+            if best_score is None or score > best_score:
+                best, best_score = cls, score
+        self._len -= 1
+        return best.pop()
+
+    def depth_by_priority(self) -> Dict[int, int]:
+        return {p: len(c.heap) for p, c in self._classes.items() if c.heap}
+
+
+class BlockingScheduler:
+    """Thread-safe wrapper; ``get`` sleeps on a Condition until work arrives."""
+
+    def __init__(self, class_weights: Optional[Dict[int, float]] = None):
+        self._core = FairScheduler(class_weights)
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._core)
+
+    def put(self, item: Any, client_id: str, priority: int, ts: Optional[float] = None):
+        with self._cond:
+            self._core.push(item, client_id, priority, ts)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._core) > 0, timeout=timeout):
+                raise TimeoutError("scheduler get timed out")
+            return self._core.pop()
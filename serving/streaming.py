@@ -0,0 +1,47 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+# ---------------- Streaming execution ----------------
+# به‌جای client.query(...) که کل نتیجه را به tuple های پایتون تبدیل می‌کند، بلوک به بلوک
+# می‌خوانیم؛ حافظه‌ی سرور ∝ اندازه‌ی یک بلوک است نه اندازه‌ی کل نتیجه.
+STREAM_BLOCK_ROWS = int(os.getenv("STREAM_BLOCK_ROWS", "10000"))
+
+
+@dataclass
+class StreamStats:
+    rows: int = 0
+    chunks: int = 0
+    bytes_sent: int = 0
+    ttfr_s: float = 0.0      # time-to-first-row
+    latency_s: float = 0.0
+
+
+def stream_query(
+    db_client,
+    sql: str,
+    on_block: Optional[Callable[[List[tuple]], Optional[int]]] = None,
+    settings: Optional[Dict[str, Any]] = None,
+) -> StreamStats:
+    """Runs *sql* block by block; *on_block* gets each block and may return bytes sent."""
+    stats = StreamStats()
+    merged = {"max_block_size": STREAM_BLOCK_ROWS, **(settings or {})}
+    t0 = time.perf_counter()
+    with db_client.query_row_block_stream(sql, settings=merged) as stream:
+        for block in stream:
+            if stats.chunks == 0:
+                stats.ttfr_s = time.perf_counter() - t0
+            stats.rows += len(block)
+            stats.chunks += 1
+            if on_block is not None:
+                stats.bytes_sent += on_block(block) or 0
+    stats.latency_s = time.perf_counter() - t0
+    if stats.chunks == 0:
+        stats.ttfr_s = stats.latency_s  # نتیجه‌ی خالی: اولین «پاسخ» همان پایان است
+    return stats
+
+
+def count_rows_streaming(db_client, sql: str, settings: Optional[Dict[str, Any]] = None) -> StreamStats:
+    """Row count + TTFR without materializing the result."""
+    return stream_query(db_client, sql, settings=settings)
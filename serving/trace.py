@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from query_scenarios.sql_fingerprint import fill_template, literal_template, shape_fingerprint
+
+# ---------------- Query trace capture ----------------
+# هر درخواست ورودی server2 یک خط JSON در یک فایل فشرده: زمان، اتصال، اولویت، fingerprint و پارامترها.
+# متن SQL همان متن ارسالی کلاینت است (نه متن کانونیکال) با literal ها بیرون کشیده: قالب فقط بار اولِ
+# هر قالب در همان فایل نوشته می‌شود و بازپخش دقیقاً همان SQL را می‌فرستد. shape fingerprint فقط
+# کلید گروه‌بندی است (چند قالب با املای متفاوت می‌توانند یک fingerprint داشته باشند).
+# مسیر درخواست فقط put_nowait می‌کند؛ قالب، شماره‌گذاری اتصال‌ها و نوشتن در thread پس‌زمینه است.
+# هر پروسه (worker های prefork) فایل خودش را دارد: <TRACE_DIR>/<timestamp>_<pid>.jsonl
+#   {"k":"s","s":tid,"sql":["SELECT ... WHERE d = ", ""]}    قالب جدید (متن بین literal ها)
+#   {"k":"c","c":3,"t":ts,"peer":"10.0.0.5"}                  اتصال جدید (c = شماره‌ی اتصال در فایل)
+#   {"k":"q","c":3,"t":ts,"p":5,"s":tid,"f":fp,"a":["'2020-01-01'"],"fl":2}   کوئری (a/fl فقط اگر خالی نباشند)
+#   {"k":"m","c":3,"t":ts}                                   پیام پایان سناریو
+#   {"k":"x","c":3,"t":ts}                                   بسته شدن اتصال
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0") == "1"
+TRACE_DIR = os.getenv("TRACE_DIR", str(Path(__file__).resolve().parent.parent / "results" / "traces"))
+TRACE_QUEUE = int(os.getenv("TRACE_QUEUE", "100000"))
+TRACE_FLUSH_S = 1.0
+
+KIND_TEMPLATE, KIND_CONNECT, KIND_QUERY, KIND_MAINTENANCE, KIND_CLOSE = "s", "c", "q", "m", "x"
+
+
+def template_id(parts) -> str:
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class TraceWriter:
+    """Non-blocking trace capture; rows beyond ``TRACE_QUEUE`` pending are dropped and counted."""
+
+    def __init__(self, trace_dir: str = TRACE_DIR, enabled: bool = TRACE_ENABLED):
+        self.trace_dir = Path(trace_dir)
+        self.enabled = enabled
+        self.dropped = 0
+        self.path: Optional[Path] = None
+        self._q: "queue.Queue[tuple]" = queue.Queue(maxsize=TRACE_QUEUE)
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # فایل و thread بعد از fork در هر worker جدا ساخته می‌شوند
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.trace_dir.mkdir(parents=True, exist_ok=True)
+                self.path = self.trace_dir / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl"
+                threading.Thread(target=self._run, args=(self.path,), daemon=True, name="trace").start()
+                self._pid = os.getpid()
+                print(f"[trace] capturing to {self.path}")
+
+    def _put(self, item: tuple):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def connect(self, client_id: str, peer: Any = None):
+        host = peer[0] if isinstance(peer, (tuple, list)) and peer else peer
+        self._put((KIND_CONNECT, client_id, time.time(), str(host) if host is not None else None))
+
+    def query(self, client_id: str, sql: str, priority: int, flags: int = 0, ts: Optional[float] = None):
+        self._put((KIND_QUERY, client_id, time.time() if ts is None else ts, sql, priority, flags))
+
+    def maintenance(self, client_id: str):
+        self._put((KIND_MAINTENANCE, client_id, time.time()))
+
+    def close(self, client_id: str):
+        self._put((KIND_CLOSE, client_id, time.time()))
+
+    def _run(self, path: Path):
+        conns: Dict[str, int] = {}
+        templates = set()
+        next_conn = 0
+        with open(path, "a", encoding="utf-8") as f:
+            while True:
+                batch = [self._q.get()]
+                time.sleep(TRACE_FLUSH_S)
+                while True:
+                    try:
+                        batch.append(self._q.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                for item in batch:
+                    kind, client_id, ts = item[0], item[1], round(item[2], 6)
+                    c = conns.get(client_id)
+                    if c is None:
+                        # اتصالی که connect اش قبلاً (مثلاً با صف پر) از دست رفته، همین‌جا شماره می‌گیرد
+                        c = conns[client_id] = next_conn
+                        next_conn += 1
+                        if kind != KIND_CONNECT:
+                            lines.append({"k": KIND_CONNECT, "c": c, "t": ts, "peer": None})
+                    if kind == KIND_CONNECT:
+                        lines.append({"k": kind, "c": c, "t": ts, "peer": item[3]})
+                    elif kind == KIND_QUERY:
+                        sql, priority, flags = item[3], item[4], item[5]
+                        parts, params = literal_template(sql)
+                        tid = template_id(parts)
+                        try:
+                            fp = shape_fingerprint(sql)
+                        except Exception:
+                            # SQL نامعتبر هم بخشی از ترافیک است؛ گروه خودش را دارد
+                            fp = "raw:" + tid
+                        if tid not in templates:
+                            templates.add(tid)
+                            lines.append({"k": KIND_TEMPLATE, "s": tid, "sql": list(parts)})
+                        row = {"k": kind, "c": c, "t": ts, "p": priority, "s": tid, "f": fp}
+                        if params:
+                            row["a"] = list(params)
+                        if flags:
+                            row["fl"] = flags
+                        lines.append(row)
+                    else:
+                        lines.append({"k": kind, "c": c, "t": ts})
+                        if kind == KIND_CLOSE:
+                            conns.pop(client_id, None)
+                for row in lines:
+                    f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+
+
+# ---------------- Reading ----------------
+def read_trace(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Events of one or more trace files sorted by time: ``{"t", "conn", "kind", "sql", "priority",
+    "flags", "fingerprint"}``. ``conn`` is ``"<file index>:<c>"`` so connections of different workers stay apart.
+    """
+    events = []
+    for idx, path in enumerate(paths):
+        templates: Dict[str, List[str]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # خط نیمه‌کاره‌ی آخر (پروسه وسط نوشتن کشته شده)
+                kind = row["k"]
+                if kind == KIND_TEMPLATE:
+                    templates[row["s"]] = row["sql"]
+                    continue
+                ev = {"t": row["t"], "conn": f"{idx}:{row['c']}", "kind": kind}
+                if kind == KIND_QUERY:
+                    ev.update(sql=fill_template(templates[row["s"]], row.get("a", ())), priority=row.get("p", 1),
+                              flags=row.get("fl", 0), fingerprint=row["f"])
+                events.append(ev)
+    events.sort(key=lambda e: e["t"])
+    return events
+